@@ -0,0 +1,76 @@
+from hashlib import sha256
+from os import urandom
+from time import perf_counter
+from tracemalloc import get_traced_memory
+from tracemalloc import start
+from tracemalloc import stop
+
+from msgpack import packb
+
+from opwen_email_server.utils.unique import new_canonical_email_id
+from opwen_email_server.utils.unique import new_email_id
+
+MEGABYTE = 1024 * 1024
+NUM_ROUNDS = 5
+
+
+def legacy_new_email_id(email: dict) -> str:
+    return sha256(packb(email, use_bin_type=True) + b'\n').hexdigest()
+
+
+def generate_email(attachment_megabytes: int) -> dict:
+    attachments = [{
+        'filename': f'photo{index}.jpg',
+        'content': urandom(MEGABYTE),
+        'cid': None,
+    } for index in range(attachment_megabytes)]
+
+    return {
+        'to': ['someone@lokole.ca'],
+        'cc': ['friend@gmail.com', 'other@gmail.com'],
+        'bcc': [],
+        'from': 'sender@example.com',
+        'subject': 'Photos from the trip',
+        'body': '<p>Here are the photos.</p>' * 2000,
+        'sent_at': '2019-11-25 10:30',
+        'attachments': attachments,
+    }
+
+
+def measure(func, email):
+    best_seconds = float('inf')
+    for _ in range(NUM_ROUNDS):
+        started = perf_counter()
+        func(email)
+        best_seconds = min(best_seconds, perf_counter() - started)
+
+    start()
+    try:
+        baseline, _ = get_traced_memory()
+        func(email)
+        _, peak = get_traced_memory()
+    finally:
+        stop()
+
+    return (peak - baseline) / MEGABYTE, best_seconds
+
+
+def main():
+    for attachment_megabytes in (1, 10, 25):
+        email = generate_email(attachment_megabytes)
+
+        assert new_email_id(email) == legacy_new_email_id(email)
+
+        results = [
+            ('legacy', measure(legacy_new_email_id, email)),
+            ('compatible', measure(new_email_id, email)),
+            ('canonical', measure(new_canonical_email_id, email)),
+        ]
+
+        print(f'hashing an email with {attachment_megabytes} MB of attachments, best of {NUM_ROUNDS} rounds')
+        for name, (peak, seconds) in results:
+            print(f'{name:>10}: {peak:8.1f} MB peak above baseline, {seconds * 1000:7.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
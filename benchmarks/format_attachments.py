@@ -0,0 +1,85 @@
+from copy import deepcopy
+from io import BytesIO
+from os import urandom
+from time import perf_counter
+from tracemalloc import get_traced_memory
+from tracemalloc import start
+from tracemalloc import stop
+
+from PIL import Image
+
+from opwen_email_server.utils.email_parser import _format_attachment
+from opwen_email_server.utils.email_parser import format_attachments
+
+MEGABYTE = 1024 * 1024
+
+
+def generate_image(size, image_format) -> bytes:
+    image_bytes = BytesIO()
+    Image.effect_noise(size, 64).convert('RGB').save(image_bytes, image_format)
+    return image_bytes.getvalue()
+
+
+def legacy_format_attachments(email: dict) -> dict:
+    attachments = email.get('attachments', [])
+
+    formatted_attachments = deepcopy(attachments)
+    is_any_attachment_changed = False
+
+    for i, attachment in enumerate(attachments):
+        content = attachment.get('content', b'')
+        formatted_content = _format_attachment(attachment.get('filename', ''), content)
+
+        if content != formatted_content:
+            formatted_attachments[i]['content'] = formatted_content
+            is_any_attachment_changed = True
+
+    if not is_any_attachment_changed:
+        return email
+
+    new_email = dict(email)
+    new_email['attachments'] = formatted_attachments
+    return new_email
+
+
+def measure(func, *args):
+    start()
+    try:
+        started = perf_counter()
+        baseline, _ = get_traced_memory()
+        func(*args)
+        _, peak = get_traced_memory()
+        seconds = perf_counter() - started
+    finally:
+        stop()
+    return (peak - baseline) / MEGABYTE, seconds
+
+
+def generate_email(payload_type) -> dict:
+    return {
+        'attachments': [
+            {'filename': 'report.pdf', 'content': payload_type(urandom(12 * MEGABYTE))},
+            {'filename': 'archive.zip', 'content': payload_type(urandom(10 * MEGABYTE))},
+            {'filename': 'photo.jpg', 'content': generate_image((3000, 2000), 'JPEG')},
+            {'filename': 'logo.png', 'content': generate_image((120, 40), 'PNG')},
+        ],
+    }
+
+
+def main():
+    for payload_type in (bytes, bytearray):
+        email = generate_email(payload_type)
+        size_mb = sum(len(attachment['content']) for attachment in email['attachments']) / MEGABYTE
+
+        results = [
+            ('legacy', measure(legacy_format_attachments, email)),
+            ('current', measure(format_attachments, email)),
+        ]
+
+        print(f'formatting attachments of a {size_mb:.0f} MB email with {payload_type.__name__} payloads')
+        for name, (peak, seconds) in results:
+            print(f'{name:>10}: {peak:8.1f} MB peak above baseline, {seconds:6.2f} s')
+
+
+if __name__ == '__main__':
+    main()
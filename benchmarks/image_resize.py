@@ -0,0 +1,80 @@
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from time import perf_counter
+
+from PIL import Image
+
+from opwen_email_server.config import MAX_HEIGHT_IMAGES
+from opwen_email_server.config import MAX_WIDTH_IMAGES
+from opwen_email_server.utils.email_parser import _resize_image
+
+CORPUS = [
+    ((4032, 3024), 'JPEG'),
+    ((3264, 2448), 'JPEG'),
+    ((1920, 1080), 'JPEG'),
+    ((800, 600), 'JPEG'),
+    ((2000, 2000), 'PNG'),
+    ((1200, 800), 'PNG'),
+    ((640, 480), 'PNG'),
+    ((150, 150), 'PNG'),
+]
+
+
+def generate_image(size, image_format) -> bytes:
+    bands = [
+        Image.linear_gradient('L').resize(size),
+        Image.effect_noise(size, 64),
+        Image.radial_gradient('L').resize(size),
+    ]
+    image_bytes = BytesIO()
+    Image.merge('RGB', bands).save(image_bytes, image_format)
+    return image_bytes.getvalue()
+
+
+def legacy_resize_image(image_content_bytes: bytes) -> bytes:
+    image = Image.open(BytesIO(image_content_bytes))
+    width, height = image.size
+    if width <= MAX_WIDTH_IMAGES and height <= MAX_HEIGHT_IMAGES:
+        return image_content_bytes
+
+    ratio = min(MAX_WIDTH_IMAGES / width, MAX_HEIGHT_IMAGES / height)
+    image_format = image.format
+    image = image.resize((max(1, int(width * ratio)), max(1, int(height * ratio))), Image.LANCZOS)
+    new_image = BytesIO()
+    image.save(new_image, image_format)
+    return new_image.getvalue()
+
+
+def measure_seconds(func, *args) -> float:
+    start = perf_counter()
+    func(*args)
+    return perf_counter() - start
+
+
+def resize_serially(resize, corpus):
+    for content in corpus:
+        resize(content)
+
+
+def resize_in_pool(pool, corpus):
+    list(pool.map(_resize_image, corpus))
+
+
+def main(rounds: int = 3):
+    corpus = [generate_image(size, image_format) for size, image_format in CORPUS] * rounds
+
+    with ProcessPoolExecutor(max_workers=4) as pool:
+        resize_in_pool(pool, corpus[:4])
+        results = [
+            ('full decode', measure_seconds(resize_serially, legacy_resize_image, corpus)),
+            ('reduced decode', measure_seconds(resize_serially, _resize_image, corpus)),
+            ('process pool', measure_seconds(resize_in_pool, pool, corpus)),
+        ]
+
+    print(f'seconds to resize {len(corpus)} mixed JPEG and PNG images')
+    for name, seconds in results:
+        print(f'{name:>15}: {seconds:8.2f} s')
+
+
+if __name__ == '__main__':
+    main()
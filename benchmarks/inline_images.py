@@ -0,0 +1,98 @@
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from os.path import abspath
+from os.path import dirname
+from os.path import join
+from threading import Thread
+from time import perf_counter
+from time import sleep
+from typing import Optional
+
+from bs4 import BeautifulSoup
+from requests import get as http_get
+
+from opwen_email_server.utils import email_parser
+from opwen_email_server.utils.serialization import to_base64
+
+TEST_IMAGE = abspath(
+    join(dirname(__file__), '..', 'tests', 'files', 'opwen_email_server', 'utils', 'test_email_parser', 'large.png'))
+
+
+class ImageHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    latency_seconds = 0.05
+
+    with open(TEST_IMAGE, 'rb') as fobj:
+        image = fobj.read()
+
+    def do_GET(self):
+        sleep(self.latency_seconds)
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/png')
+        self.send_header('Content-Length', str(len(self.image)))
+        self.end_headers()
+        self.wfile.write(self.image)
+
+    def log_message(self, *args):
+        pass
+
+
+def legacy_fetch_image_to_base64(image_url: str) -> Optional[str]:
+    response = http_get(image_url)
+    if not response.ok:
+        return None
+
+    image_type = email_parser._get_image_type(response, image_url)
+    if not image_type:
+        return None
+
+    small_image_bytes = email_parser._change_image_size(response.content)
+    return f'data:{image_type};base64,{to_base64(small_image_bytes)}'
+
+
+def legacy_format_inline_images(email: dict) -> dict:
+    soup = BeautifulSoup(email['body'], 'html.parser')
+    for image_tag in soup.find_all('img'):
+        encoded_image = legacy_fetch_image_to_base64(image_tag['src'])
+        if encoded_image:
+            image_tag['src'] = encoded_image
+
+    new_email = dict(email)
+    new_email['body'] = str(soup)
+    return new_email
+
+
+def current_format_inline_images(email: dict) -> dict:
+    return email_parser.format_inline_images(email, print)
+
+
+def measure_seconds(func, *args) -> float:
+    start = perf_counter()
+    func(*args)
+    return perf_counter() - start
+
+
+def main(num_images: int = 30):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), ImageHandler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    port = server.server_address[1]
+
+    hosts = ('127.0.0.1', 'localhost')
+    image_tags = (f'<img src="http://{hosts[i % len(hosts)]}:{port}/{i}.png"/>' for i in range(num_images))
+    email = {'body': f'<div>{"".join(image_tags)}</div>'}
+
+    try:
+        results = [
+            ('legacy', measure_seconds(legacy_format_inline_images, email)),
+            ('current', measure_seconds(current_format_inline_images, email)),
+        ]
+    finally:
+        server.shutdown()
+
+    print(f'seconds to inline {num_images} images with {ImageHandler.latency_seconds * 1000:.0f} ms latency')
+    for name, seconds in results:
+        print(f'{name:>10}: {seconds:8.2f} s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+from json import JSONDecodeError
+from json import dumps
+from json import loads
+from os import urandom
+from random import Random
+from time import perf_counter
+from typing import Optional
+from unittest.mock import patch
+
+from opwen_email_server.utils import serialization
+from opwen_email_server.utils.serialization import to_base64
+
+NUM_EMAILS = 2000
+NUM_ROUNDS = 5
+
+
+def legacy_to_jsonl_bytes(obj) -> bytes:
+    return dumps(obj, separators=(',', ':')).encode('utf-8') + b'\n'
+
+
+def legacy_from_jsonl_bytes(obj: bytes) -> Optional[dict]:
+    try:
+        decoded = obj.decode('utf-8')
+    except UnicodeDecodeError:
+        return None
+    decoded = decoded.rstrip(',\n')
+    try:
+        return loads(decoded)
+    except JSONDecodeError:
+        return None
+
+
+def generate_email(random: Random, index: int) -> dict:
+    words = ['lorem', 'ipsum', 'dolor', 'sit', 'amet', 'habari', 'bonjour', 'mbote', 'ça', 'va', 'ndiyo']
+    paragraphs = [' '.join(random.choice(words) for _ in range(random.randint(20, 120))) for _ in range(5)]
+    email = {
+        '_uid': f'{index:032x}',
+        'sent_at': '2019-11-25 10:30',
+        'to': [f'user{random.randint(0, 999)}@lokole.ca' for _ in range(random.randint(1, 3))],
+        'cc': [f'friend{random.randint(0, 999)}@gmail.com' for _ in range(random.randint(0, 2))],
+        'bcc': [],
+        'from': f'sender{index}@example.com',
+        'subject': ' '.join(random.choice(words) for _ in range(8)),
+        'body': ''.join(f'<p>{paragraph}</p>' for paragraph in paragraphs),
+        'attachments': [],
+    }
+    if index % 5 == 0:
+        email['attachments'].append({
+            'filename': 'photo.jpg',
+            'content': to_base64(urandom(random.randint(4096, 65536))),
+            'cid': f'image{index}',
+        })
+    return email
+
+
+def measure(encode, decode, emails):
+    best_encode = best_decode = float('inf')
+    for _ in range(NUM_ROUNDS):
+        started = perf_counter()
+        lines = [encode(email) for email in emails]
+        best_encode = min(best_encode, perf_counter() - started)
+
+        started = perf_counter()
+        decoded = [decode(line) for line in lines]
+        best_decode = min(best_decode, perf_counter() - started)
+
+        assert decoded == emails
+    return sum(len(line) for line in lines), best_encode, best_decode
+
+
+def main():
+    random = Random(42)
+    emails = [generate_email(random, index) for index in range(NUM_EMAILS)]
+
+    results = [('legacy', measure(legacy_to_jsonl_bytes, legacy_from_jsonl_bytes, emails))]
+    for backend in sorted(serialization.JSON_BACKENDS):
+        dump, load = serialization._JSON_BACKENDS[backend]
+        with patch.multiple(serialization, _dump_json=dump, _load_json=load):
+            results.append((backend, measure(serialization.to_jsonl_bytes, serialization.from_jsonl_bytes, emails)))
+
+    print(f'serializing {NUM_EMAILS} emails, best of {NUM_ROUNDS} rounds')
+    print(f'default backend: {serialization.JSON_BACKEND}')
+    for name, (num_bytes, encode_seconds, decode_seconds) in results:
+        print(f'{name:>10}: {num_bytes / 1024 / 1024:6.1f} MB, '
+              f'encode {encode_seconds * 1000:7.1f} ms, decode {decode_seconds * 1000:7.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
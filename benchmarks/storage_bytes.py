@@ -0,0 +1,76 @@
+from gzip import GzipFile
+from io import BytesIO
+from os import mkdir
+from os import urandom
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
+from tracemalloc import get_traced_memory
+from tracemalloc import start
+from tracemalloc import stop
+
+from opwen_email_server.services.storage import AzureTextStorage
+
+MEGABYTE = 1024 * 1024
+
+
+def legacy_store_bytes(storage: AzureTextStorage, resource_id: str, content: bytes):
+    compressed = BytesIO()
+    with GzipFile(fileobj=compressed, mode='wb') as fobj:
+        fobj.write(content)
+    compressed.seek(0)
+    upload = BytesIO()
+    upload.write(compressed.read())
+    upload.seek(0)
+    storage._client.upload_object_via_stream(upload, storage._to_filename(resource_id))
+
+
+def legacy_fetch_bytes(storage: AzureTextStorage, resource_id: str) -> bytes:
+    download = BytesIO()
+    resource = storage._client.get_object(storage._to_filename(resource_id))
+    for chunk in resource.as_stream():
+        download.write(chunk)
+    download.seek(0)
+    stream = BytesIO()
+    stream.write(download.read())
+    stream.seek(0)
+    with GzipFile(fileobj=stream, mode='rb') as fobj:
+        return fobj.read()
+
+
+def measure_peak(func, *args) -> float:
+    start()
+    try:
+        baseline, _ = get_traced_memory()
+        func(*args)
+        _, peak = get_traced_memory()
+    finally:
+        stop()
+    return (peak - baseline) / MEGABYTE
+
+
+def main(size_mb: int = 20):
+    folder = mkdtemp()
+    mkdir(join(folder, 'container'))
+    storage = AzureTextStorage(account=folder, key='unused', container='container', provider='LOCAL')
+    storage.ensure_exists()
+
+    content = urandom(size_mb * MEGABYTE // 2) + b'lokole' * (size_mb * MEGABYTE // 12)
+
+    try:
+        results = [
+            ('store legacy', measure_peak(legacy_store_bytes, storage, 'legacy', content)),
+            ('store current', measure_peak(storage.store_bytes, 'current', content)),
+            ('fetch legacy', measure_peak(legacy_fetch_bytes, storage, 'legacy')),
+            ('fetch current', measure_peak(storage.fetch_bytes, 'current')),
+        ]
+    finally:
+        rmtree(folder)
+
+    print(f'peak memory above baseline for a {size_mb} MB payload')
+    for name, peak in results:
+        print(f'{name:>15}: {peak:8.1f} MB')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,13 @@
 from abc import ABC
 from hashlib import sha256
+from itertools import chain
+from itertools import islice
+from time import time_ns
 from typing import Callable
 from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import Optional
 from typing import Tuple
 from typing import Union
 
@@ -11,10 +17,17 @@ from opwen_email_server.constants import events
 from opwen_email_server.constants import mailbox
 from opwen_email_server.constants import sync
 from opwen_email_server.services.auth import AzureAuth
+from opwen_email_server.services.pending import NO_PENDING
+from opwen_email_server.services.pending import PendingIndex
+from opwen_email_server.services.pending import PendingStats
+from opwen_email_server.services.pending import split_bytes
 from opwen_email_server.services.sendgrid import SendSendgridEmail
+from opwen_email_server.services.storage import AzureAttachmentStorage
+from opwen_email_server.services.storage import AzureDictionaryStorage
 from opwen_email_server.services.storage import AzureObjectsStorage
 from opwen_email_server.services.storage import AzureObjectStorage
 from opwen_email_server.services.storage import AzureTextStorage
+from opwen_email_server.utils.compression import train_dictionary
 from opwen_email_server.utils.email_parser import MimeEmailParser
 from opwen_email_server.utils.email_parser import get_domain
 from opwen_email_server.utils.email_parser import get_domains
@@ -22,8 +35,11 @@ from opwen_email_server.utils.email_parser import get_recipients
 from opwen_email_server.utils.log import LogMixin
 from opwen_email_server.utils.serialization import from_base64
 from opwen_email_server.utils.serialization import from_jsonl_bytes
+from opwen_email_server.utils.serialization import from_msgpack_frame
+from opwen_email_server.utils.serialization import read_frames
 from opwen_email_server.utils.serialization import to_base64
 from opwen_email_server.utils.serialization import to_jsonl_bytes
+from opwen_email_server.utils.serialization import to_msgpack_frame
 from opwen_email_server.utils.string import is_lowercase
 from opwen_email_server.utils.unique import new_client_id
 from opwen_email_server.utils.unique import new_email_id
@@ -50,13 +66,19 @@ class Ping(_Action):
 
 
 class SendOutboundEmails(_Action):
-    def __init__(self, email_storage: AzureObjectStorage, send_email: SendSendgridEmail):
+    def __init__(self,
+                 email_storage: AzureObjectStorage,
+                 send_email: SendSendgridEmail,
+                 attachment_storage: Optional[AzureAttachmentStorage] = None):
 
         self._email_storage = email_storage
         self._send_email = send_email
+        self._attachment_storage = attachment_storage
 
     def _action(self, resource_id):  # type: ignore
         email = self._email_storage.fetch_object(resource_id)
+        if self._attachment_storage:
+            email = self._attachment_storage.fetch_attachments(email)
 
         success = self._send_email(email)
         if not success:
@@ -66,45 +88,108 @@ class SendOutboundEmails(_Action):
         return 'OK', 200
 
 
+class SendOutboundEmailBatch(_Action):
+    def __init__(self,
+                 email_storage: AzureObjectStorage,
+                 send_emails: Callable[[List[dict]], List[bool]],
+                 attachment_storage: Optional[AzureAttachmentStorage] = None):
+
+        self._email_storage = email_storage
+        self._send_emails = send_emails
+        self._attachment_storage = attachment_storage
+
+    def _action(self, resource_ids):  # type: ignore
+        emails = list(self._email_storage.fetch_objects_many(resource_ids))
+        if self._attachment_storage:
+            emails = [self._attachment_storage.fetch_attachments(email) for email in emails]
+
+        num_failed = 0
+        for resource_id, email, success in zip(resource_ids, emails, self._send_emails(emails)):
+            if not success:
+                self.log_warning('Unable to send email %s', resource_id)
+                num_failed += 1
+                continue
+
+            self.log_event(events.EMAIL_DELIVERED_FROM_CLIENT, {'domain': get_domain(email.get('from', ''))})  # noqa: E501  # yapf: disable
+
+        if num_failed:
+            return f'error sending {num_failed} of {len(emails)} emails', 500
+
+        return 'OK', 200
+
+
 class StoreInboundEmails(_Action):
     def __init__(self,
                  raw_email_storage: AzureTextStorage,
                  email_storage: AzureObjectStorage,
-                 pending_factory: Callable[[str], AzureTextStorage],
+                 pending_index: PendingIndex,
                  next_task: Callable[[str], None],
-                 email_parser: Callable[[str], dict] = None):
+                 email_parser: Callable[[str], dict] = None,
+                 attachment_storage: Optional[AzureAttachmentStorage] = None,
+                 stream_parser: Optional[Callable[[Iterable[bytes]], dict]] = None,
+                 email_id_source: Callable[[dict], str] = None):
 
         self._raw_email_storage = raw_email_storage
         self._email_storage = email_storage
-        self._pending_factory = pending_factory
+        self._pending_index = pending_index
         self._next_task = next_task
         self._email_parser = email_parser or MimeEmailParser()
+        self._attachment_storage = attachment_storage
+        self._stream_parser = stream_parser
+        self._email_id_source = email_id_source or new_email_id
 
     def _action(self, resource_id):  # type: ignore
+        if self._stream_parser is not None:
+            return self._store_streamed(resource_id, self._stream_parser)
+
+        try:
+            mime_bytes = self._raw_email_storage.fetch_bytes(resource_id)
+        except ObjectDoesNotExistError:
+            self.log_warning('Inbound email %s does not exist', resource_id)
+            return 'skipped', 202
+
+        email = self._email_parser(mime_bytes.decode('utf-8'))
+        return self._store_parsed(resource_id, email, len(mime_bytes))
+
+    def _store_streamed(self, resource_id: str, stream_parser: Callable[[Iterable[bytes]], dict]) -> Response:
         try:
-            mime_email = self._raw_email_storage.fetch_text(resource_id)
+            chunks = self._raw_email_storage.fetch_chunks(resource_id)
         except ObjectDoesNotExistError:
             self.log_warning('Inbound email %s does not exist', resource_id)
             return 'skipped', 202
 
-        email = self._email_parser(mime_email)
-        email_id = self._store_inbound_email(email)
+        num_bytes = 0
 
-        self._raw_email_storage.delete(resource_id)
+        def count_bytes() -> Iterator[bytes]:
+            nonlocal num_bytes
+            for chunk in chunks:
+                num_bytes += len(chunk)
+                yield chunk
+
+        email = stream_parser(count_bytes())
+        return self._store_parsed(resource_id, email, num_bytes)
+
+    def _store_parsed(self, resource_id: str, email: dict, num_bytes: int) -> Response:
+        email_id = self._store_inbound_email(email, num_bytes)
+
+        self._raw_email_storage.delete_many((resource_id, ))
         self._next_task(email_id)
 
         self.log_event(events.EMAIL_STORED_FOR_CLIENT, {'domain': get_domain(email.get('from') or '')})  # noqa: E501  # yapf: disable
         return 'OK', 200
 
-    def _store_inbound_email(self, email: dict) -> str:
-        email_id = new_email_id(email)
+    def _store_inbound_email(self, email: dict, num_bytes: int) -> str:
+        email_id = self._email_id_source(email)
         email['_uid'] = email_id
 
+        if self._attachment_storage:
+            email = self._attachment_storage.store_attachments(email)
+
         self._email_storage.store_object(email_id, email)
 
-        for domain in get_domains(email):
-            pending_storage = self._pending_factory(domain)
-            pending_storage.store_text(email_id, 'pending')
+        domains = sorted(get_domains(email))
+        for index, domain in enumerate(domains):
+            self._pending_index.append(domain, (email_id, ), split_bytes(num_bytes, len(domains), index))
 
         return email_id
 
@@ -153,21 +238,31 @@ class IndexSentEmailForMailbox(_IndexEmailForMailbox):
 
 
 class StoreWrittenClientEmails(_Action):
-    def __init__(self, client_storage: AzureObjectsStorage, email_storage: AzureObjectStorage,
-                 next_task: Callable[[str], None]):
+    def __init__(self,
+                 client_storage: AzureObjectsStorage,
+                 email_storage: AzureObjectStorage,
+                 next_task: Callable[[str], None],
+                 attachment_storage: Optional[AzureAttachmentStorage] = None):
 
         self._client_storage = client_storage
         self._email_storage = email_storage
         self._next_task = next_task
+        self._attachment_storage = attachment_storage
 
     def _action(self, resource_id):  # type: ignore
-        emails = self._client_storage.fetch_objects(resource_id, (sync.EMAILS_FILE, from_jsonl_bytes))
+        emails = self._client_storage.fetch_objects(
+            resource_id,
+            (sync.EMAILS_FILE, from_jsonl_bytes),
+            (sync.EMAILS_FRAMES_FILE, from_msgpack_frame, read_frames),
+        )
 
         domain = ''
         num_stored = 0
         for email in emails:
             email_id = email['_uid']
             email = self._decode_attachments(email)
+            if self._attachment_storage:
+                email = self._attachment_storage.store_attachments(email)
             self._email_storage.store_object(email_id, email)
 
             self._next_task(email_id)
@@ -175,7 +270,7 @@ class StoreWrittenClientEmails(_Action):
             num_stored += 1
             domain = get_domain(email.get('from', ''))
 
-        self._client_storage.delete(resource_id)
+        self._client_storage.delete_many((resource_id, ))
 
         self.log_event(events.EMAIL_STORED_FROM_CLIENT, {'domain': domain, 'num_emails': num_stored})  # noqa: E501  # yapf: disable
         return 'OK', 200
@@ -186,7 +281,8 @@ class StoreWrittenClientEmails(_Action):
             return email
 
         for attachment in email['attachments']:
-            attachment['content'] = from_base64(attachment['content'])
+            if isinstance(attachment['content'], str):
+                attachment['content'] = from_base64(attachment['content'])
 
         return email
 
@@ -219,15 +315,27 @@ class ReceiveInboundEmail(_Action):
 
 
 class DownloadClientEmails(_Action):
-    def __init__(self, auth: AzureAuth, client_storage: AzureObjectsStorage, email_storage: AzureObjectStorage,
-                 pending_factory: Callable[[str], AzureTextStorage]):
+    _package_formats = {
+        sync.PACKAGE_FORMAT_V1: (sync.EMAILS_FILE, to_jsonl_bytes),
+        sync.PACKAGE_FORMAT_V2: (sync.EMAILS_FRAMES_FILE, to_msgpack_frame),
+    }
+
+    def __init__(self,
+                 auth: AzureAuth,
+                 client_storage: AzureObjectsStorage,
+                 email_storage: AzureObjectStorage,
+                 pending_index: PendingIndex,
+                 attachment_storage: Optional[AzureAttachmentStorage] = None,
+                 pending_factory: Optional[Callable[[str], AzureTextStorage]] = None):
 
         self._auth = auth
         self._client_storage = client_storage
         self._email_storage = email_storage
+        self._pending_index = pending_index
+        self._attachment_storage = attachment_storage
         self._pending_factory = pending_factory
 
-    def _action(self, client_id, compression):  # type: ignore
+    def _action(self, client_id, compression, format=sync.PACKAGE_FORMAT_V1):  # type: ignore
         domain = self._auth.domain_for(client_id)
         if not domain:
             self.log_event(events.UNREGISTERED_CLIENT, {'client_id': client_id})  # noqa: E501  # yapf: disable
@@ -237,30 +345,45 @@ class DownloadClientEmails(_Action):
             self.log_event(events.UNKNOWN_COMPRESSION_FORMAT, {'client_id': client_id})  # noqa: E501  # yapf: disable
             return f'unknown compression format "{compression}"', 400
 
+        if format not in self._package_formats:
+            self.log_event(events.UNKNOWN_PACKAGE_FORMAT, {'client_id': client_id})  # noqa: E501  # yapf: disable
+            return f'unknown package format "{format}"', 400
+
+        name, encoder = self._package_formats[format]
+
         delivered = set()
 
         def mark_delivered(email: dict) -> dict:
             delivered.add(email['_uid'])
             return email
 
-        pending_storage = self._pending_factory(domain)
+        email_ids, batch_ids = self._pending_index.read(domain)
 
-        pending = self._fetch_pending_emails(pending_storage)
+        legacy_storage = self._pending_factory(domain) if self._pending_factory else None
+        legacy_email_ids = list(legacy_storage.iter()) if legacy_storage else []
+
+        pending = self._fetch_pending_emails(list(dict.fromkeys(chain(email_ids, legacy_email_ids))))
         pending = (mark_delivered(email) for email in pending)
-        pending = (self._encode_attachments(email) for email in pending)
+        if format == sync.PACKAGE_FORMAT_V1:
+            pending = (self._encode_attachments(email) for email in pending)
 
-        resource_id = self._client_storage.store_objects((sync.EMAILS_FILE, pending, to_jsonl_bytes), compression)
+        resource_id = self._client_storage.store_objects((name, pending, encoder), compression)
 
-        self._mark_emails_as_delivered(pending_storage, delivered)
+        if batch_ids:
+            self._pending_index.acknowledge(domain, batch_ids)
+        if legacy_storage and legacy_email_ids:
+            self._mark_emails_as_delivered(legacy_storage, delivered.intersection(legacy_email_ids))
 
         self.log_event(events.EMAILS_DELIVERED_TO_CLIENT, {'domain': domain, 'num_emails': len(delivered)})  # noqa: E501  # yapf: disable
         return {
             'resource_id': resource_id,
         }
 
-    def _fetch_pending_emails(self, pending_storage: AzureTextStorage):
-        for email_id in pending_storage.iter():
-            yield self._email_storage.fetch_object(email_id)
+    def _fetch_pending_emails(self, email_ids: Iterable[str]):
+        emails = self._email_storage.fetch_objects_many(email_ids)
+        if not self._attachment_storage:
+            return emails
+        return (self._attachment_storage.fetch_attachments(email) for email in emails)
 
     @classmethod
     def _encode_attachments(cls, email: dict) -> dict:
@@ -275,8 +398,7 @@ class DownloadClientEmails(_Action):
 
     @classmethod
     def _mark_emails_as_delivered(cls, pending_storage: AzureTextStorage, email_ids: Iterable[str]):
-        for email_id in email_ids:
-            pending_storage.delete(email_id)
+        pending_storage.delete_many(email_ids)
 
 
 class UploadClientEmails(_Action):
@@ -338,9 +460,13 @@ class RegisterClient(_Action):
 
 
 class CalculatePendingEmailsMetric(_Action):
-    def __init__(self, auth: AzureAuth, pending_factory: Callable[[str], AzureTextStorage]):
+    def __init__(self,
+                 auth: AzureAuth,
+                 pending_index: PendingIndex,
+                 pending_factory: Optional[Callable[[str], AzureTextStorage]] = None):
 
         self._auth = auth
+        self._pending_index = pending_index
         self._pending_factory = pending_factory
 
     def _action(self, client_domain, **auth_args):  # type: ignore
@@ -349,9 +475,82 @@ class CalculatePendingEmailsMetric(_Action):
             self.log_event(events.UNKNOWN_CLIENT_DOMAIN, {'client_domain': client_domain})  # noqa: E501  # yapf: disable
             return 'unknown client domain', 404
 
-        pending_storage = self._pending_factory(client_domain)
-        pending_emails = sum(1 for _ in pending_storage.iter())
+        stats = self._pending_index.stats(client_domain)
+        metrics = _to_pending_metrics(stats)
+
+        if self._pending_factory:
+            pending_storage = self._pending_factory(client_domain)
+            metrics['pending_emails'] += sum(1 for _ in pending_storage.iter())
+
+        return metrics
+
+
+class CalculateAllPendingEmailsMetrics(_Action):
+    def __init__(self, auth: AzureAuth, pending_index: PendingIndex):
+
+        self._auth = auth
+        self._pending_index = pending_index
+
+    def _action(self, **auth_args):  # type: ignore
+        stats = self._pending_index.stats_all()
+
+        metrics = []
+        for domain in sorted(self._auth.domains()):
+            domain_metrics = _to_pending_metrics(stats.get(domain, NO_PENDING))
+            domain_metrics['client_domain'] = domain
+            metrics.append(domain_metrics)
+
+        return {
+            'domains': metrics,
+        }
+
+
+def _to_pending_metrics(stats: PendingStats) -> dict:
+    if stats.oldest_pending_ns is None:
+        oldest_pending_age = 0
+    else:
+        oldest_pending_age = max(0, (time_ns() - stats.oldest_pending_ns) // 1000000000)
+
+    return {
+        'pending_emails': stats.pending_emails,
+        'pending_bytes': stats.pending_bytes,
+        'oldest_pending_age_seconds': oldest_pending_age,
+    }
+
+
+class TrainClientPackageDictionary(_Action):
+    def __init__(self,
+                 email_storage: AzureObjectStorage,
+                 dictionary_storage: AzureDictionaryStorage,
+                 num_samples: int = 5000,
+                 dictionary_size: int = 100 * 1024):
+
+        self._email_storage = email_storage
+        self._dictionary_storage = dictionary_storage
+        self._num_samples = num_samples
+        self._dictionary_size = dictionary_size
 
+    def _action(self):  # type: ignore
+        email_ids = islice(self._email_storage.iter(), self._num_samples)
+        emails = self._email_storage.fetch_objects_many(email_ids)
+        samples = [to_jsonl_bytes(self._remove_attachments(email)) for email in emails]
+
+        if not samples:
+            return 'no emails to sample', 404
+
+        try:
+            dictionary = train_dictionary(samples, self._dictionary_size)
+        except ValueError:
+            self.log_warning('Unable to train dictionary from %d samples', len(samples))
+            return f'not enough emails to train a dictionary from {len(samples)} samples', 404
+
+        dictionary_id = self._dictionary_storage.store_dictionary(dictionary)
+
+        self.log_event(events.CLIENT_PACKAGE_DICTIONARY_TRAINED, {'dictionary_id': dictionary_id, 'num_samples': len(samples)})  # noqa: E501  # yapf: disable
         return {
-            'pending_emails': pending_emails,
+            'dictionary_id': dictionary_id,
         }
+
+    @classmethod
+    def _remove_attachments(cls, email: dict) -> dict:
+        return {key: value for (key, value) in email.items() if key != 'attachments'}
@@ -10,16 +10,23 @@ BLOBS_ACCOUNT = env('LOKOLE_EMAIL_SERVER_AZURE_BLOBS_NAME', '')
 BLOBS_KEY = env('LOKOLE_EMAIL_SERVER_AZURE_BLOBS_KEY', '')
 BLOBS_HOST = env('LOKOLE_EMAIL_SERVER_AZURE_BLOBS_HOST', '')
 BLOBS_SECURE = env.bool('LOKOLE_EMAIL_SERVER_AZURE_BLOBS_SECURE', True)
+BLOBS_COMPRESSION = env.dict('LOKOLE_EMAIL_SERVER_AZURE_BLOBS_COMPRESSION', {})
+BLOBS_CACHE_DIRECTORY = env('LOKOLE_EMAIL_SERVER_AZURE_BLOBS_CACHE_DIRECTORY', '')
+BLOBS_CACHE_MAX_BYTES = env.int('LOKOLE_EMAIL_SERVER_AZURE_BLOBS_CACHE_MAX_BYTES', 0)
 
 TABLES_ACCOUNT = env('LOKOLE_EMAIL_SERVER_AZURE_TABLES_NAME', '')
 TABLES_KEY = env('LOKOLE_EMAIL_SERVER_AZURE_TABLES_KEY', '')
 TABLES_HOST = env('LOKOLE_EMAIL_SERVER_AZURE_TABLES_HOST', '')
 TABLES_SECURE = env.bool('LOKOLE_EMAIL_SERVER_AZURE_TABLES_SECURE', True)
+AUTH_CACHE_PATH = env('LOKOLE_EMAIL_SERVER_AUTH_CACHE_PATH', '')
+AUTH_SNAPSHOT_REFRESH_SECONDS = env.int('LOKOLE_EMAIL_SERVER_AUTH_SNAPSHOT_REFRESH_SECONDS', 0)
+AUTH_FILTER_REFRESH_SECONDS = env.int('LOKOLE_EMAIL_SERVER_AUTH_FILTER_REFRESH_SECONDS', 0)
 
 CLIENT_STORAGE_ACCOUNT = env('LOKOLE_CLIENT_AZURE_STORAGE_NAME', '')
 CLIENT_STORAGE_KEY = env('LOKOLE_CLIENT_AZURE_STORAGE_KEY', '')
 CLIENT_STORAGE_HOST = env('LOKOLE_CLIENT_AZURE_STORAGE_HOST', '')
 CLIENT_STORAGE_SECURE = env.bool('LOKOLE_CLIENT_AZURE_STORAGE_SECURE', True)
+CLIENT_PACKAGE_DICTIONARY = env('LOKOLE_CLIENT_PACKAGE_DICTIONARY', '')
 
 SENDGRID_KEY = env('LOKOLE_SENDGRID_KEY', '')
 DNS_ACCOUNT = env('LOKOLE_CLOUDFLARE_USER', '')
@@ -34,6 +41,12 @@ APPINSIGHTS_HOST = env('LOKOLE_EMAIL_SERVER_APPINSIGHTS_HOST', '')
 REGISTRATION_USERNAME = env('REGISTRATION_USERNAME', '')
 REGISTRATION_PASSWORD = env('REGISTRATION_PASSWORD', '')
 
+CANONICAL_EMAIL_IDS = env.bool('LOKOLE_EMAIL_SERVER_CANONICAL_EMAIL_IDS', False)
+MIME_SPOOL_BYTES = env.int('LOKOLE_EMAIL_SERVER_MIME_SPOOL_BYTES', 0)
+INLINE_IMAGES_CACHE_DIRECTORY = env('LOKOLE_EMAIL_SERVER_INLINE_IMAGES_CACHE_DIRECTORY', '')
+INLINE_IMAGES_CACHE_MAX_BYTES = env.int('LOKOLE_EMAIL_SERVER_INLINE_IMAGES_CACHE_MAX_BYTES', 0)
+
+IMAGE_RESIZE_PROCESSES = env.int('LOKOLE_EMAIL_SERVER_IMAGE_RESIZE_PROCESSES', 0)
 MAX_WIDTH_IMAGES = env.int('LOKOLE_MAX_WIDTH_EMAIL_IMAGES', 200)
 MAX_HEIGHT_IMAGES = env.int('LOKOLE_MAX_HEIGHT_EMAIL_IMAGES', 200)
 
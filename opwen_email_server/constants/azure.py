@@ -1,8 +1,11 @@
 from typing_extensions import Final  # noqa: F401
 
 CONTAINER_CLIENT_PACKAGES = 'compressedpackages'  # type: Final
+CONTAINER_CLIENT_PACKAGE_DICTIONARIES = 'packagedictionaries'  # type: Final
 CONTAINER_EMAILS = 'emails'  # type: Final
+CONTAINER_ATTACHMENTS = 'attachments'  # type: Final
 CONTAINER_MAILBOX = 'mailbox'  # type: Final
+CONTAINER_PENDING = 'pendingemails'  # type: Final
 CONTAINER_SENDGRID_MIME = 'sendgridinboundemails'  # type: Final
 TABLE_DOMAIN_X_DELIVERED = 'emaildomainxdelivered'  # type: Final
 TABLE_AUTH = 'clientsauth'  # type: Final
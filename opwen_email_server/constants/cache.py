@@ -1,4 +1,8 @@
 from typing_extensions import Final  # noqa: F401
 
-AUTH_DOMAIN_CACHE_SIZE = 128  # type: Final
+AUTH_CACHE_MAX_ENTRIES = 10000  # type: Final
+AUTH_CACHE_TTL_SECONDS = 600  # type: Final
+AUTH_CACHE_NEGATIVE_TTL_SECONDS = 60  # type: Final
+AUTH_FILTER_MIN_CAPACITY = 10000  # type: Final
+AUTH_FILTER_ERROR_RATE = 0.001  # type: Final
 PENDING_STORAGE_CACHE_SIZE = 128  # type: Final
@@ -0,0 +1,3 @@
+from typing_extensions import Final  # noqa: F401
+
+STORAGE_MAX_WORKERS = 8  # type: Final
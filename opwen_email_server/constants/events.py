@@ -6,6 +6,7 @@ UNKNOWN_USER = 'unknown_user'  # type: Final
 BAD_PASSWORD = 'bad_password'  # type: Final  # nosec
 MISSING_SCOPES = 'missing_scopes'  # type: Final
 UNKNOWN_COMPRESSION_FORMAT = 'unknown_compression_format'  # type: Final
+UNKNOWN_PACKAGE_FORMAT = 'unknown_package_format'  # type: Final
 UNKNOWN_CLIENT_DOMAIN = 'unknown_client_domain'  # type: Final
 EMAILS_DELIVERED_TO_CLIENT = 'emails_delivered_to_client'  # type: Final
 EMAILS_RECEIVED_FROM_CLIENT = 'emails_received_from_client'  # type: Final
@@ -14,3 +15,5 @@ EMAIL_DELIVERED_FROM_CLIENT = 'email_delivered_from_client'  # type: Final
 EMAIL_STORED_FOR_CLIENT = 'email_stored_for_client'  # type: Final
 EMAIL_STORED_FROM_CLIENT = 'email_stored_from_client'  # type: Final
 MAILBOX_EMAIL_INDEXED = 'mailbox_email_indexed'  # type: Final
+CLIENT_PACKAGE_DICTIONARY_TRAINED = 'client_package_dictionary_trained'  # type: Final
+BYTES_CACHE_STATS = 'bytes_cache_stats'  # type: Final
@@ -0,0 +1,11 @@
+from typing_extensions import Final  # noqa: F401
+
+INLINE_IMAGES_MAX_WORKERS = 8  # type: Final
+INLINE_IMAGES_MAX_WORKERS_PER_DOMAIN = 4  # type: Final
+INLINE_IMAGES_TIMEOUT_SECONDS = 20  # type: Final
+INLINE_IMAGE_TIMEOUT_SECONDS = 5  # type: Final
+INLINE_IMAGE_MAX_BYTES = 5 * 1024 * 1024  # type: Final
+INLINE_IMAGE_CHUNK_BYTES = 8 * 1024  # type: Final
+IMAGE_REDUCING_GAP = 2  # type: Final
+IMAGE_REDUCIBLE_MODES = frozenset({'L', 'LA', 'RGB', 'RGBA', 'RGBX', 'CMYK', 'YCbCr', 'I', 'F'})  # type: Final
+IMAGE_RESIZE_POOL_MIN_BYTES = 256 * 1024  # type: Final
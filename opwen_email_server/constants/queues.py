@@ -5,3 +5,6 @@ WRITTEN_STORE_QUEUE = 'written'  # type: Final
 SEND_QUEUE = 'send'  # type: Final
 MAILBOX_RECEIVED_QUEUE = 'mailboxreceived'  # type: Final
 MAILBOX_SENT_QUEUE = 'mailboxsent'  # type: Final
+
+SEND_BATCH_MAX_EMAILS = 50  # type: Final
+SEND_BATCH_WINDOW_SECONDS = 2  # type: Final
@@ -1,7 +1,13 @@
 from typing_extensions import Final  # noqa: F401
 
+API_URL = 'https://api.sendgrid.com'  # type: Final
+
 MAILBOX_URL = 'https://api.sendgrid.com/v3/user/webhooks/parse/settings'  # type: Final  # noqa: E501  # yapf: disable
 
 INBOX_URL = 'https://mailserver.lokole.ca/api/email/sendgrid/{}'  # type: Final
 
 MX_RECORD = 'mx.sendgrid.net'  # type: Final
+
+MAX_PERSONALIZATIONS = 1000  # type: Final
+
+MAX_RECIPIENTS = 1000  # type: Final
@@ -1,3 +1,6 @@
 from typing_extensions import Final  # noqa: F401
 
 EMAILS_FILE = 'emails.jsonl'  # type: Final
+EMAILS_FRAMES_FILE = 'emails.msgpack'  # type: Final
+PACKAGE_FORMAT_V1 = 'v1'  # type: Final
+PACKAGE_FORMAT_V2 = 'v2'  # type: Final
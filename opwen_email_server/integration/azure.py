@@ -1,41 +1,90 @@
 from functools import lru_cache
+from typing import Optional
 
 from opwen_email_server import config
 from opwen_email_server.constants import azure as constants
+from opwen_email_server.constants.cache import AUTH_CACHE_MAX_ENTRIES
+from opwen_email_server.constants.cache import AUTH_CACHE_NEGATIVE_TTL_SECONDS
+from opwen_email_server.constants.cache import AUTH_CACHE_TTL_SECONDS
 from opwen_email_server.constants.cache import PENDING_STORAGE_CACHE_SIZE
 from opwen_email_server.services.auth import AzureAuth
 from opwen_email_server.services.dns import SetupMxRecords
+from opwen_email_server.services.pending import AzurePendingIndex
 from opwen_email_server.services.sendgrid import SendSendgridEmail
 from opwen_email_server.services.sendgrid import SetupSendgridMailbox
+from opwen_email_server.services.storage import AzureAttachmentStorage
+from opwen_email_server.services.storage import AzureDictionaryStorage
 from opwen_email_server.services.storage import AzureFileStorage
 from opwen_email_server.services.storage import AzureObjectsStorage
 from opwen_email_server.services.storage import AzureObjectStorage
 from opwen_email_server.services.storage import AzureTextStorage
+from opwen_email_server.utils.cache import BytesCache
+from opwen_email_server.utils.cache import DiskBytesCache
+from opwen_email_server.utils.cache import MemoryBytesCache
+from opwen_email_server.utils.cache import SqliteTtlCache
+from opwen_email_server.utils.cache import TtlCache
 from opwen_email_server.utils.collections import singleton
+from opwen_email_server.utils.email_parser import InlineImageCache
+from opwen_email_server.utils.email_parser import MimeEmailParser
+from opwen_email_server.utils.email_parser import MimeEmailStreamParser
 
 
 @singleton
 def get_auth() -> AzureAuth:
-    return AzureAuth(storage=AzureTextStorage(
-        account=config.TABLES_ACCOUNT,
-        key=config.TABLES_KEY,
-        host=config.TABLES_HOST,
-        secure=config.TABLES_SECURE,
-        container=constants.TABLE_AUTH,
-        provider=config.STORAGE_PROVIDER,
-    ))
+    return AzureAuth(
+        storage=AzureTextStorage(
+            account=config.TABLES_ACCOUNT,
+            key=config.TABLES_KEY,
+            host=config.TABLES_HOST,
+            secure=config.TABLES_SECURE,
+            container=constants.TABLE_AUTH,
+            provider=config.STORAGE_PROVIDER,
+            compression=config.BLOBS_COMPRESSION.get(constants.TABLE_AUTH),
+        ),
+        cache=get_auth_cache(),
+        snapshot_refresh_seconds=config.AUTH_SNAPSHOT_REFRESH_SECONDS,
+        filter_refresh_seconds=config.AUTH_FILTER_REFRESH_SECONDS,
+    )
+
+
+@singleton
+def get_auth_cache() -> Optional[TtlCache]:
+    if not config.AUTH_CACHE_PATH:
+        return None
+    return SqliteTtlCache(
+        path=config.AUTH_CACHE_PATH,
+        max_entries=AUTH_CACHE_MAX_ENTRIES,
+        ttl_seconds=AUTH_CACHE_TTL_SECONDS,
+        negative_ttl_seconds=AUTH_CACHE_NEGATIVE_TTL_SECONDS,
+    )
 
 
 @singleton
 def get_client_storage() -> AzureObjectsStorage:
-    return AzureObjectsStorage(file_storage=AzureFileStorage(
+    return AzureObjectsStorage(
+        file_storage=AzureFileStorage(
+            account=config.CLIENT_STORAGE_ACCOUNT,
+            key=config.CLIENT_STORAGE_KEY,
+            host=config.CLIENT_STORAGE_HOST,
+            secure=config.CLIENT_STORAGE_SECURE,
+            container=constants.CONTAINER_CLIENT_PACKAGES,
+            provider=config.STORAGE_PROVIDER,
+        ),
+        dictionary_storage=get_dictionary_storage(),
+        dictionary_id=config.CLIENT_PACKAGE_DICTIONARY,
+    )
+
+
+@singleton
+def get_dictionary_storage() -> AzureDictionaryStorage:
+    return AzureDictionaryStorage(
         account=config.CLIENT_STORAGE_ACCOUNT,
         key=config.CLIENT_STORAGE_KEY,
         host=config.CLIENT_STORAGE_HOST,
         secure=config.CLIENT_STORAGE_SECURE,
-        container=constants.CONTAINER_CLIENT_PACKAGES,
+        container=constants.CONTAINER_CLIENT_PACKAGE_DICTIONARIES,
         provider=config.STORAGE_PROVIDER,
-    ))
+    )
 
 
 @singleton
@@ -47,6 +96,7 @@ def get_raw_email_storage() -> AzureTextStorage:
         secure=config.BLOBS_SECURE,
         container=constants.CONTAINER_SENDGRID_MIME,
         provider=config.STORAGE_PROVIDER,
+        compression=config.BLOBS_COMPRESSION.get(constants.CONTAINER_SENDGRID_MIME),
     )
 
 
@@ -78,9 +128,68 @@ def get_email_storage() -> AzureObjectStorage:
         secure=config.BLOBS_SECURE,
         container=constants.CONTAINER_EMAILS,
         provider=config.STORAGE_PROVIDER,
+        compression=config.BLOBS_COMPRESSION.get(constants.CONTAINER_EMAILS),
+        cache=get_blobs_cache(),
+    )
+
+
+@singleton
+def get_blobs_cache() -> Optional[BytesCache]:
+    if config.BLOBS_CACHE_MAX_BYTES <= 0:
+        return None
+    if config.BLOBS_CACHE_DIRECTORY:
+        return DiskBytesCache(
+            directory=config.BLOBS_CACHE_DIRECTORY,
+            max_bytes=config.BLOBS_CACHE_MAX_BYTES,
+            name='blobs',
+        )
+    return MemoryBytesCache(max_bytes=config.BLOBS_CACHE_MAX_BYTES, name='blobs')
+
+
+@singleton
+def get_attachment_storage() -> AzureAttachmentStorage:
+    return AzureAttachmentStorage(
+        account=config.BLOBS_ACCOUNT,
+        key=config.BLOBS_KEY,
+        host=config.BLOBS_HOST,
+        secure=config.BLOBS_SECURE,
+        container=constants.CONTAINER_ATTACHMENTS,
+        provider=config.STORAGE_PROVIDER,
+        compression=config.BLOBS_COMPRESSION.get(constants.CONTAINER_ATTACHMENTS),
+        cache=get_blobs_cache(),
+    )
+
+
+@singleton
+def get_email_parser() -> MimeEmailParser:
+    return MimeEmailParser(image_cache=get_inline_images_cache())
+
+
+@singleton
+def get_stream_email_parser() -> Optional[MimeEmailStreamParser]:
+    if config.MIME_SPOOL_BYTES <= 0:
+        return None
+    return MimeEmailStreamParser(
+        spool_bytes=config.MIME_SPOOL_BYTES,
+        store_attachment=get_attachment_storage().store_attachment_file,
+        image_cache=get_inline_images_cache(),
     )
 
 
+@singleton
+def get_inline_images_cache() -> Optional[InlineImageCache]:
+    if config.INLINE_IMAGES_CACHE_MAX_BYTES <= 0:
+        return None
+    if config.INLINE_IMAGES_CACHE_DIRECTORY:
+        return InlineImageCache(
+            DiskBytesCache(
+                directory=config.INLINE_IMAGES_CACHE_DIRECTORY,
+                max_bytes=config.INLINE_IMAGES_CACHE_MAX_BYTES,
+                name='inline_images',
+            ))
+    return InlineImageCache(MemoryBytesCache(max_bytes=config.INLINE_IMAGES_CACHE_MAX_BYTES, name='inline_images'))
+
+
 @singleton
 def get_mailbox_storage() -> AzureObjectStorage:
     return AzureObjectStorage(
@@ -90,9 +199,23 @@ def get_mailbox_storage() -> AzureObjectStorage:
         secure=config.BLOBS_SECURE,
         container=constants.CONTAINER_MAILBOX,
         provider=config.STORAGE_PROVIDER,
+        compression=config.BLOBS_COMPRESSION.get(constants.CONTAINER_MAILBOX),
     )
 
 
+@singleton
+def get_pending_index() -> AzurePendingIndex:
+    return AzurePendingIndex(storage=AzureTextStorage(
+        account=config.TABLES_ACCOUNT,
+        key=config.TABLES_KEY,
+        host=config.TABLES_HOST,
+        secure=config.TABLES_SECURE,
+        container=constants.CONTAINER_PENDING,
+        provider=config.STORAGE_PROVIDER,
+        compression=config.BLOBS_COMPRESSION.get(constants.CONTAINER_PENDING),
+    ))
+
+
 @lru_cache(maxsize=PENDING_STORAGE_CACHE_SIZE)
 def get_pending_storage(domain: str) -> AzureTextStorage:
     container = domain.replace('.', '-')
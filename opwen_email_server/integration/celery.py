@@ -1,22 +1,34 @@
+from typing import List
+
 from celery import Celery
 
 from opwen_email_server.actions import IndexReceivedEmailForMailbox
 from opwen_email_server.actions import IndexSentEmailForMailbox
+from opwen_email_server.actions import SendOutboundEmailBatch
 from opwen_email_server.actions import SendOutboundEmails
 from opwen_email_server.actions import StoreInboundEmails
 from opwen_email_server.actions import StoreWrittenClientEmails
+from opwen_email_server.config import CANONICAL_EMAIL_IDS
 from opwen_email_server.config import QUEUE_BROKER
 from opwen_email_server.constants.queues import INBOUND_STORE_QUEUE
 from opwen_email_server.constants.queues import MAILBOX_RECEIVED_QUEUE
 from opwen_email_server.constants.queues import MAILBOX_SENT_QUEUE
+from opwen_email_server.constants.queues import SEND_BATCH_MAX_EMAILS
+from opwen_email_server.constants.queues import SEND_BATCH_WINDOW_SECONDS
 from opwen_email_server.constants.queues import SEND_QUEUE
 from opwen_email_server.constants.queues import WRITTEN_STORE_QUEUE
+from opwen_email_server.integration.azure import get_attachment_storage
 from opwen_email_server.integration.azure import get_client_storage
+from opwen_email_server.integration.azure import get_email_parser
 from opwen_email_server.integration.azure import get_email_sender
 from opwen_email_server.integration.azure import get_email_storage
 from opwen_email_server.integration.azure import get_mailbox_storage
-from opwen_email_server.integration.azure import get_pending_storage
+from opwen_email_server.integration.azure import get_pending_index
 from opwen_email_server.integration.azure import get_raw_email_storage
+from opwen_email_server.integration.azure import get_stream_email_parser
+from opwen_email_server.utils.concurrency import Batcher
+from opwen_email_server.utils.unique import new_canonical_email_id
+from opwen_email_server.utils.unique import new_email_id
 
 celery = Celery(broker=QUEUE_BROKER)
 
@@ -46,27 +58,33 @@ def inbound_store(resource_id: str) -> None:
     action = StoreInboundEmails(
         raw_email_storage=get_raw_email_storage(),
         email_storage=get_email_storage(),
-        pending_factory=get_pending_storage,
+        pending_index=get_pending_index(),
         next_task=index_received_email_for_mailbox.delay,
+        email_parser=get_email_parser(),
+        attachment_storage=get_attachment_storage(),
+        stream_parser=get_stream_email_parser(),
+        email_id_source=new_canonical_email_id if CANONICAL_EMAIL_IDS else new_email_id,
     )
 
     action(resource_id)
 
 
-def _send_and_index(resource_id: str) -> None:
-    send.delay(resource_id)
-    index_sent_email_for_mailbox.delay(resource_id)
-
-
 @celery.task(ignore_result=True)
 def written_store(resource_id: str) -> None:
-    action = StoreWrittenClientEmails(
-        client_storage=get_client_storage(),
-        email_storage=get_email_storage(),
-        next_task=_send_and_index,
-    )
+    with Batcher(send_batch.delay, SEND_BATCH_MAX_EMAILS, SEND_BATCH_WINDOW_SECONDS) as send_batcher:
 
-    action(resource_id)
+        def send_and_index(email_id: str) -> None:
+            send_batcher.add(email_id)
+            index_sent_email_for_mailbox.delay(email_id)
+
+        action = StoreWrittenClientEmails(
+            client_storage=get_client_storage(),
+            email_storage=get_email_storage(),
+            next_task=send_and_index,
+            attachment_storage=get_attachment_storage(),
+        )
+
+        action(resource_id)
 
 
 @celery.task(ignore_result=True)
@@ -74,11 +92,23 @@ def send(resource_id: str) -> None:
     action = SendOutboundEmails(
         email_storage=get_email_storage(),
         send_email=get_email_sender(),
+        attachment_storage=get_attachment_storage(),
     )
 
     action(resource_id)
 
 
+@celery.task(ignore_result=True)
+def send_batch(resource_ids: List[str]) -> None:
+    action = SendOutboundEmailBatch(
+        email_storage=get_email_storage(),
+        send_emails=get_email_sender().send_batch,
+        attachment_storage=get_attachment_storage(),
+    )
+
+    action(resource_ids)
+
+
 def _fqn(task):
     return f'{__name__}.{task.__name__}'
 
@@ -89,7 +119,8 @@ celery.conf.update(
         _fqn(index_sent_email_for_mailbox): {'queue': MAILBOX_SENT_QUEUE},
         _fqn(inbound_store): {'queue': INBOUND_STORE_QUEUE},
         _fqn(written_store): {'queue': WRITTEN_STORE_QUEUE},
-        _fqn(send): {'queue': SEND_QUEUE}
+        _fqn(send): {'queue': SEND_QUEUE},
+        _fqn(send_batch): {'queue': SEND_QUEUE},
     })
 
 if __name__ == '__main__':
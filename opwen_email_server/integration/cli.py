@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+
+from opwen_email_server.actions import TrainClientPackageDictionary
+from opwen_email_server.integration.azure import get_dictionary_storage
+from opwen_email_server.integration.azure import get_email_storage
+
+
+def _train_dictionary(args):
+    action = TrainClientPackageDictionary(
+        email_storage=get_email_storage(),
+        dictionary_storage=get_dictionary_storage(),
+        num_samples=args.samples,
+        dictionary_size=args.size,
+    )
+
+    print(action())
+
+
+def _cli():
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser()
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    train_dictionary = commands.add_parser('train-dictionary')
+    train_dictionary.add_argument('--samples', type=int, default=5000)
+    train_dictionary.add_argument('--size', type=int, default=100 * 1024)
+    train_dictionary.set_defaults(func=_train_dictionary)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    _cli()
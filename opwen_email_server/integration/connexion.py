@@ -1,15 +1,18 @@
 from opwen_email_server import config
+from opwen_email_server.actions import CalculateAllPendingEmailsMetrics
 from opwen_email_server.actions import CalculatePendingEmailsMetric
 from opwen_email_server.actions import DownloadClientEmails
 from opwen_email_server.actions import Ping
 from opwen_email_server.actions import ReceiveInboundEmail
 from opwen_email_server.actions import RegisterClient
 from opwen_email_server.actions import UploadClientEmails
+from opwen_email_server.integration.azure import get_attachment_storage
 from opwen_email_server.integration.azure import get_auth
 from opwen_email_server.integration.azure import get_client_storage
 from opwen_email_server.integration.azure import get_email_storage
 from opwen_email_server.integration.azure import get_mailbox_setup
 from opwen_email_server.integration.azure import get_mx_setup
+from opwen_email_server.integration.azure import get_pending_index
 from opwen_email_server.integration.azure import get_pending_storage
 from opwen_email_server.integration.azure import get_raw_email_storage
 from opwen_email_server.integration.celery import inbound_store
@@ -31,6 +34,8 @@ client_read = DownloadClientEmails(
     auth=get_auth(),
     client_storage=get_client_storage(),
     email_storage=get_email_storage(),
+    pending_index=get_pending_index(),
+    attachment_storage=get_attachment_storage(),
     pending_factory=get_pending_storage,
 )
 
@@ -43,9 +48,15 @@ client_register = RegisterClient(
 
 metrics_pending = CalculatePendingEmailsMetric(
     auth=get_auth(),
+    pending_index=get_pending_index(),
     pending_factory=get_pending_storage,
 )
 
+metrics_pending_all = CalculateAllPendingEmailsMetrics(
+    auth=get_auth(),
+    pending_index=get_pending_index(),
+)
+
 basic_auth = BasicAuth(users={config.REGISTRATION_USERNAME: {
     'password': config.REGISTRATION_PASSWORD,
 }})
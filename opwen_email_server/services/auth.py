@@ -1,11 +1,22 @@
-from functools import lru_cache
+from threading import Lock
+from typing import Dict
+from typing import Iterator
+from typing import List
 from typing import Optional
+from uuid import UUID
 
 from libcloud.storage.types import ObjectDoesNotExistError
 
 from opwen_email_server.constants import events
-from opwen_email_server.constants.cache import AUTH_DOMAIN_CACHE_SIZE
+from opwen_email_server.constants.cache import AUTH_CACHE_MAX_ENTRIES
+from opwen_email_server.constants.cache import AUTH_CACHE_NEGATIVE_TTL_SECONDS
+from opwen_email_server.constants.cache import AUTH_CACHE_TTL_SECONDS
+from opwen_email_server.constants.cache import AUTH_FILTER_ERROR_RATE
+from opwen_email_server.constants.cache import AUTH_FILTER_MIN_CAPACITY
 from opwen_email_server.services.storage import AzureTextStorage
+from opwen_email_server.utils.bloom import BloomFilter
+from opwen_email_server.utils.cache import TtlCache
+from opwen_email_server.utils.concurrency import PeriodicRefresh
 from opwen_email_server.utils.log import LogMixin
 
 
@@ -42,34 +53,145 @@ class BasicAuth(LogMixin):
 
 
 class AzureAuth(LogMixin):
-    def __init__(self, storage: AzureTextStorage) -> None:
+    def __init__(self,
+                 storage: AzureTextStorage,
+                 cache: Optional[TtlCache] = None,
+                 snapshot_refresh_seconds: float = 0,
+                 filter_refresh_seconds: float = 0) -> None:
         self._storage = storage
+        self._cache = cache or TtlCache(
+            max_entries=AUTH_CACHE_MAX_ENTRIES,
+            ttl_seconds=AUTH_CACHE_TTL_SECONDS,
+            negative_ttl_seconds=AUTH_CACHE_NEGATIVE_TTL_SECONDS,
+        )
+        self._snapshot: Optional[Dict[str, str]] = None
+        self._snapshot_refresh = PeriodicRefresh(self.refresh_snapshot, snapshot_refresh_seconds)
+        self._filter: Optional[BloomFilter] = None
+        self._filter_inserts: Optional[List[str]] = None
+        self._filter_lock = Lock()
+        self._filter_refresh = PeriodicRefresh(self.refresh_filter, filter_refresh_seconds)
 
     def insert(self, client_id: str, domain: str):
         self._storage.store_text(client_id, domain)
         self._storage.store_text(domain, client_id)
+        self._cache.put(client_id, domain)
+        self._cache.put(domain, client_id)
+        if self._snapshot is not None:
+            snapshot = dict(self._snapshot)
+            snapshot[client_id] = domain
+            snapshot[domain] = client_id
+            self._snapshot = snapshot
+        self._add_to_filter(client_id, domain)
         self.log_debug('Registered client %s at domain %s', client_id, domain)
 
     def client_id_for(self, domain: str) -> Optional[str]:
-        try:
-            client_id = self._storage.fetch_text(domain)
-        except ObjectDoesNotExistError:
+        client_id = self._lookup(domain)
+        if client_id is None:
             self.log_debug('Unrecognized domain %s', domain)
-            return None
         else:
             self.log_debug('Domain %s has client %s', domain, client_id)
-            return client_id
+        return client_id
 
     def domain_for(self, client_id: str) -> Optional[str]:
-        try:
-            domain = self._domain_for_cached(client_id)
-        except ObjectDoesNotExistError:
-            self.log_debug('Unrecognized client %s', client_id)
+        if not self._may_be_registered(client_id):
+            self.log_debug('Filtered unrecognized client %s', client_id)
             return None
+
+        domain = self._lookup(client_id)
+        if domain is None:
+            self.log_debug('Unrecognized client %s', client_id)
         else:
             self.log_debug('Client %s has domain %s', client_id, domain)
-            return domain
+        return domain
+
+    def cache_stats(self) -> Dict[str, int]:
+        return self._cache.stats()
+
+    def domains(self) -> Iterator[str]:
+        for resource_id in self._storage.iter():
+            if not self._is_client_id(resource_id):
+                yield resource_id
+
+    @classmethod
+    def _is_client_id(cls, resource_id: str) -> bool:
+        try:
+            UUID(resource_id)
+        except ValueError:
+            return False
+        else:
+            return True
+
+    def refresh_snapshot(self):
+        snapshot = dict(self._snapshot or {})
+        resource_ids = set(self._storage.iter())
+
+        removed = [resource_id for resource_id in snapshot if resource_id not in resource_ids]
+        added = [resource_id for resource_id in resource_ids if resource_id not in snapshot]
+
+        for resource_id in removed:
+            del snapshot[resource_id]
+        for resource_id, value in zip(added, self._storage.fetch_text_many(added)):
+            snapshot[resource_id] = value
+
+        self._snapshot = snapshot
+        self.log_debug('Refreshed auth snapshot: %d added, %d removed', len(added), len(removed))
+
+    def refresh_filter(self):
+        with self._filter_lock:
+            self._filter_inserts = []
+
+        try:
+            resource_ids = list(self._storage.iter())
+            capacity = max(AUTH_FILTER_MIN_CAPACITY, 2 * len(resource_ids))
+            bloom = BloomFilter.from_items(resource_ids, capacity, AUTH_FILTER_ERROR_RATE)
+
+            with self._filter_lock:
+                for item in self._filter_inserts:
+                    bloom.add(item)
+                self._filter = bloom
+        finally:
+            with self._filter_lock:
+                self._filter_inserts = None
+
+        self.log_debug('Refreshed auth filter with %d entries', len(resource_ids))
+
+    def stop_refresh(self):
+        self._snapshot_refresh.stop()
+        self._filter_refresh.stop()
+
+    def _add_to_filter(self, *items: str):
+        with self._filter_lock:
+            if self._filter is not None:
+                for item in items:
+                    self._filter.add(item)
+            if self._filter_inserts is not None:
+                self._filter_inserts.extend(items)
+
+    def _may_be_registered(self, key: str) -> bool:
+        self._filter_refresh.ensure_started()
+        bloom = self._filter
+        return bloom is None or key in bloom
+
+    def _lookup(self, key: str) -> Optional[str]:
+        self._snapshot_refresh.ensure_started()
+        snapshot = self._snapshot
+        if snapshot is not None:
+            value = snapshot.get(key)
+            if value is not None:
+                return value
+
+        return self._lookup_cached(key)
+
+    def _lookup_cached(self, key: str) -> Optional[str]:
+        try:
+            return self._cache.get(key)
+        except KeyError:
+            pass
+
+        try:
+            value: Optional[str] = self._storage.fetch_text(key)
+        except ObjectDoesNotExistError:
+            value = None
 
-    @lru_cache(maxsize=AUTH_DOMAIN_CACHE_SIZE)
-    def _domain_for_cached(self, client_id: str) -> str:
-        return self._storage.fetch_text(client_id)
+        self._cache.put(key, value)
+        return value
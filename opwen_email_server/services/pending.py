@@ -0,0 +1,178 @@
+from abc import ABC
+from collections import defaultdict
+from collections import namedtuple
+from itertools import count
+from threading import Lock
+from time import time_ns
+from typing import DefaultDict
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import Optional
+from typing import Tuple
+from uuid import uuid4
+
+from opwen_email_server.services.storage import AzureTextStorage
+from opwen_email_server.utils.log import LogMixin
+
+PendingRead = Tuple[List[str], List[str]]
+
+PendingStats = namedtuple('PendingStats', ['pending_emails', 'pending_bytes', 'oldest_pending_ns'])
+
+NO_PENDING = PendingStats(pending_emails=0, pending_bytes=0, oldest_pending_ns=None)
+
+
+def split_bytes(num_bytes: int, num_parts: int, index: int) -> int:
+    share, remainder = divmod(num_bytes, num_parts)
+    return share + 1 if index < remainder else share
+
+
+class PendingIndex(ABC, LogMixin):
+    def append(self, domain: str, email_ids: Iterable[str], num_bytes: int = 0) -> Optional[str]:
+        raise NotImplementedError  # pragma: no cover
+
+    def read(self, domain: str, limit: Optional[int] = None) -> PendingRead:
+        raise NotImplementedError  # pragma: no cover
+
+    def acknowledge(self, domain: str, batch_ids: Iterable[str]) -> int:
+        raise NotImplementedError  # pragma: no cover
+
+    def count(self, domain: str) -> int:
+        return self.stats(domain).pending_emails
+
+    def stats(self, domain: str) -> PendingStats:
+        raise NotImplementedError  # pragma: no cover
+
+    def stats_all(self) -> Dict[str, PendingStats]:
+        raise NotImplementedError  # pragma: no cover
+
+
+class AzurePendingIndex(PendingIndex):
+    _separator = '-'
+    _email_separator = '\n'
+    _settle_seconds = 2
+
+    def __init__(self, storage: AzureTextStorage, settle_seconds: Optional[int] = None) -> None:
+        self._storage = storage
+        self._settle_seconds = self._settle_seconds if settle_seconds is None else settle_seconds
+
+    def append(self, domain: str, email_ids: Iterable[str], num_bytes: int = 0) -> Optional[str]:
+        email_ids = list(email_ids)
+        if not email_ids:
+            return None
+
+        batch_id = self._separator.join((f'{time_ns():020d}', str(len(email_ids)), str(num_bytes), uuid4().hex))
+        self._storage.store_text(f'{domain}/{batch_id}', self._email_separator.join(email_ids))
+
+        self.log_debug('appended %d pending emails for %s', len(email_ids), domain)
+        return batch_id
+
+    def read(self, domain: str, limit: Optional[int] = None) -> PendingRead:
+        cutoff = f'{time_ns() - self._settle_seconds * 1000000000:020d}'
+        batch_ids = [batch_id for batch_id in self._list_batches(domain) if batch_id < cutoff][:limit]
+        if not batch_ids:
+            return [], []
+
+        email_ids = []
+        for content in self._storage.fetch_text_many(f'{domain}/{batch_id}' for batch_id in batch_ids):
+            email_ids.extend(content.split(self._email_separator))
+
+        self.log_debug('read %d pending emails in %d batches for %s', len(email_ids), len(batch_ids), domain)
+        return email_ids, batch_ids
+
+    def acknowledge(self, domain: str, batch_ids: Iterable[str]) -> int:
+        num_deleted = self._storage.delete_many(f'{domain}/{batch_id}' for batch_id in batch_ids)
+        self.log_debug('acknowledged %d pending batches for %s', num_deleted, domain)
+        return num_deleted
+
+    def stats(self, domain: str) -> PendingStats:
+        return self._to_stats(self._list_batches(domain))
+
+    def stats_all(self) -> Dict[str, PendingStats]:
+        batches: DefaultDict[str, List[str]] = defaultdict(list)
+        for resource_id in self._storage.iter():
+            domain, _, batch_id = resource_id.partition('/')
+            batches[domain].append(batch_id)
+
+        return {domain: self._to_stats(batch_ids) for (domain, batch_ids) in batches.items()}
+
+    def _list_batches(self, domain: str) -> List[str]:
+        prefix = f'{domain}/'
+        return sorted(resource_id[len(prefix):] for resource_id in self._storage.iter(prefix))
+
+    @classmethod
+    def _parse_batch(cls, batch_id: str) -> Tuple[int, int, int]:
+        appended_ns, num_emails, num_bytes, _ = batch_id.split(cls._separator, 3)
+        return int(appended_ns), int(num_emails), int(num_bytes)
+
+    @classmethod
+    def _to_stats(cls, batch_ids: List[str]) -> PendingStats:
+        if not batch_ids:
+            return NO_PENDING
+
+        batches = [cls._parse_batch(batch_id) for batch_id in batch_ids]
+        return PendingStats(
+            pending_emails=sum(num_emails for (_, num_emails, _) in batches),
+            pending_bytes=sum(num_bytes for (_, _, num_bytes) in batches),
+            oldest_pending_ns=min(appended_ns for (appended_ns, _, _) in batches),
+        )
+
+
+class LocalPendingIndex(PendingIndex):
+    def __init__(self) -> None:
+        self._batches: DefaultDict[str, List[Tuple[str, List[str], int, int]]] = defaultdict(list)
+        self._counters: DefaultDict[str, List[int]] = defaultdict(lambda: [0, 0])
+        self._sequence = count()
+        self._lock = Lock()
+
+    def append(self, domain: str, email_ids: Iterable[str], num_bytes: int = 0) -> Optional[str]:
+        email_ids = list(email_ids)
+        if not email_ids:
+            return None
+
+        with self._lock:
+            batch_id = f'{next(self._sequence):020d}'
+            self._batches[domain].append((batch_id, email_ids, num_bytes, time_ns()))
+            counters = self._counters[domain]
+            counters[0] += len(email_ids)
+            counters[1] += num_bytes
+        return batch_id
+
+    def read(self, domain: str, limit: Optional[int] = None) -> PendingRead:
+        with self._lock:
+            batches = self._batches[domain][:limit]
+
+        email_ids = [email_id for _, batch, _, _ in batches for email_id in batch]
+        return email_ids, [batch[0] for batch in batches]
+
+    def acknowledge(self, domain: str, batch_ids: Iterable[str]) -> int:
+        batch_ids = set(batch_ids)
+        with self._lock:
+            batches = self._batches[domain]
+            acknowledged = [batch for batch in batches if batch[0] in batch_ids]
+            self._batches[domain] = [batch for batch in batches if batch[0] not in batch_ids]
+            counters = self._counters[domain]
+            for _, email_ids, num_bytes, _ in acknowledged:
+                counters[0] -= len(email_ids)
+                counters[1] -= num_bytes
+        return len(acknowledged)
+
+    def stats(self, domain: str) -> PendingStats:
+        with self._lock:
+            return self._to_stats(domain)
+
+    def stats_all(self) -> Dict[str, PendingStats]:
+        with self._lock:
+            return {domain: self._to_stats(domain) for domain in self._batches if self._batches[domain]}
+
+    def _to_stats(self, domain: str) -> PendingStats:
+        batches = self._batches.get(domain)
+        if not batches:
+            return NO_PENDING
+
+        pending_emails, pending_bytes = self._counters[domain]
+        return PendingStats(
+            pending_emails=pending_emails,
+            pending_bytes=pending_bytes,
+            oldest_pending_ns=batches[0][3],
+        )
@@ -1,5 +1,11 @@
+from collections import OrderedDict
+from hashlib import sha256
 from mimetypes import guess_type
 from typing import Callable
+from typing import Dict
+from typing import Hashable
+from typing import List
+from typing import Tuple
 
 from cached_property import cached_property
 from python_http_client import BadRequestsError
@@ -7,22 +13,27 @@ from requests import post as http_post
 from sendgrid import SendGridAPIClient
 from sendgrid.helpers.mail import Attachment
 from sendgrid.helpers.mail import Content
+from sendgrid.helpers.mail import CustomArg
 from sendgrid.helpers.mail import Email
 from sendgrid.helpers.mail import Mail
 from sendgrid.helpers.mail import MailSettings
 from sendgrid.helpers.mail import Personalization
 from sendgrid.helpers.mail import SandBoxMode
 
+from opwen_email_server.constants.sendgrid import API_URL
 from opwen_email_server.constants.sendgrid import INBOX_URL
 from opwen_email_server.constants.sendgrid import MAILBOX_URL
+from opwen_email_server.constants.sendgrid import MAX_PERSONALIZATIONS
+from opwen_email_server.constants.sendgrid import MAX_RECIPIENTS
 from opwen_email_server.utils.log import LogMixin
 from opwen_email_server.utils.serialization import to_base64
 
 
 class SendSendgridEmail(LogMixin):
-    def __init__(self, key: str, sandbox: bool = False) -> None:
+    def __init__(self, key: str, sandbox: bool = False, host: str = API_URL) -> None:
         self._key = key
         self._sandbox = sandbox
+        self._host = host
 
     @cached_property
     def _client(self) -> Callable[[Mail], int]:
@@ -34,7 +45,7 @@ class SendSendgridEmail(LogMixin):
 
             return send_email_fake
 
-        client = SendGridAPIClient(api_key=self._key)
+        client = SendGridAPIClient(api_key=self._key, host=self._host)
 
         def send_email(email: Mail) -> int:
             if self._sandbox:
@@ -53,7 +64,29 @@ class SendSendgridEmail(LogMixin):
         email = self._create_email(email, email_id)
         return self._send_email(email, email_id)
 
+    def send_batch(self, emails: List[dict]) -> List[bool]:
+        results: Dict[int, bool] = {}
+
+        for batch in self._create_batches(emails):
+            batch_emails = [emails[index] for index in batch]
+            email_ids = ','.join(email.get('_uid', '') for email in batch_emails)
+            mail = self._create_batch_email(batch_emails, email_ids)
+            status = self._send_mail(mail, email_ids)
+
+            if status == 400 and len(batch) > 1:
+                self.log_warning('batch %s was rejected, sending its emails one by one', email_ids)
+                for index in batch:
+                    results[index] = self(emails[index])
+            else:
+                for index in batch:
+                    results[index] = self._is_success(status)
+
+        return [results[index] for index in range(len(emails))]
+
     def _send_email(self, email: Mail, email_id: str) -> bool:
+        return self._is_success(self._send_mail(email, email_id))
+
+    def _send_mail(self, email: Mail, email_id: str) -> int:
         self.log_debug('about to send email %s', email_id)
         try:
             status = self._client(email)
@@ -67,8 +100,91 @@ class SendSendgridEmail(LogMixin):
         else:
             self.log_debug('sent email %s', email_id)
 
+        return status
+
+    @classmethod
+    def _is_success(cls, status: int) -> bool:
         return status in (200, 201, 202)
 
+    @classmethod
+    def _create_batches(cls, emails: List[dict]) -> List[List[int]]:
+        groups: Dict[Hashable, List[int]] = OrderedDict()
+        content_keys: Dict[int, str] = {}
+        for index, email in enumerate(emails):
+            groups.setdefault(cls._get_batch_key(email, content_keys), []).append(index)
+
+        batches = []
+        for group in groups.values():
+            batch: List[int] = []
+            num_recipients = 0
+            for index in group:
+                email_recipients = cls._count_recipients(emails[index])
+                if batch and (len(batch) >= MAX_PERSONALIZATIONS or num_recipients + email_recipients > MAX_RECIPIENTS):
+                    batches.append(batch)
+                    batch = []
+                    num_recipients = 0
+                batch.append(index)
+                num_recipients += email_recipients
+            batches.append(batch)
+
+        return batches
+
+    @classmethod
+    def _get_batch_key(cls, email: dict, content_keys: Dict[int, str]) -> Tuple[Hashable, ...]:
+        attachments = tuple(
+            (attachment.get('filename', ''), cls._get_content_key(attachment.get('content', b''), content_keys))
+            for attachment in email.get('attachments', []))
+        return email.get('from'), email.get('body'), attachments
+
+    @classmethod
+    def _get_content_key(cls, content: bytes, content_keys: Dict[int, str]) -> str:
+        content_key = content_keys.get(id(content))
+        if content_key is None:
+            content_key = sha256(content).hexdigest()
+            content_keys[id(content)] = content_key
+        return content_key
+
+    @classmethod
+    def _count_recipients(cls, email: dict) -> int:
+        return sum(len(email.get(field, [])) for field in ('to', 'cc', 'bcc'))
+
+    def _create_batch_email(self, emails: List[dict], email_ids: str) -> Mail:
+        if len(emails) == 1:
+            return self._create_email(emails[0], email_ids)
+
+        self.log_debug('converting emails %s to sendgrid format', email_ids)
+        mail = Mail()
+
+        for index, email in enumerate(emails):
+            personalization = self._create_personalization(email)
+            personalization.subject = email.get('subject', '(no subject)')
+            personalization.add_custom_arg(CustomArg('email_id', email.get('_uid', '')))
+            mail.add_personalization(personalization, index)
+
+        mail.add_content(Content('text/html', emails[0].get('body')))
+        mail.from_email = Email(emails[0].get('from'))
+
+        for attachment in emails[0].get('attachments', []):
+            mail.add_attachment(self._create_attachment(attachment))
+
+        self.log_debug('converted emails %s to sendgrid format', email_ids)
+        return mail
+
+    @classmethod
+    def _create_personalization(cls, email: dict) -> Personalization:
+        personalization = Personalization()
+
+        for to in email.get('to', []):
+            personalization.add_to(Email(to))
+
+        for cc in email.get('cc', []):
+            personalization.add_cc(Email(cc))
+
+        for bcc in email.get('bcc', []):
+            personalization.add_bcc(Email(bcc))
+
+        return personalization
+
     def _create_email(self, email: dict, email_id: str) -> Mail:
         self.log_debug('converting email %s to sendgrid format', email_id)
         mail = Mail()
@@ -1,42 +1,73 @@
 from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from hashlib import sha256
 from io import BytesIO
+from os import getpid
+from tarfile import BLOCKSIZE
+from tarfile import DEFAULT_FORMAT
+from tarfile import ENCODING
+from tarfile import NUL
+from tarfile import RECORDSIZE
 from tarfile import TarFile
-from tempfile import NamedTemporaryFile
+from tarfile import TarInfo
+from tarfile import open as tarfile_open
+from tempfile import SpooledTemporaryFile
+from threading import Lock
+from threading import local
+from time import time
 from typing import IO
 from typing import Callable
+from typing import Dict
 from typing import Iterable
 from typing import Iterator
+from typing import List
 from typing import Optional
 from typing import Tuple
+from typing import TypeVar
+from typing import Union
 
 from cached_property import cached_property
 from libcloud.storage.base import Container
+from libcloud.storage.base import Object
 from libcloud.storage.base import StorageDriver
 from libcloud.storage.providers import get_driver
 from libcloud.storage.types import ContainerAlreadyExistsError
 from libcloud.storage.types import ContainerDoesNotExistError
 from libcloud.storage.types import ObjectDoesNotExistError
 from libcloud.storage.types import Provider
-from xtarfile import open as tarfile_open
-from xtarfile.xtarfile import SUPPORTED_FORMATS
 
+from opwen_email_server.constants.concurrency import STORAGE_MAX_WORKERS
+from opwen_email_server.utils.cache import BytesCache
+from opwen_email_server.utils.compression import BLOB_CODECS
+from opwen_email_server.utils.compression import COMPRESSION_FORMATS
+from opwen_email_server.utils.compression import compress_chunks
+from opwen_email_server.utils.compression import decompress_chunks
+from opwen_email_server.utils.compression import get_dictionary_id
+from opwen_email_server.utils.compression import open_chunks
+from opwen_email_server.utils.compression import split_chunks
+from opwen_email_server.utils.concurrency import map_ordered
 from opwen_email_server.utils.log import LogMixin
 from opwen_email_server.utils.path import get_extension
 from opwen_email_server.utils.serialization import from_msgpack_bytes
-from opwen_email_server.utils.serialization import gunzip_bytes
-from opwen_email_server.utils.serialization import gzip_bytes
 from opwen_email_server.utils.serialization import to_msgpack_bytes
 from opwen_email_server.utils.temporary import create_tempfilename
-from opwen_email_server.utils.temporary import removing
+from opwen_email_server.utils.temporary import spool_chunks
 from opwen_email_server.utils.unique import new_resource_id
 
+T = TypeVar('T')
+
 AccessInfo = namedtuple('AccessInfo', ['account', 'key', 'container'])
 
 Upload = Tuple[str, Iterable[dict], Callable[[dict], bytes]]
-Download = Tuple[str, Callable[[bytes], dict]]
+Download = Tuple[str, Callable[[bytes], Optional[dict]]]
+FramedDownload = Tuple[str, Callable[[bytes], Optional[dict]], Callable[[IO[bytes]], Iterable[bytes]]]
 
 
 class _BaseAzureStorage(LogMixin):
+    _max_workers = STORAGE_MAX_WORKERS
+    _spool_size = 10 * 1024 * 1024
+
     def __init__(self,
                  account: str,
                  key: str,
@@ -50,9 +81,16 @@ class _BaseAzureStorage(LogMixin):
         self._provider = getattr(Provider, provider)
         self._host = host or None
         self._secure = secure
+        self._local = local()
+        self._executor_lock = Lock()
+        self._executor_pid: Optional[int] = None
+        self._executor_instance: Optional[ThreadPoolExecutor] = None
 
     @cached_property
     def _driver(self) -> StorageDriver:
+        return self._new_driver()
+
+    def _new_driver(self) -> StorageDriver:
         driver = get_driver(self._provider)
         return driver(self._account, self._key, host=self._host, secure=self._secure)
 
@@ -67,6 +105,34 @@ class _BaseAzureStorage(LogMixin):
                 container = self._driver.get_container(self._container)
         return container
 
+    @property
+    def _thread_client(self) -> Container:
+        try:
+            return self._local.client
+        except AttributeError:
+            client = Container(self._client.name, self._client.extra, self._new_driver())
+            self._local.client = client
+            return client
+
+    @property
+    def _executor(self) -> ThreadPoolExecutor:
+        with self._executor_lock:
+            if self._executor_instance is None or self._executor_pid != getpid():
+                self._executor_instance = ThreadPoolExecutor(max_workers=self._max_workers,
+                                                             thread_name_prefix=self._container)
+                self._executor_pid = getpid()
+            return self._executor_instance
+
+    def _map(self, func: Callable[[Container, str], T], resource_ids: Iterable[str], max_workers: int) -> Iterator[T]:
+        resource_ids = list(resource_ids)
+        if len(resource_ids) <= 1 or max_workers <= 1:
+            return (func(self._client, resource_id) for resource_id in resource_ids)
+
+        def run(resource_id: str) -> T:
+            return func(self._thread_client, resource_id)
+
+        return map_ordered(run, resource_ids, min(max_workers, self._max_workers), self._executor)
+
     def access_info(self) -> AccessInfo:
         return AccessInfo(
             account=self._account,
@@ -87,19 +153,50 @@ class _BaseAzureStorage(LogMixin):
             resource.delete()
             self.log_debug('deleted %s', resource_id)
 
-    def iter(self) -> Iterator[str]:
-        for resource in self._client.list_objects():
-            extension = get_extension(resource.name)
-            resource_id = resource.name.replace(extension, '')
+    def delete_many(self, resource_ids: Iterable[str], max_workers: int = STORAGE_MAX_WORKERS) -> int:
+        num_deleted = sum(self._map(self._delete_blind, resource_ids, max_workers))
+        self.log_debug('deleted %d resources', num_deleted)
+        return num_deleted
+
+    def _delete_blind(self, client: Container, resource_id: str) -> bool:
+        return self._delete_object(client, resource_id)
+
+    @classmethod
+    def _delete_object(cls, client: Container, name: str) -> bool:
+        resource = Object(name, size=0, hash=None, extra={}, meta_data={}, container=client, driver=client.driver)
+        try:
+            return client.driver.delete_object(resource)
+        except ObjectDoesNotExistError:
+            return False
+
+    def iter(self, prefix: str = '') -> Iterator[str]:
+        if prefix:
+            resources = self._client.driver.list_container_objects(self._client, ex_prefix=prefix)
+        else:
+            resources = self._client.list_objects()
+
+        for resource in resources:
+            if not resource.name.startswith(prefix):
+                continue
+            resource_id = self._to_resource_id(resource.name)
             yield resource_id
             self.log_debug('listed %s', resource_id)
 
+    def _to_resource_id(self, name: str) -> str:
+        extension = get_extension(name)
+        return name.replace(extension, '')
+
 
 class AzureFileStorage(_BaseAzureStorage):
     def store_file(self, resource_id: str, path: str):
         self.log_debug('storing file %s at %s', path, resource_id)
         self._client.upload_object(path, resource_id)
 
+    def store_stream(self, resource_id: str, stream: Iterable[bytes]):
+        self.log_debug('storing stream at %s', resource_id)
+        with spool_chunks(stream, self._spool_size) as upload:
+            self._client.upload_object_via_stream(upload, resource_id)
+
     def fetch_file(self, resource_id: str) -> str:
         resource = self._client.get_object(resource_id)
         path = create_tempfilename(resource_id)
@@ -107,39 +204,136 @@ class AzureFileStorage(_BaseAzureStorage):
         self.log_debug('fetched file %s from %s', path, resource_id)
         return path
 
+    def fetch_stream(self, resource_id: str) -> Iterator[bytes]:
+        resource = self._client.get_object(resource_id)
+        self.log_debug('fetching stream from %s', resource_id)
+        return resource.as_stream()
+
 
 class _AzureBytesStorage(_BaseAzureStorage):
     _compression = 'gz'
+    _legacy_compression = 'gz'
+    _chunk_size = 1024 * 1024
+
+    def __init__(self,
+                 account: str,
+                 key: str,
+                 container: str,
+                 provider: str,
+                 host: Optional[str] = None,
+                 secure: bool = True,
+                 compression: Optional[str] = None,
+                 cache: Optional[BytesCache] = None) -> None:
+        super().__init__(account, key, container, provider, host, secure)
+        self._compression = compression or self._compression
+        self._cache = cache
+
+        if self._compression not in BLOB_CODECS:
+            raise ValueError(f'Unknown compression {self._compression} for container {container}')
 
     def store_bytes(self, resource_id: str, content: bytes):
         filename = self._to_filename(resource_id)
         self.log_debug('storing %d bytes at %s', len(content), filename)
         upload = BytesIO()
-        upload.write(gzip_bytes(content))
+        for chunk in compress_chunks(split_chunks(content, self._chunk_size), self._compression):
+            upload.write(chunk)
         upload.seek(0)
         self._client.upload_object_via_stream(upload, filename)
+        if self._cache is not None:
+            self._cache.put(self._to_cache_key(resource_id), content)
 
     def fetch_bytes(self, resource_id: str) -> bytes:
-        filename = self._to_filename(resource_id)
-        download = BytesIO()
-        resource = self._client.get_object(filename)
-        for chunk in resource.as_stream():
-            download.write(chunk)
-        download.seek(0)
-        content = gunzip_bytes(download.read())
-        self.log_debug('fetched %d bytes from %s', len(content), filename)
+        return self._fetch_bytes(self._client, resource_id)
+
+    def fetch_chunks(self, resource_id: str) -> Iterator[bytes]:
+        resource, compression = self._get_resource(self._client, resource_id)
+        self.log_debug('streaming bytes from %s', resource.name)
+        return decompress_chunks(resource.as_stream(), compression)
+
+    def fetch_bytes_many(self, resource_ids: Iterable[str], max_workers: int = STORAGE_MAX_WORKERS) -> Iterator[bytes]:
+        return self._map(self._fetch_bytes, resource_ids, max_workers)
+
+    def _fetch_bytes(self, client: Container, resource_id: str) -> bytes:
+        if self._cache is not None:
+            cache_key = self._to_cache_key(resource_id)
+            cached = self._cache.get(cache_key)
+            if cached is not None:
+                self.log_debug('fetched %d cached bytes for %s', len(cached), resource_id)
+                return cached
+
+        resource, compression = self._get_resource(client, resource_id)
+        content = b''.join(decompress_chunks(resource.as_stream(), compression))
+        self.log_debug('fetched %d bytes from %s', len(content), resource.name)
+
+        if self._cache is not None:
+            self._cache.put(cache_key, content)
         return content
 
     def delete(self, resource_id: str):
-        filename = self._to_filename(resource_id)
-        super().delete(filename)
+        if self._cache is not None:
+            self._cache.delete(self._to_cache_key(resource_id))
+
+        try:
+            resource, _ = self._get_resource(self._client, resource_id)
+        except ObjectDoesNotExistError:
+            self.log_warning('deleted missing %s', resource_id)
+        else:
+            resource.delete()
+            self.log_debug('deleted %s', resource.name)
+
+    def _delete_blind(self, client: Container, resource_id: str) -> bool:
+        if self._cache is not None:
+            self._cache.delete(self._to_cache_key(resource_id))
+
+        resource_id, compression = self._parse_filename(resource_id)
+        for compression in self._get_compressions(compression):
+            if self._delete_object(client, self._to_filename(resource_id, compression)):
+                return True
+        return False
 
-    def _to_filename(self, resource_id: str) -> str:
-        extension = f'.{self._extension}.{self._compression}'
-        if resource_id.endswith(extension):
-            return resource_id
+    def _get_resource(self, client: Container, resource_id: str) -> Tuple[Object, str]:
+        resource_id, compression = self._parse_filename(resource_id)
+        compressions = self._get_compressions(compression)
+
+        for compression in compressions[:-1]:
+            try:
+                return client.get_object(self._to_filename(resource_id, compression)), compression
+            except ObjectDoesNotExistError:
+                self.log_debug('no %s blob for %s', compression, resource_id)
+
+        compression = compressions[-1]
+        return client.get_object(self._to_filename(resource_id, compression)), compression
+
+    def _to_resource_id(self, name: str) -> str:
+        resource_id, _ = self._parse_filename(name)
+        return resource_id
+
+    def _get_compressions(self, compression: Optional[str]) -> List[str]:
+        if compression:
+            return [compression]
+        return list(dict.fromkeys([self._compression, self._legacy_compression, *sorted(BLOB_CODECS)]))
+
+    def _to_cache_key(self, resource_id: str) -> str:
+        resource_id, _ = self._parse_filename(resource_id)
+        return f'{self._container}/{resource_id}'
+
+    def _parse_filename(self, filename: str) -> Tuple[str, Optional[str]]:
+        for compression in BLOB_CODECS:
+            extension = self._to_extension(compression)
+            if filename.endswith(extension):
+                return filename[:-len(extension)], compression
+        return filename, None
+
+    def _to_filename(self, resource_id: str, compression: Optional[str] = None) -> str:
+        resource_id, _ = self._parse_filename(resource_id)
+        extension = self._to_extension(compression or self._compression)
         return f'{resource_id}{extension}'
 
+    def _to_extension(self, compression: str) -> str:
+        if compression == 'none':
+            return f'.{self._extension}'
+        return f'.{self._extension}.{compression}'
+
     @property
     def _extension(self) -> str:
         raise NotImplementedError  # pragma: no cover
@@ -157,43 +351,159 @@ class AzureTextStorage(_AzureBytesStorage):
         content = self.fetch_bytes(resource_id)
         return content.decode(self._encoding)
 
+    def fetch_text_many(self, resource_ids: Iterable[str], max_workers: int = STORAGE_MAX_WORKERS) -> Iterator[str]:
+        for content in self.fetch_bytes_many(resource_ids, max_workers):
+            yield content.decode(self._encoding)
+
+
+class AzureAttachmentStorage(_AzureBytesStorage):
+    _extension = 'bin'
+    _reference_key = 'sha256'
+
+    def store_content(self, content: bytes) -> str:
+        content_hash = sha256(content).hexdigest()
+        try:
+            self._get_resource(self._client, content_hash)
+        except ObjectDoesNotExistError:
+            self.store_bytes(content_hash, content)
+        else:
+            self.log_debug('deduplicated content %s', content_hash)
+        return content_hash
+
+    def store_file(self, fobj: IO[bytes]) -> str:
+        content_hash = sha256()
+        for chunk in iter(partial(fobj.read, self._chunk_size), b''):
+            content_hash.update(chunk)
+        content_id = content_hash.hexdigest()
+
+        try:
+            self._get_resource(self._client, content_id)
+        except ObjectDoesNotExistError:
+            fobj.seek(0)
+            chunks = compress_chunks(iter(partial(fobj.read, self._chunk_size), b''), self._compression)
+            with spool_chunks(chunks, self._spool_size) as upload:
+                self._client.upload_object_via_stream(upload, self._to_filename(content_id))
+            self.log_debug('stored file at %s', content_id)
+        else:
+            self.log_debug('deduplicated content %s', content_id)
+        return content_id
+
+    def store_attachment_file(self, attachment: dict, fobj: IO[bytes]) -> dict:
+        attachment = dict(attachment)
+        attachment[self._reference_key] = self.store_file(fobj)
+        return attachment
+
+    def store_attachments(self, email: dict) -> dict:
+        attachments = email.get('attachments')
+        if not attachments:
+            return email
+
+        references = []
+        for attachment in attachments:
+            content = attachment.get('content')
+            if content is not None:
+                attachment = {key: value for (key, value) in attachment.items() if key != 'content'}
+                attachment[self._reference_key] = self.store_content(content)
+            references.append(attachment)
+
+        new_email = dict(email)
+        new_email['attachments'] = references
+        return new_email
+
+    def fetch_attachments(self, email: dict) -> dict:
+        attachments = email.get('attachments')
+        if not attachments:
+            return email
+
+        content_hashes = [attachment.get(self._reference_key) for attachment in attachments]
+        if not any(content_hashes):
+            return email
+
+        contents = iter(list(self.fetch_bytes_many(content_hash for content_hash in content_hashes if content_hash)))
+
+        resolved = []
+        for attachment, content_hash in zip(attachments, content_hashes):
+            if content_hash:
+                attachment = {key: value for (key, value) in attachment.items() if key != self._reference_key}
+                attachment['content'] = next(contents)
+            resolved.append(attachment)
+
+        new_email = dict(email)
+        new_email['attachments'] = resolved
+        return new_email
+
+
+class AzureDictionaryStorage(_AzureBytesStorage):
+    _compression = 'none'
+    _extension = 'zdict'
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self._dictionaries: Dict[str, bytes] = {}
+
+    def store_dictionary(self, dictionary: bytes) -> str:
+        dictionary_id = get_dictionary_id(dictionary)
+        self.store_bytes(dictionary_id, dictionary)
+        self._dictionaries[dictionary_id] = dictionary
+        return dictionary_id
+
+    def fetch_dictionary(self, dictionary_id: str) -> bytes:
+        try:
+            return self._dictionaries[dictionary_id]
+        except KeyError:
+            dictionary = bytes(self.fetch_bytes(dictionary_id))
+            self._dictionaries[dictionary_id] = dictionary
+            return dictionary
+
 
 class AzureObjectsStorage(LogMixin):
     _compression = 'zstd'
     _compression_level = 20
+    _spool_size = 10 * 1024 * 1024
+    _chunk_size = 64 * 1024
+    _dictionary_prefix = 'zdict-'
 
-    def __init__(self, file_storage: AzureFileStorage, resource_id_source: Callable[[], str] = None):
+    def __init__(self,
+                 file_storage: AzureFileStorage,
+                 resource_id_source: Callable[[], str] = None,
+                 dictionary_storage: Optional[AzureDictionaryStorage] = None,
+                 dictionary_id: Optional[str] = None):
         self._file_storage = file_storage
         self._resource_id_source = resource_id_source or new_resource_id
+        self._dictionary_storage = dictionary_storage
+        self._dictionary_id = dictionary_id if dictionary_storage else None
 
-    def _open_archive_file(self, archive: TarFile, name: str) -> IO[bytes]:
+    def _open_archive_file(self, archive: TarFile, names: Iterable[str]) -> Tuple[str, IO[bytes]]:
+        names = list(names)
         while True:
             member = archive.next()
             if member is None:
                 break
-            if member.name == name:
+            if member.name in names:
                 fobj = archive.extractfile(member)
                 if fobj is None:
                     break
-                return fobj
+                return member.name, fobj
 
         # noinspection PyProtectedMember
-        raise ObjectDoesNotExistError(f'File {name} is missing in archive', self._file_storage._driver, archive.name)
+        raise ObjectDoesNotExistError(f'File {" or ".join(names)} is missing in archive', self._file_storage._driver,
+                                      archive.name)
 
     @classmethod
-    def _open_archive(cls, path: str, mode: str) -> TarFile:
-        extension_index = path.rfind('.')
+    def _get_compression(cls, resource_id: str) -> str:
+        extension_index = resource_id.rfind('.')
         if extension_index > -1:
-            compression = path[extension_index + 1:]
-        else:
-            compression = cls._compression
-
-        kwargs = {}
-        if compression == 'zstd' and mode == 'w':
-            kwargs['level'] = cls._compression_level
-
-        mode = f'{mode}|{compression}'
-        return tarfile_open(path, mode, **kwargs)
+            return resource_id[extension_index + 1:]
+        return cls._compression
+
+    def _get_dictionary(self, resource_id: str) -> Optional[bytes]:
+        for part in resource_id.split('.')[1:]:
+            if part.startswith(self._dictionary_prefix):
+                if not self._dictionary_storage:
+                    raise ValueError(f'No dictionary storage to decompress {resource_id}')
+                dictionary_id = part[len(self._dictionary_prefix):]
+                return self._dictionary_storage.fetch_dictionary(dictionary_id)
+        return None
 
     def access_info(self) -> AccessInfo:
         return self._file_storage.access_info()
@@ -203,46 +513,82 @@ class AzureObjectsStorage(LogMixin):
 
     @classmethod
     def compression_formats(cls) -> Iterable[str]:
-        return SUPPORTED_FORMATS
+        return COMPRESSION_FORMATS
 
     def store_objects(self, upload: Upload, compression: Optional[str] = None) -> Optional[str]:
 
         compression = compression or self._compression
 
-        resource_id = f'{self._resource_id_source()}.tar.{compression}'
+        dictionary_id = self._dictionary_id if compression == 'zstd' else None
+        if dictionary_id:
+            resource_id = f'{self._resource_id_source()}.{self._dictionary_prefix}{dictionary_id}.tar.{compression}'
+        else:
+            resource_id = f'{self._resource_id_source()}.tar.{compression}'
 
         name, objs, encoder = upload
 
         num_stored = 0
-        with removing(create_tempfilename(resource_id)) as path:
-            with self._open_archive(path, 'w') as archive:
-                with NamedTemporaryFile() as fobj:
-                    num_bytes = 0
-                    for obj in objs:
-                        encoded = encoder(obj)
-                        fobj.write(encoded)
-                        num_bytes += len(encoded)
-                        num_stored += 1
-
-                    if num_bytes > 0:
-                        fobj.seek(0)
-                        archive.add(fobj.name, name)
+        with SpooledTemporaryFile(max_size=self._spool_size) as fobj:
+            num_bytes = 0
+            for obj in objs:
+                encoded = encoder(obj)
+                fobj.write(encoded)
+                num_bytes += len(encoded)
+                num_stored += 1
 
             if num_stored > 0:
-                self._file_storage.store_file(resource_id, path)
+                fobj.seek(0)
+                archive = self._stream_archive(fobj, name, num_bytes)
+                level = self._compression_level if compression == 'zstd' else None
+                dictionary = self._get_dictionary(resource_id)
+                self._file_storage.store_stream(resource_id, compress_chunks(archive, compression, level, dictionary))
 
         self.log_debug('stored %d objects at %s', num_stored, resource_id)
         return resource_id if num_stored > 0 else None
 
-    def fetch_objects(self, resource_id: str, download: Download) -> Iterable[dict]:
+    @classmethod
+    def _stream_archive(cls, fobj: IO[bytes], name: str, size: int) -> Iterator[bytes]:
+        offset = 0
+
+        if size > 0:
+            member = TarInfo(name)
+            member.size = size
+            member.mtime = int(time())
+            header = member.tobuf(DEFAULT_FORMAT, ENCODING, 'surrogateescape')
+            yield header
+            offset += len(header)
+
+            for chunk in iter(partial(fobj.read, cls._chunk_size), b''):
+                yield chunk
+                offset += len(chunk)
+
+            remainder = offset % BLOCKSIZE
+            if remainder > 0:
+                yield NUL * (BLOCKSIZE - remainder)
+                offset += BLOCKSIZE - remainder
+
+        yield NUL * (2 * BLOCKSIZE)
+        offset += 2 * BLOCKSIZE
+
+        remainder = offset % RECORDSIZE
+        if remainder > 0:
+            yield NUL * (RECORDSIZE - remainder)
 
-        name, decoder = download
+    def fetch_objects(self, resource_id: str, *downloads: Union[Download, FramedDownload]) -> Iterable[dict]:
+
+        readers = {download[0]: download[1:] for download in downloads}
+
+        compression = self._get_compression(resource_id)
+        dictionary = self._get_dictionary(resource_id)
+        stream = self._file_storage.fetch_stream(resource_id)
 
         num_fetched = 0
-        with removing(self._file_storage.fetch_file(resource_id)) as path:
-            with self._open_archive(path, 'r') as archive:
-                fobj = self._open_archive_file(archive, name)
-                for encoded in fobj:
+        with open_chunks(decompress_chunks(stream, compression, dictionary)) as fobj:
+            with tarfile_open(fileobj=fobj, mode='r|') as archive:
+                name, fobj = self._open_archive_file(archive, readers)
+                decoder, *framing = readers[name]
+                read_records = framing[0] if framing else iter
+                for encoded in read_records(fobj):
                     obj = decoder(encoded)
                     if obj is None:
                         continue
@@ -253,6 +599,9 @@ class AzureObjectsStorage(LogMixin):
     def delete(self, resource_id: str):
         self._file_storage.delete(resource_id)
 
+    def delete_many(self, resource_ids: Iterable[str]) -> int:
+        return self._file_storage.delete_many(resource_ids)
+
 
 class AzureObjectStorage(_AzureBytesStorage):
     _extension = 'msgpack'
@@ -261,6 +610,10 @@ class AzureObjectStorage(_AzureBytesStorage):
         serialized = self.fetch_bytes(resource_id)
         return from_msgpack_bytes(serialized)
 
+    def fetch_objects_many(self, resource_ids: Iterable[str], max_workers: int = STORAGE_MAX_WORKERS) -> Iterator[dict]:
+        for serialized in self.fetch_bytes_many(resource_ids, max_workers):
+            yield from_msgpack_bytes(serialized)
+
     def store_object(self, resource_id: str, obj: dict) -> None:
         serialized = to_msgpack_bytes(obj)
         self.store_bytes(resource_id, serialized)
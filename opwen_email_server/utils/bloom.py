@@ -0,0 +1,34 @@
+from hashlib import blake2b
+from math import ceil
+from math import log
+from typing import Iterable
+from typing import Iterator
+
+
+class BloomFilter:
+    def __init__(self, capacity: int, error_rate: float) -> None:
+        num_bits = max(8, ceil(-capacity * log(error_rate) / log(2)**2))
+        self._num_bits = num_bits
+        self._num_hashes = max(1, round(num_bits / max(capacity, 1) * log(2)))
+        self._bits = bytearray(ceil(num_bits / 8))
+
+    @classmethod
+    def from_items(cls, items: Iterable[str], capacity: int, error_rate: float) -> 'BloomFilter':
+        bloom = cls(capacity, error_rate)
+        for item in items:
+            bloom.add(item)
+        return bloom
+
+    def add(self, item: str):
+        for index in self._indexes(item):
+            self._bits[index >> 3] |= 1 << (index & 7)
+
+    def __contains__(self, item: str) -> bool:
+        return all(self._bits[index >> 3] & (1 << (index & 7)) for index in self._indexes(item))
+
+    def _indexes(self, item: str) -> Iterator[int]:
+        digest = blake2b(item.encode('utf-8'), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        for i in range(self._num_hashes):
+            yield (first + i * second) % self._num_bits
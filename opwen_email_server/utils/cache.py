@@ -0,0 +1,316 @@
+from collections import OrderedDict
+from hashlib import sha256
+from os import getpid
+from os import listdir
+from os import makedirs
+from os import replace
+from os import stat
+from os import utime
+from os.path import join
+from sqlite3 import Connection
+from sqlite3 import connect
+from threading import Lock
+from threading import local
+from time import monotonic
+from time import time
+from typing import Dict
+from typing import Optional
+from uuid import uuid4
+
+from opwen_email_server.constants import events
+from opwen_email_server.utils.log import LogMixin
+from opwen_email_server.utils.temporary import remove_if_exists
+
+
+class BytesCache(LogMixin):
+    _stats_interval = 1000
+
+    def __init__(self, max_bytes: int, name: str = 'bytes') -> None:
+        self._max_bytes = max_bytes
+        self._name = name
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[bytes]:
+        value = self._get(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            should_report = (self.hits + self.misses) % self._stats_interval == 0
+
+        if should_report:
+            self.log_event(events.BYTES_CACHE_STATS, {'cache': self._name, **self.stats()})
+        return value
+
+    def put(self, key: str, value: bytes):
+        if len(value) > self._max_bytes:
+            self.log_debug('not caching %s with %d bytes', key, len(value))
+            self.delete(key)
+            return
+        self._put(key, value)
+
+    def delete(self, key: str):
+        raise NotImplementedError  # pragma: no cover
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+    def _get(self, key: str) -> Optional[bytes]:
+        raise NotImplementedError  # pragma: no cover
+
+    def _put(self, key: str, value: bytes):
+        raise NotImplementedError  # pragma: no cover
+
+
+class MemoryBytesCache(BytesCache):
+    def __init__(self, max_bytes: int, name: str = 'bytes') -> None:
+        super().__init__(max_bytes, name)
+        self._entries: OrderedDict = OrderedDict()
+        self._num_bytes = 0
+
+    def delete(self, key: str):
+        with self._lock:
+            value = self._entries.pop(key, None)
+            if value is not None:
+                self._num_bytes -= len(value)
+
+    def _get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def _put(self, key: str, value: bytes):
+        value = bytes(value)
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._num_bytes -= len(previous)
+
+            self._entries[key] = value
+            self._num_bytes += len(value)
+
+            while self._num_bytes > self._max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._num_bytes -= len(evicted)
+                self.evictions += 1
+
+
+class DiskBytesCache(BytesCache):
+    _suffix = '.cache'
+    _low_water_ratio = 0.9
+    _rescan_seconds = 60
+
+    def __init__(self, directory: str, max_bytes: int, name: str = 'bytes') -> None:
+        super().__init__(max_bytes, name)
+        self._directory = directory
+        self._num_bytes: Optional[int] = None
+        self._scanned_at = 0.0
+        makedirs(directory, exist_ok=True)
+
+    def delete(self, key: str):
+        path = self._path(key)
+        size = self._size(path)
+        remove_if_exists(path)
+
+        with self._lock:
+            if self._num_bytes is not None:
+                self._num_bytes = max(self._num_bytes - size, 0)
+
+    def _get(self, key: str) -> Optional[bytes]:
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as fobj:
+                value = fobj.read()
+            utime(path)
+        except FileNotFoundError:
+            return None
+        return value
+
+    def _put(self, key: str, value: bytes):
+        path = self._path(key)
+        temp_path = f'{path}.{uuid4()}.tmp'
+        with open(temp_path, 'wb') as fobj:
+            fobj.write(value)
+        previous_size = self._size(path)
+        replace(temp_path, path)
+
+        with self._lock:
+            if self._num_bytes is None or monotonic() - self._scanned_at > self._rescan_seconds:
+                self._num_bytes = self._scan_size()
+                self._scanned_at = monotonic()
+            else:
+                self._num_bytes += len(value) - previous_size
+
+            if self._num_bytes > self._max_bytes:
+                self._num_bytes = self._evict()
+                self._scanned_at = monotonic()
+
+    def _path(self, key: str) -> str:
+        return join(self._directory, sha256(key.encode('utf-8')).hexdigest() + self._suffix)
+
+    @classmethod
+    def _size(cls, path: str) -> int:
+        try:
+            return stat(path).st_size
+        except FileNotFoundError:
+            return 0
+
+    def _entries(self):
+        for filename in listdir(self._directory):
+            if not filename.endswith(self._suffix):
+                continue
+            path = join(self._directory, filename)
+            try:
+                info = stat(path)
+            except FileNotFoundError:
+                continue
+            yield info.st_mtime, info.st_size, path
+
+    def _scan_size(self) -> int:
+        return sum(size for _, size, _ in self._entries())
+
+    def _evict(self) -> int:
+        entries = list(self._entries())
+        num_bytes = sum(size for _, size, _ in entries)
+        if num_bytes <= self._max_bytes:
+            return num_bytes
+
+        low_water_bytes = int(self._max_bytes * self._low_water_ratio)
+        for _, size, path in sorted(entries):
+            if num_bytes <= low_water_bytes:
+                break
+            remove_if_exists(path)
+            num_bytes -= size
+            self.evictions += 1
+
+        self.log_debug('evicted cache entries down to %d bytes', num_bytes)
+        return num_bytes
+
+
+class TtlCache(LogMixin):
+    def __init__(self, max_entries: int, ttl_seconds: float, negative_ttl_seconds: float) -> None:
+        self._max_entries = max_entries
+        self._ttl_seconds = ttl_seconds
+        self._negative_ttl_seconds = negative_ttl_seconds
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = Lock()
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[str]:
+        try:
+            value = self._get(key)
+        except KeyError:
+            with self._lock:
+                self.misses += 1
+            raise
+
+        with self._lock:
+            if value is None:
+                self.negative_hits += 1
+            else:
+                self.hits += 1
+        return value
+
+    def put(self, key: str, value: Optional[str]):
+        ttl_seconds = self._ttl_seconds if value is not None else self._negative_ttl_seconds
+        if ttl_seconds <= 0:
+            return
+        self._put(key, value, time() + ttl_seconds)
+
+    def delete(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'hits': self.hits,
+            'negative_hits': self.negative_hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+    def _get(self, key: str) -> Optional[str]:
+        with self._lock:
+            value, expires_at = self._entries[key]
+            if expires_at <= time():
+                del self._entries[key]
+                raise KeyError(key)
+            self._entries.move_to_end(key)
+            return value
+
+    def _put(self, key: str, value: Optional[str], expires_at: float):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (value, expires_at)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+
+class SqliteTtlCache(TtlCache):
+    _prune_interval = 100
+    _timeout_seconds = 5
+
+    def __init__(self, path: str, max_entries: int, ttl_seconds: float, negative_ttl_seconds: float) -> None:
+        super().__init__(max_entries, ttl_seconds, negative_ttl_seconds)
+        self._path = path
+        self._local = local()
+        self._num_puts = 0
+
+    @property
+    def _connection(self) -> Connection:
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != getpid():
+            connection = connect(self._path, timeout=self._timeout_seconds, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('CREATE TABLE IF NOT EXISTS entries '
+                               '(key TEXT PRIMARY KEY, value TEXT, expires_at REAL NOT NULL)')
+            self._local.connection = connection
+            self._local.pid = getpid()
+        return connection
+
+    def delete(self, key: str):
+        self._connection.execute('DELETE FROM entries WHERE key = ?', (key, ))
+
+    def _get(self, key: str) -> Optional[str]:
+        row = self._connection.execute('SELECT value, expires_at FROM entries WHERE key = ?', (key, )).fetchone()
+        if row is None or row[1] <= time():
+            raise KeyError(key)
+        return row[0]
+
+    def _put(self, key: str, value: Optional[str], expires_at: float):
+        connection = self._connection
+        connection.execute('INSERT OR REPLACE INTO entries (key, value, expires_at) VALUES (?, ?, ?)',
+                           (key, value, expires_at))
+
+        with self._lock:
+            self._num_puts += 1
+            should_prune = self._num_puts % self._prune_interval == 0
+
+        if should_prune:
+            self._prune(connection)
+
+    def _prune(self, connection: Connection):
+        connection.execute('DELETE FROM entries WHERE expires_at <= ?', (time(), ))
+        num_entries, = connection.execute('SELECT COUNT(*) FROM entries').fetchone()
+        num_evicted = num_entries - self._max_entries
+        if num_evicted > 0:
+            connection.execute(
+                'DELETE FROM entries WHERE key IN '
+                '(SELECT key FROM entries ORDER BY expires_at LIMIT ?)', (num_evicted, ))
+            with self._lock:
+                self.evictions += num_evicted
+            self.log_debug('evicted %d cache entries', num_evicted)
@@ -0,0 +1,215 @@
+from bz2 import BZ2Compressor
+from bz2 import BZ2Decompressor
+from io import BufferedReader
+from io import RawIOBase
+from lzma import FORMAT_XZ
+from lzma import LZMACompressor
+from lzma import LZMADecompressor
+from typing import Callable
+from typing import Dict
+from typing import Iterable
+from typing import Iterator
+from typing import Optional
+from zlib import DEFLATED
+from zlib import MAX_WBITS
+from zlib import compressobj
+from zlib import decompressobj
+
+from lz4.frame import LZ4FrameCompressor
+from lz4.frame import LZ4FrameDecompressor
+from zstandard import ZstdCompressionDict
+from zstandard import ZstdCompressor
+from zstandard import ZstdDecompressor
+from zstandard import ZstdError
+from zstandard import train_dictionary as zstd_train_dictionary
+
+GZIP_WBITS = 16 + MAX_WBITS
+
+
+def _gz_compressor(level: Optional[int]):
+    return compressobj(9 if level is None else level, DEFLATED, GZIP_WBITS)
+
+
+def _bz2_compressor(level: Optional[int]):
+    return BZ2Compressor(9 if level is None else level)
+
+
+def _xz_compressor(level: Optional[int]):
+    return LZMACompressor(format=FORMAT_XZ, preset=level)
+
+
+def _zstd_compressor(level: Optional[int], dictionary: Optional[bytes] = None):
+    dict_data = ZstdCompressionDict(dictionary) if dictionary else None
+    return ZstdCompressor(level=3 if level is None else level, dict_data=dict_data).compressobj()
+
+
+def _lz4_compressor(level: Optional[int]):
+    return _LZ4Compressor(0 if level is None else level)
+
+
+def _none_compressor(level: Optional[int]):
+    return _NoneCompressor()
+
+
+def _gz_decompressor():
+    return decompressobj(GZIP_WBITS)
+
+
+def _bz2_decompressor():
+    return BZ2Decompressor()
+
+
+def _xz_decompressor():
+    return LZMADecompressor(format=FORMAT_XZ)
+
+
+def _zstd_decompressor(dictionary: Optional[bytes] = None):
+    dict_data = ZstdCompressionDict(dictionary) if dictionary else None
+    return ZstdDecompressor(dict_data=dict_data).decompressobj()
+
+
+def _lz4_decompressor():
+    return LZ4FrameDecompressor()
+
+
+def _none_decompressor():
+    return _NoneCompressor()
+
+
+_COMPRESSORS: Dict[str, Callable] = {
+    'gz': _gz_compressor,
+    'bz2': _bz2_compressor,
+    'xz': _xz_compressor,
+    'zstd': _zstd_compressor,
+    'lz4': _lz4_compressor,
+    'none': _none_compressor,
+}
+
+_DECOMPRESSORS: Dict[str, Callable] = {
+    'gz': _gz_decompressor,
+    'bz2': _bz2_decompressor,
+    'xz': _xz_decompressor,
+    'zstd': _zstd_decompressor,
+    'lz4': _lz4_decompressor,
+    'none': _none_decompressor,
+}
+
+COMPRESSION_FORMATS = frozenset(('gz', 'bz2', 'xz', 'zstd'))
+
+BLOB_CODECS = frozenset(_COMPRESSORS)
+
+
+def compress_chunks(chunks: Iterable[bytes],
+                    compression: str,
+                    level: Optional[int] = None,
+                    dictionary: Optional[bytes] = None) -> Iterator[bytes]:
+
+    if dictionary:
+        _ensure_supports_dictionary(compression)
+        compressor = _zstd_compressor(level, dictionary)
+    else:
+        compressor = _COMPRESSORS[compression](level)
+
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+
+    compressed = compressor.flush()
+    if compressed:
+        yield compressed
+
+
+def decompress_chunks(chunks: Iterable[bytes], compression: str, dictionary: Optional[bytes] = None) -> Iterator[bytes]:
+    if dictionary:
+        _ensure_supports_dictionary(compression)
+        decompressor = _zstd_decompressor(dictionary)
+    else:
+        decompressor = _DECOMPRESSORS[compression]()
+
+    for chunk in chunks:
+        decompressed = decompressor.decompress(chunk)
+        if decompressed:
+            yield decompressed
+
+    flush = getattr(decompressor, 'flush', None)
+    if flush is not None:
+        decompressed = flush()
+        if decompressed:
+            yield decompressed
+
+
+def train_dictionary(samples: Iterable[bytes], size: int) -> bytes:
+    samples = list(samples)
+
+    try:
+        return zstd_train_dictionary(size, samples).as_bytes()
+    except ZstdError as ex:
+        raise ValueError(f'Unable to train dictionary from {len(samples)} samples: {ex}') from ex
+
+
+def get_dictionary_id(dictionary: bytes) -> str:
+    return str(ZstdCompressionDict(dictionary).dict_id())
+
+
+def _ensure_supports_dictionary(compression: str):
+    if compression != 'zstd':
+        raise ValueError(f'Compression {compression} does not support dictionaries')
+
+
+def split_chunks(content: bytes, chunk_size: int) -> Iterator[memoryview]:
+    view = memoryview(content)
+    for offset in range(0, len(view), chunk_size):
+        yield view[offset:offset + chunk_size]
+
+
+def open_chunks(chunks: Iterable[bytes]) -> BufferedReader:
+    return BufferedReader(_ChunksReader(chunks))
+
+
+class _LZ4Compressor:
+    def __init__(self, level: int) -> None:
+        self._compressor = LZ4FrameCompressor(compression_level=level)
+        self._header = self._compressor.begin()
+
+    def compress(self, data: bytes) -> bytes:
+        compressed = self._header + self._compressor.compress(data)
+        self._header = b''
+        return compressed
+
+    def flush(self) -> bytes:
+        compressed = self._header + self._compressor.flush()
+        self._header = b''
+        return compressed
+
+
+class _NoneCompressor:
+    def compress(self, data: bytes) -> bytes:
+        return data
+
+    def decompress(self, data: bytes) -> bytes:
+        return data
+
+    def flush(self) -> bytes:
+        return b''
+
+
+class _ChunksReader(RawIOBase):
+    def __init__(self, chunks: Iterable[bytes]) -> None:
+        self._chunks = iter(chunks)
+        self._buffer = memoryview(b'')
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        while not self._buffer:
+            try:
+                self._buffer = memoryview(next(self._chunks))
+            except StopIteration:
+                return 0
+
+        size = min(len(buffer), len(self._buffer))
+        buffer[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return size
@@ -0,0 +1,119 @@
+from collections import deque
+from concurrent.futures import Executor
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
+from os import getpid
+from threading import Event
+from threading import Lock
+from threading import Thread
+from time import monotonic
+from typing import Callable
+from typing import Deque
+from typing import Generic
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import TypeVar
+
+from opwen_email_server.utils.log import LogMixin
+
+T = TypeVar('T')
+U = TypeVar('U')
+
+
+def map_ordered(func: Callable[[T], U], items: Iterable[T], max_workers: int,
+                executor: Optional[Executor] = None) -> Iterator[U]:
+    if max_workers <= 1:
+        yield from map(func, items)
+        return
+
+    if executor is None:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            yield from map_ordered(func, items, max_workers, executor)
+        return
+
+    max_pending = 2 * max_workers
+    pending: Deque[Future] = deque()
+
+    try:
+        for item in items:
+            pending.append(executor.submit(func, item))
+            if len(pending) >= max_pending:
+                yield pending.popleft().result()
+
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+class PeriodicRefresh(LogMixin):
+    def __init__(self, refresh: Callable[[], None], interval_seconds: float) -> None:
+        self._refresh = refresh
+        self._interval_seconds = interval_seconds
+        self._pid: Optional[int] = None
+        self._has_refreshed = False
+        self._lock = Lock()
+        self._stopped = Event()
+
+    @property
+    def enabled(self) -> bool:
+        return self._interval_seconds > 0
+
+    def ensure_started(self):
+        if not self.enabled or self._pid == getpid():
+            return
+
+        with self._lock:
+            if self._pid == getpid():
+                return
+            if not self._has_refreshed:
+                self.refresh()
+            Thread(target=self._refresh_forever, daemon=True).start()
+            self._pid = getpid()
+
+    def refresh(self):
+        try:
+            self._refresh()
+        except Exception as ex:
+            self.log_exception(ex, 'Unable to run periodic refresh')
+        else:
+            self._has_refreshed = True
+
+    def stop(self):
+        self._stopped.set()
+
+    def _refresh_forever(self):
+        while not self._stopped.wait(self._interval_seconds):
+            self.refresh()
+
+
+class Batcher(Generic[T]):
+    def __init__(self, flush: Callable[[List[T]], None], max_size: int, max_wait_seconds: float) -> None:
+        self._flush = flush
+        self._max_size = max_size
+        self._max_wait_seconds = max_wait_seconds
+        self._items: List[T] = []
+        self._started = 0.0
+
+    def add(self, item: T):
+        if not self._items:
+            self._started = monotonic()
+
+        self._items.append(item)
+
+        if len(self._items) >= self._max_size or monotonic() - self._started >= self._max_wait_seconds:
+            self.flush()
+
+    def flush(self):
+        items, self._items = self._items, []
+        if items:
+            self._flush(items)
+
+    def __enter__(self) -> 'Batcher[T]':
+        return self
+
+    def __exit__(self, *args):
+        self.flush()
@@ -1,28 +1,73 @@
-from copy import deepcopy
+from binascii import Error as BinasciiError
+from binascii import a2b_base64
+from binascii import a2b_qp
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
 from datetime import datetime
 from datetime import timezone
+from email.message import Message
+from email.parser import BytesParser
+from email.policy import compat32
 from email.utils import mktime_tz
 from email.utils import parsedate_tz
+from hashlib import sha256
+from html.parser import HTMLParser
 from io import BytesIO
 from itertools import chain
+from mimetypes import guess_extension
 from mimetypes import guess_type
+from re import compile as re_compile
+from re import finditer
+from re import search
+from tempfile import SpooledTemporaryFile
+from threading import BoundedSemaphore
+from threading import Lock
+from time import monotonic
+from time import time
+from typing import IO
 from typing import Callable
+from typing import Dict
 from typing import Iterable
+from typing import Iterator
 from typing import List
 from typing import Optional
 from typing import Tuple
+from urllib.parse import urlparse
+from weakref import WeakValueDictionary
 
-from bs4 import BeautifulSoup
 from PIL import Image
 from pyzmail import PyzMessage
 from pyzmail.parse import MailPart
+from pyzmail.parse import decode_mail_header
+from pyzmail.parse import get_filename
+from pyzmail.parse import get_mail_addresses
+from pyzmail.utils import handle_filename_collision
+from pyzmail.utils import sanitize_filename
 from requests import Response
-from requests import get as http_get
+from requests import Session
+from requests.adapters import HTTPAdapter
 
+from opwen_email_server.config import IMAGE_RESIZE_PROCESSES
 from opwen_email_server.config import MAX_HEIGHT_IMAGES
 from opwen_email_server.config import MAX_WIDTH_IMAGES
+from opwen_email_server.constants.images import IMAGE_REDUCIBLE_MODES
+from opwen_email_server.constants.images import IMAGE_REDUCING_GAP
+from opwen_email_server.constants.images import IMAGE_RESIZE_POOL_MIN_BYTES
+from opwen_email_server.constants.images import INLINE_IMAGE_CHUNK_BYTES
+from opwen_email_server.constants.images import INLINE_IMAGE_MAX_BYTES
+from opwen_email_server.constants.images import INLINE_IMAGE_TIMEOUT_SECONDS
+from opwen_email_server.constants.images import INLINE_IMAGES_MAX_WORKERS
+from opwen_email_server.constants.images import INLINE_IMAGES_MAX_WORKERS_PER_DOMAIN
+from opwen_email_server.constants.images import INLINE_IMAGES_TIMEOUT_SECONDS
+from opwen_email_server.utils.cache import BytesCache
+from opwen_email_server.utils.collections import singleton
+from opwen_email_server.utils.compression import open_chunks
 from opwen_email_server.utils.log import LogMixin
+from opwen_email_server.utils.serialization import from_json
 from opwen_email_server.utils.serialization import to_base64
+from opwen_email_server.utils.serialization import to_json
 
 
 def _parse_body(message: PyzMessage, default_charset: str = 'ascii') -> str:
@@ -51,16 +96,23 @@ def _parse_attachments(mailparts: Iterable[MailPart]) -> Iterable[dict]:
             yield attachment
 
 
-def _parse_addresses(message: PyzMessage, address_type: str) -> List[str]:
-    return sorted(email for _, email in message.get_addresses(address_type) if email)
+def _parse_addresses(message: Message, address_type: str) -> List[str]:
+    return sorted(email for _, email in get_mail_addresses(message, address_type) if email)
 
 
-def _parse_address(message: PyzMessage, address_type: str) -> Optional[str]:
+def _parse_address(message: Message, address_type: str) -> Optional[str]:
     return next(iter(_parse_addresses(message, address_type)), None)
 
 
-def _parse_sent_at(message: PyzMessage) -> Optional[str]:
-    rfc_822 = message.get_decoded_header('date')
+def _parse_header(message: Message, name: str) -> str:
+    value = message.get(name)
+    if value is None:
+        return ''
+    return decode_mail_header(value)
+
+
+def _parse_sent_at(message: Message) -> Optional[str]:
+    rfc_822 = _parse_header(message, 'date')
     if not rfc_822:
         return None
     date_tz = parsedate_tz(rfc_822)
@@ -81,31 +133,223 @@ def parse_mime_email(mime_email: str) -> dict:
         'cc': _parse_addresses(message, 'cc'),
         'bcc': _parse_addresses(message, 'bcc'),
         'from': _parse_address(message, 'from'),
-        'subject': message.get_subject(),
+        'subject': _parse_header(message, 'subject'),
         'body': _parse_body(message),
         'attachments': list(_parse_attachments(message.mailparts)),
     }
 
 
+StoreAttachment = Callable[[dict, IO[bytes]], dict]
+
+
+class _PayloadDecoder:
+    def __init__(self, encoding: str) -> None:
+        self._encoding = encoding
+        self._remainder = b''
+
+    def decode(self, line: bytes) -> bytes:
+        if self._encoding == 'base64':
+            data = self._remainder + line.translate(None, b' \t\r\n')
+            size = len(data) - len(data) % 4
+            self._remainder = data[size:]
+            return self._decode_base64(data[:size])
+        if self._encoding == 'quoted-printable':
+            return a2b_qp(line)
+        return line
+
+    def flush(self) -> bytes:
+        if not self._remainder:
+            return b''
+        data = self._remainder + b'=' * (-len(self._remainder) % 4)
+        self._remainder = b''
+        return self._decode_base64(data)
+
+    @classmethod
+    def _decode_base64(cls, data: bytes) -> bytes:
+        try:
+            return a2b_base64(data)
+        except BinasciiError:
+            return b''
+
+
+class _MimeStreamParser:
+    _body_types = ('text/html', 'text/plain')
+
+    def __init__(self, lines: Iterator[bytes], spool_bytes: int, store_attachment: Optional[StoreAttachment]) -> None:
+        self._lines = lines
+        self._spool_bytes = spool_bytes
+        self._store_attachment = store_attachment
+        self._filenames: List[str] = []
+        self._bodies: Dict[str, Tuple[bytes, Optional[str]]] = {}
+        self._attachments: List[dict] = []
+
+    def __call__(self) -> dict:
+        message = self._read_headers()
+        self._parse_content(message, (), True)
+
+        return {
+            'sent_at': _parse_sent_at(message),
+            'to': _parse_addresses(message, 'to'),
+            'cc': _parse_addresses(message, 'cc'),
+            'bcc': _parse_addresses(message, 'bcc'),
+            'from': _parse_address(message, 'from'),
+            'subject': _parse_header(message, 'subject'),
+            'body': self._parse_body(),
+            'attachments': self._attachments,
+        }
+
+    def _read_headers(self) -> Message:
+        headers = bytearray()
+        for line in self._lines:
+            if line in (b'\r\n', b'\n'):
+                break
+            headers += line
+        return BytesParser(policy=compat32).parsebytes(bytes(headers), headersonly=True)
+
+    def _parse_part(self, boundaries: Tuple[bytes, ...], parent: str, index: int, allow_body: bool) -> Optional[bytes]:
+        message = self._read_headers()
+
+        if parent in ('related', 'report', 'signed'):
+            allow_body = allow_body and index == 0
+        elif parent == 'encrypted':
+            allow_body = False
+        elif parent != 'alternative':
+            allow_body = allow_body and message.get_param('attachment', None, 'content-disposition') != ''
+
+        return self._parse_content(message, boundaries, allow_body)
+
+    def _parse_content(self, message: Message, boundaries: Tuple[bytes, ...], allow_body: bool) -> Optional[bytes]:
+        boundary = message.get_boundary()
+        if message.get_content_maintype() == 'multipart' and boundary:
+            return self._parse_multipart(message, boundaries, b'--' + boundary.encode('ascii', 'replace'), allow_body)
+        return self._parse_leaf(message, boundaries, allow_body)
+
+    def _parse_multipart(self, message: Message, boundaries: Tuple[bytes, ...], delimiter: bytes,
+                         allow_body: bool) -> Optional[bytes]:
+        boundaries = boundaries + (delimiter, )
+        subtype = message.get_content_subtype()
+
+        line = self._skip_until(boundaries)
+        index = 0
+        while line is not None and self._match(line, delimiter) == delimiter:
+            line = self._parse_part(boundaries, subtype, index, allow_body)
+            index += 1
+
+        if line is not None and self._match(line, delimiter):
+            line = self._skip_until(boundaries[:-1])
+        return line
+
+    def _parse_leaf(self, message: Message, boundaries: Tuple[bytes, ...], allow_body: bool) -> Optional[bytes]:
+        content_type = message.get_content_type()
+        filename = self._to_filename(message, content_type)
+        decoder = _PayloadDecoder(str(message.get('content-transfer-encoding', '')).strip().lower())
+
+        if allow_body and content_type in self._body_types and content_type not in self._bodies:
+            body = BytesIO()
+            line = self._read_payload(boundaries, decoder, body)
+            self._bodies[content_type] = (body.getvalue(), message.get_param('charset'))
+            return line
+
+        with SpooledTemporaryFile(max_size=self._spool_bytes) as payload:
+            line = self._read_payload(boundaries, decoder, payload)
+            if payload.tell():
+                self._attachments.append(self._to_attachment(message, filename, payload))
+            return line
+
+    def _read_payload(self, boundaries: Tuple[bytes, ...], decoder: _PayloadDecoder,
+                      payload: IO[bytes]) -> Optional[bytes]:
+        previous = None
+        for line in self._lines:
+            if any(self._match(line, boundary) for boundary in boundaries):
+                if previous is not None:
+                    payload.write(decoder.decode(previous.rstrip(b'\r\n')))
+                payload.write(decoder.flush())
+                return line
+            if previous is not None:
+                payload.write(decoder.decode(previous))
+            previous = line
+
+        if previous is not None:
+            payload.write(decoder.decode(previous.rstrip(b'\r\n') if boundaries else previous))
+        payload.write(decoder.flush())
+        return None
+
+    def _skip_until(self, boundaries: Tuple[bytes, ...]) -> Optional[bytes]:
+        for line in self._lines:
+            if any(self._match(line, boundary) for boundary in boundaries):
+                return line
+        return None
+
+    @classmethod
+    def _match(cls, line: bytes, boundary: bytes) -> Optional[bytes]:
+        if not line.startswith(boundary):
+            return None
+        suffix = line[len(boundary):].rstrip(b' \t\r\n')
+        if suffix == b'':
+            return boundary
+        if suffix == b'--':
+            return line.rstrip(b' \t\r\n')
+        return None
+
+    def _to_filename(self, message: Message, content_type: str) -> str:
+        filename = get_filename(message)
+        if not filename and content_type.startswith('message/'):
+            filename = 'message.eml'
+
+        extension = guess_extension(content_type)
+        if not extension:
+            extension = '.bin'
+        elif extension == '.ksh':
+            extension = '.txt'
+
+        filename = sanitize_filename(filename, content_type.split('/', 1)[0], extension)
+        filename = handle_filename_collision(filename, self._filenames)
+        self._filenames.append(filename.lower())
+        return filename
+
+    def _to_attachment(self, message: Message, filename: str, payload: IO[bytes]) -> dict:
+        content_id = message.get('content-id')
+        if content_id and content_id.startswith('<') and content_id.endswith('>'):
+            content_id = content_id[1:-1]
+
+        size = payload.tell()
+        payload.seek(0)
+        if self._store_attachment and size > self._spool_bytes and not _is_image(filename):
+            attachment = {'filename': filename}
+            if content_id:
+                attachment['cid'] = content_id
+            return self._store_attachment(attachment, payload)
+
+        attachment = {'filename': filename, 'content': payload.read()}
+        if content_id:
+            attachment['cid'] = content_id
+        return attachment
+
+    def _parse_body(self, default_charset: str = 'ascii') -> str:
+        for content_type in self._body_types:
+            body = self._bodies.get(content_type)
+            if body is None:
+                continue
+            payload, charset = body
+            return payload.decode(charset or default_charset, errors='replace')
+        return ''
+
+
+def parse_mime_email_stream(chunks: Iterable[bytes],
+                            spool_bytes: int,
+                            store_attachment: Optional[StoreAttachment] = None) -> dict:
+    with open_chunks(chunks) as lines:
+        return _MimeStreamParser(lines, spool_bytes, store_attachment)()
+
+
 def format_attachments(email: dict) -> dict:
     attachments = email.get('attachments', [])
 
     if not attachments:
         return email
 
-    formatted_attachments = deepcopy(attachments)
-    is_any_attachment_changed = False
-
-    for i, attachment in enumerate(attachments):
-        filename = attachment.get('filename', '')
-        content = attachment.get('content', b'')
-        formatted_content = _format_attachment(filename, content)
-
-        if content != formatted_content:
-            formatted_attachments[i]['content'] = formatted_content
-            is_any_attachment_changed = True
-
-    if not is_any_attachment_changed:
+    formatted_attachments = list(_format_attachments(attachments))
+    if all(formatted is attachment for formatted, attachment in zip(formatted_attachments, attachments)):
         return email
 
     new_email = dict(email)
@@ -113,18 +357,30 @@ def format_attachments(email: dict) -> dict:
     return new_email
 
 
-def _format_attachment(filename: str, content: bytes) -> bytes:
-    attachment_type = guess_type(filename)[0]
+def _format_attachments(attachments: Iterable[dict]) -> Iterator[dict]:
+    for attachment in attachments:
+        filename = attachment.get('filename', '')
+        content = attachment.get('content', b'')
+        formatted_content = _format_attachment(filename, content)
 
-    if not attachment_type:
-        return content
+        if formatted_content is content or formatted_content == content:
+            yield attachment
+        else:
+            yield dict(attachment, content=formatted_content)
 
-    if 'image' in attachment_type.lower():
+
+def _format_attachment(filename: str, content: bytes) -> bytes:
+    if _is_image(filename):
         content = _change_image_size(content)
 
     return content
 
 
+def _is_image(filename: str) -> bool:
+    attachment_type = guess_type(filename)[0]
+    return bool(attachment_type) and 'image' in attachment_type.lower()
+
+
 def get_recipients(email: dict) -> Iterable[str]:
     return chain(email.get('to') or [], email.get('cc') or [], email.get('bcc') or [])
 
@@ -149,7 +405,36 @@ def _is_already_small(size: Tuple[int, int]) -> bool:
     return width <= MAX_WIDTH_IMAGES and height <= MAX_HEIGHT_IMAGES
 
 
+@singleton
+def _get_resize_pool() -> Optional[ProcessPoolExecutor]:
+    if IMAGE_RESIZE_PROCESSES <= 0:
+        return None
+    return ProcessPoolExecutor(max_workers=IMAGE_RESIZE_PROCESSES)
+
+
 def _change_image_size(image_content_bytes: bytes) -> bytes:
+    pool = _get_resize_pool()
+    if pool is None or len(image_content_bytes) < IMAGE_RESIZE_POOL_MIN_BYTES:
+        return _resize_image(image_content_bytes)
+    return pool.submit(_resize_image, image_content_bytes).result()
+
+
+def _reduce_image(image: Image.Image, size: Tuple[int, int]) -> Image.Image:
+    if image.mode not in IMAGE_REDUCIBLE_MODES:
+        return image
+
+    min_width, min_height = size[0] * IMAGE_REDUCING_GAP, size[1] * IMAGE_REDUCING_GAP
+    image.draft(image.mode, (min_width, min_height))
+
+    factor = min(image.width // min_width, image.height // min_height)
+    if factor < 2:
+        return image
+    if hasattr(image, 'reduce'):
+        return image.reduce(factor)
+    return image.resize((image.width // factor, image.height // factor), Image.BOX)
+
+
+def _resize_image(image_content_bytes: bytes) -> bytes:
     image_bytes = BytesIO(image_content_bytes)
     image_bytes.seek(0)
     image = Image.open(image_bytes)
@@ -157,32 +442,208 @@ def _change_image_size(image_content_bytes: bytes) -> bytes:
     if _is_already_small(image.size):
         return image_content_bytes
 
+    image_format = image.format
     new_size = (MAX_WIDTH_IMAGES, MAX_HEIGHT_IMAGES)
-    image.thumbnail(new_size, Image.ANTIALIAS)
+    image = _reduce_image(image, new_size)
+    image.thumbnail(new_size, Image.LANCZOS)
     new_image = BytesIO()
-    image.save(new_image, image.format)
+    image.save(new_image, image_format)
     new_image.seek(0)
     new_image_bytes = new_image.read()
     return new_image_bytes
 
 
-def _fetch_image_to_base64(image_url: str) -> Optional[str]:
-    response = http_get(image_url)
-    if not response.ok:
-        return None
-
-    image_type = _get_image_type(response, image_url)
-    if not image_type:
+@singleton
+def _get_http_session() -> Session:
+    session = Session()
+    adapter = HTTPAdapter(pool_maxsize=INLINE_IMAGES_MAX_WORKERS)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def _read_image(response: Response, deadline: float) -> bytes:
+    content_length = response.headers.get('Content-Length', '')
+    if content_length.isdigit() and int(content_length) > INLINE_IMAGE_MAX_BYTES:
+        raise ValueError(f'image has {content_length} bytes')
+
+    content = bytearray()
+    for chunk in response.iter_content(INLINE_IMAGE_CHUNK_BYTES):
+        content += chunk
+        if len(content) > INLINE_IMAGE_MAX_BYTES:
+            raise ValueError(f'image has more than {INLINE_IMAGE_MAX_BYTES} bytes')
+        if monotonic() > deadline:
+            raise TimeoutError('image download timed out')
+    return bytes(content)
+
+
+class InlineImageCache:
+    def __init__(self, cache: BytesCache) -> None:
+        self._cache = cache
+
+    def get_url(self, image_url: str) -> Optional[dict]:
+        entry = self._cache.get(f'url:{image_url}')
+        if entry is None:
+            return None
+        return from_json(entry.decode('utf-8'))
+
+    def put_url(self, image_url: str, entry: dict):
+        self._cache.put(f'url:{image_url}', to_json(entry).encode('utf-8'))
+
+    def delete_url(self, image_url: str):
+        self._cache.delete(f'url:{image_url}')
+
+    def get_image(self, content_hash: str) -> Optional[str]:
+        encoded = self._cache.get(f'image:{content_hash}')
+        if encoded is None:
+            return None
+        return encoded.decode('ascii')
+
+    def put_image(self, content_hash: str, encoded: str):
+        self._cache.put(f'image:{content_hash}', encoded.encode('ascii'))
+
+
+def _get_max_age(response: Response) -> int:
+    cache_control = response.headers.get('Cache-Control', '').lower()
+    if 'no-cache' in cache_control or 'no-store' in cache_control:
+        return 0
+    max_age = search(r'max-age=(\d+)', cache_control)
+    return int(max_age.group(1)) if max_age else 0
+
+
+def _get_conditional_headers(entry: Optional[dict]) -> Dict[str, str]:
+    if not entry:
+        return {}
+    headers = {}
+    if entry.get('etag'):
+        headers['If-None-Match'] = entry['etag']
+    if entry.get('last_modified'):
+        headers['If-Modified-Since'] = entry['last_modified']
+    return headers
+
+
+def _fetch_image_to_base64(image_url: str, deadline: float, cache: Optional[InlineImageCache] = None) -> Optional[str]:
+    entry = cache.get_url(image_url) if cache else None
+    if cache and entry and entry['expires_at'] > time():
+        cached_image = cache.get_image(entry['sha256'])
+        if cached_image:
+            return f'data:{entry["type"]};base64,{cached_image}'
+
+    deadline = min(deadline, monotonic() + INLINE_IMAGE_TIMEOUT_SECONDS)
+    timeout = deadline - monotonic()
+    if timeout <= 0:
+        raise TimeoutError('image download timed out')
+
+    headers = _get_conditional_headers(entry)
+    with _get_http_session().get(image_url, headers=headers, stream=True, timeout=timeout) as response:
+        if cache and entry and response.status_code == 304:
+            cached_image = cache.get_image(entry['sha256'])
+            if not cached_image:
+                cache.delete_url(image_url)
+                return _fetch_image_to_base64(image_url, deadline, cache)
+            cache.put_url(image_url, dict(entry, expires_at=time() + _get_max_age(response)))
+            return f'data:{entry["type"]};base64,{cached_image}'
+
+        if not response.ok:
+            return None
+
+        image_type = _get_image_type(response, image_url)
+        if not image_type:
+            return None
+
+        content = _read_image(response, deadline)
+
+    if not content:
         return None
 
-    if not response.content:
-        return None
+    content_hash = sha256(content).hexdigest()
+    small_image_base64 = cache.get_image(content_hash) if cache else None
+    if not small_image_base64:
+        small_image_bytes = _change_image_size(content)
+        small_image_base64 = to_base64(small_image_bytes)
+        if cache:
+            cache.put_image(content_hash, small_image_base64)
+
+    if cache:
+        cache.put_url(
+            image_url, {
+                'sha256': content_hash,
+                'type': image_type,
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+                'expires_at': time() + _get_max_age(response),
+            })
 
-    small_image_bytes = _change_image_size(response.content)
-    small_image_base64 = to_base64(small_image_bytes)
     return f'data:{image_type};base64,{small_image_base64}'
 
 
+class _DomainLimits:
+    def __init__(self) -> None:
+        self._limits: WeakValueDictionary = WeakValueDictionary()
+        self._lock = Lock()
+
+    def get(self, hostname: str) -> BoundedSemaphore:
+        with self._lock:
+            limit = self._limits.get(hostname)
+            if limit is None:
+                limit = BoundedSemaphore(INLINE_IMAGES_MAX_WORKERS_PER_DOMAIN)
+                self._limits[hostname] = limit
+            return limit
+
+
+@singleton
+def _get_domain_limits() -> _DomainLimits:
+    return _DomainLimits()
+
+
+@singleton
+def _get_image_executor() -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(max_workers=INLINE_IMAGES_MAX_WORKERS)
+
+
+def _fetch_image_with_limit(image_url: str, limit: BoundedSemaphore, deadline: float,
+                            cache: Optional[InlineImageCache]) -> Optional[str]:
+    if not limit.acquire(timeout=max(0.0, deadline - monotonic())):
+        raise TimeoutError('too many concurrent downloads from domain')
+    try:
+        return _fetch_image_to_base64(image_url, deadline, cache)
+    finally:
+        limit.release()
+
+
+def _fetch_images_to_base64(image_urls: Iterable[str], on_error: Callable,
+                            cache: Optional[InlineImageCache]) -> Dict[str, str]:
+    image_urls = list(dict.fromkeys(image_urls))
+    if not image_urls:
+        return {}
+
+    deadline = monotonic() + INLINE_IMAGES_TIMEOUT_SECONDS
+    limits = _get_domain_limits()
+    executor = _get_image_executor()
+
+    futures = {}
+    for image_url in image_urls:
+        limit = limits.get(urlparse(image_url).hostname or '')
+        futures[executor.submit(_fetch_image_with_limit, image_url, limit, deadline, cache)] = image_url
+    done, not_done = wait(futures, timeout=max(0.0, deadline - monotonic()))
+
+    for future in not_done:
+        future.cancel()
+        on_error('Timed out inlining image %s', futures[future])
+
+    encoded_images = {}
+    for future in done:
+        image_url = futures[future]
+        try:
+            encoded_image = future.result()
+        except Exception as ex:
+            on_error('Unable to inline image %s: %s', image_url, ex)
+        else:
+            if encoded_image:
+                encoded_images[image_url] = encoded_image
+    return encoded_images
+
+
 def _is_valid_url(url: Optional[str]) -> bool:
     if not url:
         return False
@@ -191,38 +652,103 @@ def _is_valid_url(url: Optional[str]) -> bool:
     return has_http_prefix or has_https_prefix
 
 
-def format_inline_images(email: dict, on_error: Callable) -> dict:
+_HTML_ATTRIBUTE = re_compile(r'\s*(?P<name>[^\s/>=]+)(?:\s*=\s*(?P<value>"[^"]*"|\'[^\']*\'|[^\s>]+))?')
+
+_ImageTag = namedtuple('_ImageTag', ['offset', 'text', 'src'])
+
+
+class _ImageTagFinder(HTMLParser):
+    def __init__(self) -> None:
+        super().__init__(convert_charrefs=True)
+        self.image_tags: List[Tuple[Tuple[int, int], str, Optional[str]]] = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'img':
+            self.image_tags.append((self.getpos(), self.get_starttag_text(), dict(attrs).get('src')))
+
+
+def _find_image_tags(html: str) -> List[_ImageTag]:
+    finder = _ImageTagFinder()
+    finder.feed(html)
+    finder.close()
+
+    line_offsets = [0]
+    line_offsets.extend(match.end() for match in finditer('\n', html))
+
+    return [
+        _ImageTag(offset=line_offsets[line - 1] + column, text=text, src=src)
+        for (line, column), text, src in finder.image_tags
+    ]
+
+
+def _replace_image_src(image_tag: str, new_src: str) -> str:
+    src_span = None
+    for attribute in _HTML_ATTRIBUTE.finditer(image_tag, len('<img')):
+        if attribute.group('name').lower() == 'src' and attribute.group('value') is not None:
+            src_span = attribute.span('value')
+
+    if src_span is None:
+        return image_tag
+
+    start, end = src_span
+    return f'{image_tag[:start]}"{new_src}"{image_tag[end:]}'
+
+
+def _replace_image_srcs(html: str, image_tags: Iterable[_ImageTag], new_srcs: Dict[str, str]) -> str:
+    parts = []
+    position = 0
+    for image_tag in image_tags:
+        new_src = new_srcs.get(image_tag.src)
+        if not new_src:
+            continue
+        parts.append(html[position:image_tag.offset])
+        parts.append(_replace_image_src(image_tag.text, new_src))
+        position = image_tag.offset + len(image_tag.text)
+    parts.append(html[position:])
+    return ''.join(parts)
+
+
+def format_inline_images(email: dict, on_error: Callable, cache: Optional[InlineImageCache] = None) -> dict:
     email_body = email.get('body', '')
     if not email_body:
         return email
 
-    soup = BeautifulSoup(email_body, 'html.parser')
-    image_tags = soup.find_all('img')
+    image_tags = _find_image_tags(email_body)
     if not image_tags:
         return email
 
-    for image_tag in image_tags:
-        image_url = image_tag.get('src')
-
-        if not _is_valid_url(image_url):
-            continue
-
-        try:
-            encoded_image = _fetch_image_to_base64(image_url)
-        except Exception as ex:
-            on_error('Unable to inline image %s: %s', image_url, ex)
-        else:
-            if encoded_image:
-                image_tag['src'] = encoded_image
+    image_urls = (image_tag.src for image_tag in image_tags)
+    encoded_images = _fetch_images_to_base64(filter(_is_valid_url, image_urls), on_error, cache)
+    if not encoded_images:
+        return email
 
     new_email = dict(email)
-    new_email['body'] = str(soup)
+    new_email['body'] = _replace_image_srcs(email_body, image_tags, encoded_images)
     return new_email
 
 
 class MimeEmailParser(LogMixin):
+    def __init__(self, image_cache: Optional[InlineImageCache] = None) -> None:
+        self._image_cache = image_cache
+
     def __call__(self, mime_email: str) -> dict:
         email = parse_mime_email(mime_email)
         email = format_attachments(email)
-        email = format_inline_images(email, self.log_warning)
+        email = format_inline_images(email, self.log_warning, self._image_cache)
+        return email
+
+
+class MimeEmailStreamParser(LogMixin):
+    def __init__(self,
+                 spool_bytes: int,
+                 store_attachment: Optional[StoreAttachment] = None,
+                 image_cache: Optional[InlineImageCache] = None) -> None:
+        self._spool_bytes = spool_bytes
+        self._store_attachment = store_attachment
+        self._image_cache = image_cache
+
+    def __call__(self, chunks: Iterable[bytes]) -> dict:
+        email = parse_mime_email_stream(chunks, self._spool_bytes, self._store_attachment)
+        email = format_attachments(email)
+        email = format_inline_images(email, self.log_warning, self._image_cache)
         return email
@@ -1,48 +1,173 @@
 from base64 import b64decode
 from base64 import b64encode
-from gzip import GzipFile
-from io import BytesIO
-from json import JSONDecodeError
 from json import dumps
 from json import loads
+from struct import Struct
+from threading import local
+from typing import IO
+from typing import Callable
+from typing import Dict
+from typing import Iterable
+from typing import Iterator
 from typing import Optional
-
-from msgpack import packb as msgpack_dump
+from typing import Tuple
+from typing import Union
+from zlib import DEFLATED
+from zlib import compressobj
+from zlib import decompressobj
+
+from msgpack import ExtraData
+from msgpack import Packer
+from msgpack import Unpacker
 from msgpack import unpackb as msgpack_load
 
+from opwen_email_server.utils.compression import GZIP_WBITS
+
+try:
+    from orjson import dumps as orjson_dump
+    from orjson import loads as orjson_load
+except ImportError:  # pragma: no cover
+    orjson_dump = None  # type: ignore
+    orjson_load = None  # type: ignore
+
+_FRAME_HEADER = Struct('>I')
+
+_MSGPACK_TRAILER = ord('\n')
+
+_packers = local()
+
+_PACKER_MAX_BUFFER_BYTES = 1024 * 1024
+
+
+def _json_dump(obj) -> bytes:
+    return dumps(obj, separators=(',', ':')).encode('utf-8')
+
+
+def _json_load(encoded: Union[str, bytes]):
+    if isinstance(encoded, bytes):
+        encoded = encoded.decode('utf-8')
+    return loads(encoded)
+
+
+def _orjson_dump(obj) -> bytes:
+    try:
+        return orjson_dump(obj)
+    except TypeError:
+        return _json_dump(obj)
+
+
+_JSON_BACKENDS: Dict[str, Tuple[Callable, Callable]] = {
+    'json': (_json_dump, _json_load),
+}
+
+if orjson_dump is not None:
+    _JSON_BACKENDS['orjson'] = (_orjson_dump, orjson_load)
+
+JSON_BACKENDS = frozenset(_JSON_BACKENDS)
+
+JSON_BACKEND = 'orjson' if 'orjson' in JSON_BACKENDS else 'json'
+
+_dump_json, _load_json = _JSON_BACKENDS[JSON_BACKEND]
+
 
 def to_json(obj: object) -> str:
-    return dumps(obj, separators=(',', ':'))
+    return _dump_json(obj).decode('utf-8')
 
 
 def from_json(obj: str) -> dict:
-    return loads(obj)
+    return _load_json(obj)
 
 
 def to_jsonl_bytes(obj) -> bytes:
-    return to_json(obj).encode('utf-8') + b'\n'
+    return _dump_json(obj) + b'\n'
 
 
 def from_jsonl_bytes(obj: bytes) -> Optional[dict]:
+    if obj.endswith((b',', b',\n')):
+        obj = obj.rstrip(b',\n')
     try:
-        decoded = obj.decode('utf-8')
-    except UnicodeDecodeError:
-        return None
-    decoded = decoded.rstrip(',\n')
-    try:
-        return from_json(decoded)
-    except JSONDecodeError:
+        return _load_json(obj)
+    except ValueError:
         return None
 
 
+def _get_packer() -> Packer:
+    packer = getattr(_packers, 'packer', None)
+    if packer is None:
+        packer = Packer(use_bin_type=True, autoreset=False)
+        _packers.packer = packer
+    return packer
+
+
+def _reset_packer(packer: Packer) -> None:
+    with packer.getbuffer() as buffer:
+        num_bytes = buffer.nbytes
+    if num_bytes > _PACKER_MAX_BUFFER_BYTES:
+        _packers.packer = None
+    else:
+        packer.reset()
+
+
 def to_msgpack_bytes(obj) -> bytes:
-    encoded = msgpack_dump(obj, use_bin_type=True)
-    return encoded + b'\n'
+    packer = _get_packer()
+    try:
+        packer.pack(obj)
+        packer.pack(_MSGPACK_TRAILER)
+        return packer.bytes()
+    finally:
+        _reset_packer(packer)
 
 
 def from_msgpack_bytes(serialized: bytes) -> dict:
-    encoded = serialized.rstrip(b'\n')
-    return msgpack_load(encoded, raw=False)
+    try:
+        return msgpack_load(serialized, raw=False)
+    except ExtraData as ex:
+        if ex.extra != b'\n':
+            raise
+        return ex.unpacked
+
+
+def iter_msgpack_objects(chunks: Iterable[bytes]) -> Iterator[dict]:
+    unpacker = Unpacker(raw=False)
+    after_object = False
+    for chunk in chunks:
+        unpacker.feed(chunk)
+        for obj in unpacker:
+            if after_object and isinstance(obj, int) and obj == _MSGPACK_TRAILER:
+                after_object = False
+                continue
+            after_object = True
+            yield obj
+
+
+def to_msgpack_frame(obj) -> bytes:
+    packer = _get_packer()
+    try:
+        packer.pack(obj)
+        with packer.getbuffer() as encoded:
+            return b''.join((_FRAME_HEADER.pack(len(encoded)), encoded))
+    finally:
+        _reset_packer(packer)
+
+
+def from_msgpack_frame(frame: bytes) -> dict:
+    return msgpack_load(frame, raw=False)
+
+
+def read_frames(fobj: IO[bytes]) -> Iterator[bytes]:
+    while True:
+        header = fobj.read(_FRAME_HEADER.size)
+        if not header:
+            break
+        if len(header) < _FRAME_HEADER.size:
+            raise ValueError('Truncated frame header')
+
+        size, = _FRAME_HEADER.unpack(header)
+        frame = fobj.read(size)
+        if len(frame) < size:
+            raise ValueError(f'Truncated frame: expected {size} bytes, got {len(frame)}')
+
+        yield frame
 
 
 def to_base64(content: bytes) -> str:
@@ -54,18 +179,12 @@ def from_base64(encoded: str) -> bytes:
 
 
 def gzip_bytes(uncompressed_bytes: bytes) -> bytes:
-    stream = BytesIO()
-    with GzipFile(fileobj=stream, mode='wb') as fobj:
-        fobj.write(uncompressed_bytes)  # type: ignore
-    stream.seek(0)
-    compressed = stream.read()
-    return compressed
+    compressor = compressobj(9, DEFLATED, GZIP_WBITS)
+    compressed = compressor.compress(uncompressed_bytes)
+    return compressed + compressor.flush()
 
 
 def gunzip_bytes(compressed: bytes) -> bytes:
-    stream = BytesIO()
-    stream.write(compressed)
-    stream.seek(0)
-    with GzipFile(fileobj=stream, mode='rb') as fobj:
-        uncompressed_bytes = fobj.read()  # type: ignore
-    return uncompressed_bytes
+    decompressor = decompressobj(GZIP_WBITS)
+    uncompressed_bytes = decompressor.decompress(compressed)
+    return uncompressed_bytes + decompressor.flush()
@@ -1,9 +1,13 @@
 from contextlib import contextmanager
 from contextlib import suppress
+from io import BytesIO
 from os import remove
 from os.path import join
+from tempfile import TemporaryFile
 from tempfile import gettempdir
+from typing import IO
 from typing import Generator
+from typing import Iterable
 from typing import Optional
 from uuid import uuid4
 
@@ -26,3 +30,21 @@ def removing(path: str) -> Generator[str, None, None]:
 def remove_if_exists(path: str):
     with suppress(FileNotFoundError):
         remove(path)
+
+
+@contextmanager
+def spool_chunks(chunks: Iterable[bytes], max_size: int) -> Generator[IO[bytes], None, None]:
+    fobj: IO[bytes] = BytesIO()
+    try:
+        for chunk in chunks:
+            if isinstance(fobj, BytesIO) and fobj.tell() + len(chunk) > max_size:
+                spooled = fobj
+                fobj = TemporaryFile()
+                fobj.write(spooled.getvalue())
+                spooled.close()
+            fobj.write(chunk)
+
+        fobj.seek(0)
+        yield fobj
+    finally:
+        fobj.close()
@@ -1,11 +1,79 @@
 from hashlib import sha256
+from struct import pack
 from uuid import uuid4
 
-from opwen_email_server.utils.serialization import to_msgpack_bytes
+from msgpack import packb
+
+
+def _str_header(size: int) -> bytes:
+    if size < 32:
+        return pack('B', 0xa0 | size)
+    if size < 0x100:
+        return pack('>BB', 0xd9, size)
+    if size < 0x10000:
+        return pack('>BH', 0xda, size)
+    return pack('>BI', 0xdb, size)
+
+
+def _bin_header(size: int) -> bytes:
+    if size < 0x100:
+        return pack('>BB', 0xc4, size)
+    if size < 0x10000:
+        return pack('>BH', 0xc5, size)
+    return pack('>BI', 0xc6, size)
+
+
+def _map_header(size: int) -> bytes:
+    if size < 16:
+        return pack('B', 0x80 | size)
+    if size < 0x10000:
+        return pack('>BH', 0xde, size)
+    return pack('>BI', 0xdf, size)
+
+
+def _array_header(size: int) -> bytes:
+    if size < 16:
+        return pack('B', 0x90 | size)
+    if size < 0x10000:
+        return pack('>BH', 0xdc, size)
+    return pack('>BI', 0xdd, size)
+
+
+def _hash_msgpack(digest, obj, canonical: bool):
+    if isinstance(obj, str):
+        encoded = obj.encode('utf-8')
+        digest.update(_str_header(len(encoded)))
+        digest.update(encoded)
+    elif isinstance(obj, (bytes, bytearray, memoryview)):
+        content = memoryview(obj)
+        digest.update(_bin_header(content.nbytes))
+        digest.update(content)
+    elif isinstance(obj, dict):
+        digest.update(_map_header(len(obj)))
+        for key in sorted(obj) if canonical else obj:
+            _hash_msgpack(digest, key, canonical)
+            _hash_msgpack(digest, obj[key], canonical)
+    elif isinstance(obj, (list, tuple)):
+        digest.update(_array_header(len(obj)))
+        for item in obj:
+            _hash_msgpack(digest, item, canonical)
+    else:
+        digest.update(packb(obj, use_bin_type=True))
+
+
+def _hash_email(email: dict, canonical: bool) -> str:
+    digest = sha256()
+    _hash_msgpack(digest, email, canonical)
+    digest.update(b'\n')
+    return digest.hexdigest()
 
 
 def new_email_id(email: dict) -> str:
-    return sha256(to_msgpack_bytes(email)).hexdigest()
+    return _hash_email(email, canonical=False)
+
+
+def new_canonical_email_id(email: dict) -> str:
+    return _hash_email(email, canonical=True)
 
 
 def new_client_id() -> str:
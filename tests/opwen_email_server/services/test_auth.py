@@ -1,6 +1,7 @@
 from shutil import rmtree
 from tempfile import mkdtemp
 from unittest import TestCase
+from unittest.mock import patch
 
 from opwen_email_server.services.auth import AzureAuth
 from opwen_email_server.services.auth import BasicAuth
@@ -57,3 +58,162 @@ class AzureAuthTests(TestCase):
         self.assertEqual(self._auth.client_id_for('domain'), 'client')
         self.assertIsNone(self._auth.domain_for('unknown-client'))
         self.assertIsNone(self._auth.client_id_for('unknown-client'))
+
+    def test_caches_lookups(self):
+        self._auth.insert('client', 'domain')
+
+        with patch.object(self._auth._storage, 'fetch_text') as mock_fetch:
+            self.assertEqual(self._auth.domain_for('client'), 'domain')
+            self.assertEqual(self._auth.client_id_for('domain'), 'client')
+
+        self.assertFalse(mock_fetch.called)
+
+    def test_caches_unknown_clients(self):
+        with patch.object(self._auth._storage, 'fetch_text', wraps=self._auth._storage.fetch_text) as mock_fetch:
+            self.assertIsNone(self._auth.domain_for('unknown-client'))
+            self.assertIsNone(self._auth.domain_for('unknown-client'))
+
+        self.assertEqual(mock_fetch.call_count, 1)
+        self.assertEqual(self._auth.cache_stats()['negative_hits'], 1)
+
+    def test_insert_replaces_negative_entries(self):
+        self.assertIsNone(self._auth.client_id_for('domain'))
+
+        self._auth.insert('client', 'domain')
+
+        self.assertEqual(self._auth.client_id_for('domain'), 'client')
+
+    def test_lists_domains(self):
+        self._auth.insert('e8e5caa4-4ee6-4e7f-99c9-e231b6a27a9f', 'foo.com')
+        self._auth.insert('1de2ceb6-4f82-4cad-86ac-815bcbcb801c', 'bar.com')
+
+        self.assertEqual(sorted(self._auth.domains()), ['bar.com', 'foo.com'])
+
+
+class AzureAuthSnapshotTests(TestCase):
+    def setUp(self):
+        self._folder = mkdtemp()
+        self._storage = AzureTextStorage(
+            account=self._folder,
+            key='key',
+            container='auth',
+            provider='LOCAL',
+        )
+        self._auth = AzureAuth(storage=self._storage, snapshot_refresh_seconds=3600)
+
+    def tearDown(self):
+        self._auth.stop_refresh()
+        rmtree(self._folder)
+
+    def test_serves_lookups_from_snapshot(self):
+        AzureAuth(storage=self._storage).insert('client', 'domain')
+
+        self.assertEqual(self._auth.domain_for('client'), 'domain')
+
+        with patch.object(self._storage, 'fetch_text', side_effect=Exception('storage is down')):
+            self.assertEqual(self._auth.domain_for('client'), 'domain')
+            self.assertEqual(self._auth.client_id_for('domain'), 'client')
+
+    def test_refreshes_only_changed_entries(self):
+        other = AzureAuth(storage=self._storage)
+        other.insert('client1', 'domain1')
+        self._auth.refresh_snapshot()
+        other.insert('client2', 'domain2')
+
+        with patch.object(self._storage, 'fetch_text_many', wraps=self._storage.fetch_text_many) as mock_fetch:
+            self._auth.refresh_snapshot()
+
+        self.assertEqual(sorted(mock_fetch.call_args[0][0]), ['client2', 'domain2'])
+        self.assertEqual(self._auth.domain_for('client2'), 'domain2')
+
+    def test_falls_back_to_storage_for_entries_missing_in_snapshot(self):
+        self.assertIsNone(self._auth.domain_for('client'))
+
+        AzureAuth(storage=self._storage).insert('client', 'domain')
+
+        self.assertEqual(self._auth.client_id_for('domain'), 'client')
+
+    def test_keeps_snapshot_when_refresh_fails(self):
+        self._auth.insert('client', 'domain')
+        self._auth.refresh_snapshot()
+
+        with patch.object(self._storage, 'iter', side_effect=Exception('storage is down')):
+            self._auth._snapshot_refresh.refresh()
+
+        self.assertEqual(self._auth.domain_for('client'), 'domain')
+
+
+class AzureAuthFilterTests(TestCase):
+    def setUp(self):
+        self._folder = mkdtemp()
+        self._storage = AzureTextStorage(
+            account=self._folder,
+            key='key',
+            container='auth',
+            provider='LOCAL',
+        )
+        AzureAuth(storage=self._storage).insert('client1', 'domain1')
+        self._auth = AzureAuth(storage=self._storage, filter_refresh_seconds=3600)
+
+    def tearDown(self):
+        self._auth.stop_refresh()
+        rmtree(self._folder)
+
+    def test_rejects_filter_misses_without_io(self):
+        self.assertEqual(self._auth.domain_for('client1'), 'domain1')
+
+        with patch.object(self._storage, 'fetch_text', wraps=self._storage.fetch_text) as mock_fetch:
+            for _ in range(100):
+                self.assertIsNone(self._auth.domain_for('unknown'))
+
+        mock_fetch.assert_not_called()
+        with self.assertRaises(KeyError):
+            self._auth._cache.get('unknown')
+
+    def test_rejects_clients_registered_elsewhere_until_refresh(self):
+        self.assertEqual(self._auth.domain_for('client1'), 'domain1')
+        AzureAuth(storage=self._storage).insert('client2', 'domain2')
+
+        self.assertIsNone(self._auth.domain_for('client2'))
+
+        self._auth.refresh_filter()
+
+        self.assertEqual(self._auth.domain_for('client2'), 'domain2')
+
+    def test_keeps_inserts_made_during_refresh(self):
+        self.assertEqual(self._auth.domain_for('client1'), 'domain1')
+        list_resources = self._storage.iter
+
+        def insert_while_listing(*args, **kwargs):
+            resource_ids = list(list_resources(*args, **kwargs))
+            self._auth.insert('client2', 'domain2')
+            return iter(resource_ids)
+
+        with patch.object(self._storage, 'iter', side_effect=insert_while_listing):
+            self._auth.refresh_filter()
+
+        self.assertIn('client2', self._auth._filter)
+        self.assertIn('domain2', self._auth._filter)
+
+    def test_accepts_clients_registered_through_insert(self):
+        self.assertIsNone(self._auth.domain_for('client2'))
+
+        self._auth.insert('client2', 'domain2')
+
+        self.assertEqual(self._auth.domain_for('client2'), 'domain2')
+
+    def test_includes_clients_registered_elsewhere_after_refresh(self):
+        self.assertIsNone(self._auth.domain_for('client2'))
+        AzureAuth(storage=self._storage).insert('client2', 'domain2')
+
+        self._auth.refresh_filter()
+
+        self.assertIn('client2', self._auth._filter)
+
+    def test_falls_back_to_storage_when_filter_is_unavailable(self):
+        auth = AzureAuth(storage=self._storage, filter_refresh_seconds=3600)
+
+        with patch.object(self._storage, 'iter', side_effect=Exception('storage is down')):
+            self.assertEqual(auth.domain_for('client1'), 'domain1')
+
+        auth.stop_refresh()
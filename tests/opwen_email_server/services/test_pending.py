@@ -0,0 +1,206 @@
+from os import mkdir
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import TestCase
+from unittest.mock import patch
+
+from opwen_email_server.services.pending import NO_PENDING
+from opwen_email_server.services.pending import AzurePendingIndex
+from opwen_email_server.services.pending import LocalPendingIndex
+from opwen_email_server.services.storage import AzureTextStorage
+
+
+class _PendingIndexTests:
+    def test_reads_appended_batches_in_order(self):
+        self._index.append('foo.com', ['1', '2'])
+        self._index.append('bar.com', ['3'])
+        self._index.append('foo.com', ['4'])
+
+        email_ids, entry_ids = self._index.read('foo.com')
+
+        self.assertEqual(email_ids, ['1', '2', '4'])
+        self.assertTrue(entry_ids)
+
+    def test_reads_limited_entries(self):
+        self._index.append('foo.com', ['1'])
+        self._index.append('foo.com', ['2'])
+        self._index.append('foo.com', ['3'])
+
+        email_ids, entry_ids = self._index.read('foo.com', limit=1)
+        self.assertEqual(email_ids, ['1'])
+        self._index.acknowledge('foo.com', entry_ids)
+
+        email_ids, entry_ids = self._index.read('foo.com', limit=5)
+        self.assertEqual(email_ids, ['2', '3'])
+        self._index.acknowledge('foo.com', entry_ids)
+
+        self.assertEqual(self._index.read('foo.com'), ([], []))
+
+    def test_limits_reads_by_batches(self):
+        self._index.append('foo.com', ['1', '2'])
+        self._index.append('foo.com', ['3'])
+
+        email_ids, batch_ids = self._index.read('foo.com', limit=1)
+
+        self.assertEqual(email_ids, ['1', '2'])
+        self.assertEqual(len(batch_ids), 1)
+
+    def test_returns_one_batch_per_append(self):
+        batch_id = self._index.append('foo.com', ['1', '2', '3'])
+
+        self.assertEqual(self._index.read('foo.com'), (['1', '2', '3'], [batch_id]))
+        self.assertEqual(self._index.acknowledge('foo.com', [batch_id]), 1)
+        self.assertEqual(self._index.count('foo.com'), 0)
+
+    def test_acknowledges_read_entries(self):
+        self._index.append('foo.com', ['1'])
+        self._index.append('foo.com', ['2'])
+        _, entry_ids = self._index.read('foo.com')
+        self._index.append('foo.com', ['3'])
+
+        num_acknowledged = self._index.acknowledge('foo.com', entry_ids)
+
+        self.assertEqual(num_acknowledged, 2)
+        self.assertEqual(self._index.read('foo.com')[0], ['3'])
+        self.assertEqual(self._index.count('foo.com'), 1)
+
+    def test_counts(self):
+        self._index.append('foo.com', ['1', '2'])
+        self._index.append('foo.com', ['3'])
+        self._index.append('bar.com', ['4'])
+
+        self.assertEqual(self._index.count('foo.com'), 3)
+        self.assertEqual(self._index.count('baz.com'), 0)
+
+    def test_calculates_stats(self):
+        self._index.append('foo.com', ['1', '2'], 100)
+        self._index.append('foo.com', ['3'], 20)
+        self._index.append('bar.com', ['4'], 5)
+        _, entry_ids = self._index.read('bar.com')
+        self._index.acknowledge('bar.com', entry_ids)
+
+        stats = self._index.stats('foo.com')
+
+        self.assertEqual(stats.pending_emails, 3)
+        self.assertEqual(stats.pending_bytes, 120)
+        self.assertIsNotNone(stats.oldest_pending_ns)
+        self.assertEqual(self._index.stats('bar.com'), NO_PENDING)
+
+    def test_calculates_stats_for_all_domains(self):
+        self._index.append('foo.com', ['1', '2'], 100)
+        self._index.append('bar.com', ['3'], 20)
+
+        stats = self._index.stats_all()
+
+        self.assertEqual(sorted(stats), ['bar.com', 'foo.com'])
+        self.assertEqual(stats['foo.com'].pending_emails, 2)
+        self.assertEqual(stats['bar.com'].pending_bytes, 20)
+
+    def test_ignores_empty_append(self):
+        self.assertIsNone(self._index.append('foo.com', []))
+        self.assertEqual(self._index.read('foo.com'), ([], []))
+
+
+class AzurePendingIndexTests(_PendingIndexTests, TestCase):
+    def test_does_not_read_unsettled_batches(self):
+        index = AzurePendingIndex(self._storage, settle_seconds=60)
+        index.append('foo.com', ['1'])
+
+        self.assertEqual(index.read('foo.com'), ([], []))
+
+    def test_keeps_late_entries_when_acknowledging(self):
+        with patch('opwen_email_server.services.pending.time_ns', return_value=2000000000000):
+            self._index.append('foo.com', ['2'])
+        _, entry_ids = self._index.read('foo.com')
+        with patch('opwen_email_server.services.pending.time_ns', return_value=1000000000000):
+            self._index.append('foo.com', ['1'])
+
+        self._index.acknowledge('foo.com', entry_ids)
+
+        self.assertEqual(self._index.read('foo.com')[0], ['1'])
+
+    def test_stores_one_blob_per_append(self):
+        email_ids = [f'id-{i}' for i in range(100)]
+
+        with patch.object(self._storage, 'store_text', wraps=self._storage.store_text) as mock_store_text:
+            self._index.append('foo.com', email_ids)
+
+        batch_resource_ids = [args[0] for (args, _) in mock_store_text.call_args_list if args[0].startswith('foo.com/')]
+        self.assertEqual(len(batch_resource_ids), 1)
+        self.assertEqual(list(self._storage.iter('foo.com/')), batch_resource_ids)
+
+        read_email_ids, batch_ids = self._index.read('foo.com')
+        self.assertEqual(read_email_ids, email_ids)
+        self.assertEqual(self._index.acknowledge('foo.com', batch_ids), 1)
+        self.assertEqual(list(self._storage.iter('foo.com/')), [])
+
+    def test_calculates_stats_from_batch_listing(self):
+        for i in range(5):
+            self._index.append('foo.com', [str(i)], 10)
+        self._index.append('bar.com', ['5'], 10)
+
+        with patch.object(self._storage, 'iter', wraps=self._storage.iter) as mock_iter, \
+                patch.object(self._storage, 'fetch_text') as mock_fetch_text, \
+                patch.object(self._storage, 'fetch_text_many') as mock_fetch_text_many:
+            stats = self._index.stats('foo.com')
+            all_stats = self._index.stats_all()
+
+        self.assertEqual(stats.pending_emails, 5)
+        self.assertEqual(stats.pending_bytes, 50)
+        self.assertEqual(all_stats['foo.com'], stats)
+        self.assertEqual(mock_iter.call_count, 2)
+        mock_fetch_text.assert_not_called()
+        mock_fetch_text_many.assert_not_called()
+
+    def test_appends_with_one_write_and_no_reads(self):
+        self._index.append('foo.com', ['1'], 10)
+
+        with patch.object(self._storage, 'store_text', wraps=self._storage.store_text) as mock_store_text, \
+                patch.object(self._storage, 'iter') as mock_iter, \
+                patch.object(self._storage, 'fetch_text') as mock_fetch_text:
+            self._index.append('foo.com', ['2', '3'], 20)
+
+        self.assertEqual(mock_store_text.call_count, 1)
+        mock_iter.assert_not_called()
+        mock_fetch_text.assert_not_called()
+        self.assertEqual(self._index.stats('foo.com').pending_emails, 3)
+        self.assertEqual(self._index.stats('foo.com').pending_bytes, 30)
+
+    def test_updates_stats_on_acknowledge(self):
+        self._index.append('foo.com', ['1'], 10)
+        self._index.append('foo.com', ['2'], 20)
+        _, entry_ids = self._index.read('foo.com', limit=1)
+
+        self._index.acknowledge('foo.com', entry_ids)
+
+        stats = self._index.stats('foo.com')
+        self.assertEqual(stats.pending_emails, 1)
+        self.assertEqual(stats.pending_bytes, 20)
+        self.assertEqual(stats.oldest_pending_ns, int(self._index.read('foo.com')[1][0].split('-')[0]))
+
+    def test_counts_bytes_of_whole_batch(self):
+        self._index.append('foo.com', ['1', '2', '3'], 10)
+
+        self.assertEqual(self._index.stats('foo.com').pending_bytes, 10)
+
+    def setUp(self):
+        self._folder = mkdtemp()
+        self._container = 'pending'
+        mkdir(join(self._folder, self._container))
+        self._storage = AzureTextStorage(
+            account=self._folder,
+            key='unused',
+            container=self._container,
+            provider='LOCAL',
+        )
+        self._storage._max_workers = 1
+        self._index = AzurePendingIndex(self._storage, settle_seconds=0)
+
+    def tearDown(self):
+        rmtree(self._folder)
+
+
+class LocalPendingIndexTests(_PendingIndexTests, TestCase):
+    def setUp(self):
+        self._index = LocalPendingIndex()
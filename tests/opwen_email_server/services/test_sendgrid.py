@@ -1,3 +1,10 @@
+from hashlib import sha256
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from json import dumps
+from json import loads
+from threading import Thread
+from typing import List
 from typing import Optional
 from unittest import TestCase
 from unittest import skipUnless
@@ -97,6 +104,154 @@ class SendgridEmailSenderTests(TestCase):
             mock_response.getcode.return_value = status
 
 
+class FakeSendgridHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        request = loads(self.rfile.read(int(self.headers['Content-Length'])))
+        self.server.requests.append(request)
+
+        errors = []
+        for index, personalization in enumerate(request.get('personalizations', [])):
+            if any(to['email'].startswith('invalid') for to in personalization.get('to', [])):
+                errors.append({'field': f'personalizations.{index}.to', 'message': 'Invalid address.'})
+
+        if self.server.failure_status:
+            self._respond(self.server.failure_status, {'errors': [{'message': 'unavailable'}]})
+        elif errors:
+            self._respond(400, {'errors': errors})
+        else:
+            self._respond(202, None)
+
+    def _respond(self, status: int, body: Optional[dict]):
+        content = dumps(body).encode('utf-8') if body else b''
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args):
+        pass
+
+
+class SendgridEmailBatchSenderTests(TestCase):
+    sender = 'sendgridtests@lokole.ca'
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), FakeSendgridHandler)
+        self.server.requests = []
+        self.server.failure_status = None
+        Thread(target=self.server.serve_forever, kwargs={'poll_interval': 0.01}, daemon=True).start()
+        self.send_email = SendSendgridEmail(key='fake', host=f'http://127.0.0.1:{self.server.server_port}')
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_sends_emails_with_same_content_in_one_request(self):
+        emails = [self.given_email(f'email{index}', to=[f'user{index}@lokole.ca']) for index in range(3)]
+
+        results = self.send_email.send_batch(emails)
+
+        self.assertEqual(results, [True, True, True])
+        self.assertEqual(len(self.requests), 1)
+        personalizations = self.requests[0]['personalizations']
+        self.assertEqual([p['to'] for p in personalizations], [[{'email': f'user{i}@lokole.ca'}] for i in range(3)])
+        self.assertEqual([p['custom_args'] for p in personalizations], [{'email_id': f'email{i}'} for i in range(3)])
+        self.assertEqual([p['subject'] for p in personalizations], [f'subject email{i}' for i in range(3)])
+        self.assertEqual(self.requests[0]['content'], [{'type': 'text/html', 'value': 'body'}])
+
+    def test_sends_emails_with_different_content_separately(self):
+        emails = [
+            self.given_email('email1', body='first'),
+            self.given_email('email2', body='second'),
+            self.given_email('email3', body='first', attachments=[{'filename': 'a.txt', 'content': b'a'}]),
+            self.given_email('email4', body='first'),
+        ]
+
+        results = self.send_email.send_batch(emails)
+
+        self.assertEqual(results, [True, True, True, True])
+        self.assertEqual(len(self.requests), 3)
+        self.assertEqual([len(request['personalizations']) for request in self.requests], [2, 1, 1])
+        self.assertEqual(self.requests[2]['attachments'][0]['content'], 'YQ==')
+
+    def test_batches_emails_by_attachment_content(self):
+        emails = [
+            self.given_email('email1', attachments=[{'filename': 'a.txt', 'content': b'a'}]),
+            self.given_email('email2', attachments=[{'filename': 'a.txt', 'content': memoryview(b'a')}]),
+            self.given_email('email3', attachments=[{'filename': 'a.txt', 'content': b'b'}]),
+        ]
+
+        batches = SendSendgridEmail._create_batches(emails)
+
+        self.assertEqual(batches, [[0, 1], [2]])
+
+    def test_hashes_shared_attachment_content_once(self):
+        content = b'a' * 1024
+        emails = [self.given_email(f'email{index}', attachments=[{'content': content}]) for index in range(3)]
+
+        with patch('opwen_email_server.services.sendgrid.sha256', wraps=sha256) as hasher:
+            batches = SendSendgridEmail._create_batches(emails)
+
+        self.assertEqual(batches, [[0, 1, 2]])
+        self.assertEqual(hasher.call_count, 1)
+
+    def test_sends_single_email_like_unbatched_send(self):
+        email = self.given_email('email1', cc=['cc@lokole.ca'], bcc=['bcc@lokole.ca'])
+
+        self.send_email.send_batch([email])
+        self.send_email(email)
+
+        self.assertEqual(len(self.requests), 2)
+        self.assertEqual(self.requests[0], self.requests[1])
+
+    def test_splits_batches_at_recipient_limit(self):
+        recipients = [f'user{index}@lokole.ca' for index in range(400)]
+        emails = [self.given_email(f'email{index}', to=recipients) for index in range(3)]
+
+        results = self.send_email.send_batch(emails)
+
+        self.assertEqual(results, [True, True, True])
+        self.assertEqual([len(request['personalizations']) for request in self.requests], [2, 1])
+
+    def test_attributes_rejected_emails(self):
+        emails = [
+            self.given_email('email1'),
+            self.given_email('email2', to=['invalid@lokole.ca']),
+            self.given_email('email3'),
+        ]
+
+        with patch.object(self.send_email, 'log_exception'), patch.object(self.send_email, 'log_warning'):
+            results = self.send_email.send_batch(emails)
+
+        self.assertEqual(results, [True, False, True])
+        self.assertEqual([len(request['personalizations']) for request in self.requests], [3, 1, 1, 1])
+
+    def test_fails_whole_batch_when_service_is_unavailable(self):
+        emails = [self.given_email('email1'), self.given_email('email2')]
+        self.server.failure_status = 503
+
+        with patch.object(self.send_email, 'log_exception'):
+            results = self.send_email.send_batch(emails)
+
+        self.assertEqual(results, [False, False])
+        self.assertEqual(len(self.requests), 1)
+
+    @property
+    def requests(self) -> List[dict]:
+        return self.server.requests
+
+    def given_email(self, email_id: str, body: str = 'body', to: List[str] = None, **kwargs) -> dict:
+        email = {
+            '_uid': email_id,
+            'from': self.sender,
+            'to': to or ['clemens@lokole.ca'],
+            'subject': f'subject {email_id}',
+            'body': body,
+        }
+        email.update(kwargs)
+        return email
+
+
 @skipUnless(SENDGRID_KEY, 'no sendgrid key configured')
 class LiveSendgridEmailSenderTests(SendgridEmailSenderTests):
     def assertSendsEmail(self, email: dict, success: bool = True, **kwargs):
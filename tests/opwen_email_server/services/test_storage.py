@@ -1,29 +1,40 @@
 from io import BytesIO
 from os import listdir
 from os import mkdir
+from os import urandom
 from os import remove
 from os.path import isdir
 from os.path import join
 from pathlib import Path
 from shutil import rmtree
 from tarfile import TarInfo
+from tarfile import open as tarfile_open
 from tempfile import NamedTemporaryFile
 from tempfile import mkdtemp
 from unittest import TestCase
+from unittest.mock import Mock
 from unittest.mock import PropertyMock
 from unittest.mock import patch
 
+from libcloud.storage.base import Container
 from libcloud.storage.types import ContainerAlreadyExistsError
 from libcloud.storage.types import ContainerDoesNotExistError
 from libcloud.storage.types import ObjectDoesNotExistError
-from xtarfile import open as tarfile_open
 
+from opwen_email_server.services.storage import AzureAttachmentStorage
+from opwen_email_server.services.storage import AzureDictionaryStorage
 from opwen_email_server.services.storage import AzureFileStorage
 from opwen_email_server.services.storage import AzureObjectStorage
 from opwen_email_server.services.storage import AzureObjectsStorage
 from opwen_email_server.services.storage import AzureTextStorage
+from opwen_email_server.utils.cache import MemoryBytesCache
+from opwen_email_server.utils.compression import BLOB_CODECS
+from opwen_email_server.utils.compression import train_dictionary
 from opwen_email_server.utils.serialization import from_jsonl_bytes
+from opwen_email_server.utils.serialization import from_msgpack_frame
+from opwen_email_server.utils.serialization import read_frames
 from opwen_email_server.utils.serialization import to_jsonl_bytes
+from opwen_email_server.utils.serialization import to_msgpack_frame
 from opwen_email_server.utils.temporary import create_tempfilename
 from opwen_email_server.utils.temporary import removing
 
@@ -41,6 +52,62 @@ class AzureTextStorageTests(TestCase):
         with self.assertRaises(ObjectDoesNotExistError):
             self._storage.fetch_text(resource_id)
 
+    def test_deletes_many_texts_ignoring_missing(self):
+        resource_ids = [f'id{i}' for i in range(10)]
+        for resource_id in resource_ids:
+            self._storage.store_text(resource_id, 'some content')
+
+        num_deleted = self._storage.delete_many(resource_ids + ['missing'], max_workers=4)
+
+        self.assertEqual(num_deleted, 10)
+        self.assertEqual(list(self._storage.iter()), [])
+
+    def test_deletes_single_resource_without_pool(self):
+        self._storage.store_text('id1', 'some content')
+
+        num_deleted = self._storage.delete_many(['id1'])
+
+        self.assertEqual(num_deleted, 1)
+        self.assertIsNone(self._storage._executor_instance)
+
+    def test_deletes_many_legacy_gz_after_codec_change(self):
+        self._storage.store_text('legacy', 'some content')
+        storage = AzureTextStorage(
+            account=self._folder,
+            key='unused',
+            container=self._container,
+            provider='LOCAL',
+            compression='zstd',
+        )
+
+        num_deleted = storage.delete_many(['legacy'])
+
+        self.assertEqual(num_deleted, 1)
+        self.assertEqual(listdir(join(self._folder, self._container)), [])
+
+    def test_fetches_chunks(self):
+        self._storage.store_text('id1', 'some content' * 1000)
+
+        chunks = self._storage.fetch_chunks('id1')
+
+        self.assertEqual(b''.join(chunks), b'some content' * 1000)
+
+    def test_fetches_bytes(self):
+        self._storage.store_text('id1', 'some content')
+
+        content = self._storage.fetch_bytes('id1')
+
+        self.assertIs(type(content), bytes)
+
+    def test_stores_and_fetches_text_larger_than_chunk_size(self):
+        resource_id, expected_content = 'id1', 'some content' * 1000
+
+        with patch.object(self._storage, '_chunk_size', 100):
+            self._storage.store_text(resource_id, expected_content)
+            actual_content = self._storage.fetch_text(resource_id)
+
+        self.assertEqual(actual_content, expected_content)
+
     def test_list(self):
         self._storage.store_text('resource1', 'a')
         self._storage.store_text('resource2.txt.gz', 'b')
@@ -49,6 +116,60 @@ class AzureTextStorageTests(TestCase):
         self._storage.delete('resource2')
         self.assertEqual(sorted(self._storage.iter()), sorted(['resource1']))
 
+    def test_lists_resources_with_dots_and_prefix(self):
+        self._storage.store_text('foo.com', 'a')
+        self._storage.store_text('bar.com/1', 'b')
+
+        self.assertEqual(sorted(self._storage.iter()), ['bar.com/1', 'foo.com'])
+        self.assertEqual(list(self._storage.iter('bar.com/')), ['bar.com/1'])
+
+    def test_stores_and_fetches_text_with_all_codecs(self):
+        for compression in BLOB_CODECS:
+            with self.subTest(compression=compression):
+                storage = self._create_storage(compression)
+
+                storage.store_text('id1', 'some content')
+
+                self.assertEqual(storage.fetch_text('id1'), 'some content')
+                self.assertEqual(list(storage.iter()), ['id1'])
+                storage.delete('id1')
+
+    def test_rejects_unknown_codec(self):
+        with self.assertRaises(ValueError):
+            self._create_storage('gzip')
+
+    def test_writes_codec_into_filename(self):
+        storage = self._create_storage('zstd')
+
+        storage.store_text('id1', 'some content')
+
+        self.assertEqual(listdir(join(self._folder, self._container)), ['id1.txt.zstd'])
+
+    def test_fetches_and_deletes_legacy_gz_after_codec_change(self):
+        self._storage.store_text('id1', 'some content')
+        storage = self._create_storage('lz4')
+
+        self.assertEqual(storage.fetch_text('id1'), 'some content')
+
+        storage.delete('id1')
+        with self.assertRaises(ObjectDoesNotExistError):
+            storage.fetch_text('id1')
+
+    def test_fetches_and_deletes_blobs_of_any_previous_codec(self):
+        self._create_storage('zstd').store_text('id1', 'some content')
+        storage = self._create_storage('lz4')
+
+        self.assertEqual(storage.fetch_text('id1'), 'some content')
+
+        storage.delete('id1')
+        self.assertEqual(listdir(join(self._folder, self._container)), [])
+
+    def test_fetches_with_explicit_codec_in_name(self):
+        storage = self._create_storage('none')
+        storage.store_text('id1', 'some content')
+
+        self.assertEqual(self._storage.fetch_text('id1.txt'), 'some content')
+
     def test_ensure_exists(self):
         self.assertFalse(isdir(join(self._folder, self._container)))
         self._storage.ensure_exists()
@@ -75,16 +196,20 @@ class AzureTextStorageTests(TestCase):
 
             self.assertIs(self._storage._client, container)
 
-    def setUp(self):
-        self._folder = mkdtemp()
-        self._container = 'container'
-        self._storage = AzureTextStorage(
+    def _create_storage(self, compression=None):
+        return AzureTextStorage(
             account=self._folder,
             key='key',
             container=self._container,
             provider='LOCAL',
+            compression=compression,
         )
 
+    def setUp(self):
+        self._folder = mkdtemp()
+        self._container = 'container'
+        self._storage = self._create_storage()
+
     def tearDown(self):
         rmtree(self._folder)
 
@@ -104,6 +229,24 @@ class AzureFileStorageTests(TestCase):
 
         self._storage.delete(resource_id)
 
+    def test_stores_stream_from_spooled_file(self):
+        self._storage._spool_size = 1024
+        client = self._storage._client
+        uploads = []
+
+        def upload_object_via_stream(iterator, object_name):
+            uploads.append(iterator)
+            return Container.upload_object_via_stream(client, iterator, object_name)
+
+        with patch.object(client, 'upload_object_via_stream', side_effect=upload_object_via_stream):
+            self._storage.store_stream('id1', (b'x' * 512 for _ in range(10)))
+
+        upload, = uploads
+        self.assertTrue(callable(getattr(upload, 'seek', None)))
+        self.assertNotIsInstance(upload, BytesIO)
+        self.assertTrue(upload.closed)
+        self.assertFileContains(self._storage.fetch_file('id1'), 'x' * 5120)
+
     def assertFileContains(self, path: str, content: str):
         with open(path, encoding='utf-8') as fobj:
             self.assertEqual(fobj.read(), content)
@@ -147,6 +290,19 @@ class AzureObjectsStorageTests(TestCase):
         with self.assertRaises(ObjectDoesNotExistError):
             list(self._storage.fetch_objects('missing', ('file', from_jsonl_bytes)))
 
+    def test_fetches_objects_while_streaming(self):
+        resource_id = '3d2bfa80-18f7-11e7-93ae-92361f002671.tar.gz'
+        name = 'file'
+        lines = b'{"foo":"bar"}\n{"baz":[1,2,3]}'
+        self._given_resource(resource_id, name, lines)
+
+        with patch.object(self._storage._file_storage, 'fetch_file') as mock_fetch_file:
+            objs = self._storage.fetch_objects(resource_id, (name, from_jsonl_bytes))
+
+            self.assertEqual(next(objs), {'foo': 'bar'})
+            self.assertEqual(list(objs), [{'baz': [1, 2, 3]}])
+            self.assertFalse(mock_fetch_file.called)
+
     def test_fetches_missing_archive_member(self):
         resource_id = '3d2bfa80-18f7-11e7-93ae-92361f002671.tar.gz'
         name = 'file'
@@ -156,6 +312,39 @@ class AzureObjectsStorageTests(TestCase):
         with self.assertRaises(ObjectDoesNotExistError):
             list(self._storage.fetch_objects(resource_id, ('missing-tar', from_jsonl_bytes)))
 
+    def test_fetches_framed_objects(self):
+        resource_id = '3d2bfa80-18f7-11e7-93ae-92361f002671.tar.gz'
+        name = 'file'
+        objs = [{'foo': b'bar\n'}, {'baz': [1, 2, 3]}]
+        self._given_resource(resource_id, name, b''.join(to_msgpack_frame(obj) for obj in objs))
+
+        fetched = list(self._storage.fetch_objects(resource_id, (name, from_msgpack_frame, read_frames)))
+
+        self.assertEqual(fetched, objs)
+
+    def test_fetches_first_matching_archive_member(self):
+        resource_id = '3d2bfa80-18f7-11e7-93ae-92361f002671.tar.gz'
+        objs = [{'foo': b'bar'}]
+        self._given_resource(resource_id, 'file.msgpack', b''.join(to_msgpack_frame(obj) for obj in objs))
+
+        fetched = list(
+            self._storage.fetch_objects(
+                resource_id,
+                ('file.jsonl', from_jsonl_bytes),
+                ('file.msgpack', from_msgpack_frame, read_frames),
+            ))
+
+        self.assertEqual(fetched, objs)
+
+    def test_roundtrips_framed_objects(self):
+        name = 'file'
+        objs = [{'foo': b'\x00\n\xff'}, {'baz': [1, 2, 3]}]
+
+        resource_id = self._storage.store_objects((name, objs, to_msgpack_frame), 'gz')
+        fetched = list(self._storage.fetch_objects(resource_id, (name, from_msgpack_frame, read_frames)))
+
+        self.assertEqual(fetched, objs)
+
     def test_fetches_json_objects(self):
         resource_id = '3d2bfa80-18f7-11e7-93ae-92361f002671.tar.gz'
         name = 'file'
@@ -194,6 +383,53 @@ class AzureObjectsStorageTests(TestCase):
         self.assertIsNotNone(resource_id)
         self.assertContainerHasNumFiles(1, suffix='.tar.gz')
 
+    def test_stores_and_fetches_objects_with_all_compressions(self):
+        name = 'file'
+        objs = [{'foo': 'bar'}, {'baz': [1, 2, 3]}, {'content': 'x' * 100000}]
+
+        for compression in self._storage.compression_formats():
+            with self.subTest(compression=compression):
+                resource_id = self._storage.store_objects((name, objs, to_jsonl_bytes), compression)
+                fetched = list(self._storage.fetch_objects(resource_id, (name, from_jsonl_bytes)))
+
+                self.assertEqual(fetched, objs)
+
+    def test_stores_and_fetches_objects_with_dictionary(self):
+        name = 'file'
+        objs = [{'to': [f'user{i}@test.lokole.ca'], 'subject': f'hello {i}'} for i in range(500)]
+        dictionary_storage = AzureDictionaryStorage(
+            account=self._folder,
+            key='unused',
+            container='dictionaries',
+            provider='LOCAL',
+        )
+        dictionary = train_dictionary((to_jsonl_bytes(obj) for obj in objs), 2048)
+        dictionary_id = dictionary_storage.store_dictionary(dictionary)
+        storage = AzureObjectsStorage(
+            file_storage=self._storage._file_storage,
+            dictionary_storage=dictionary_storage,
+            dictionary_id=dictionary_id,
+        )
+
+        resource_id = storage.store_objects((name, objs, to_jsonl_bytes))
+        fetched = list(storage.fetch_objects(resource_id, (name, from_jsonl_bytes)))
+
+        self.assertIn(f'.zdict-{dictionary_id}.tar.zstd', resource_id)
+        self.assertEqual(fetched, objs)
+        with self.assertRaises(ValueError):
+            list(self._storage.fetch_objects(resource_id, (name, from_jsonl_bytes)))
+
+    def test_does_not_use_dictionary_for_other_compressions(self):
+        storage = AzureObjectsStorage(
+            file_storage=self._storage._file_storage,
+            dictionary_storage=Mock(),
+            dictionary_id='123',
+        )
+
+        resource_id = storage.store_objects(('file', [{'foo': 'bar'}], to_jsonl_bytes), 'gz')
+
+        self.assertNotIn('zdict', resource_id)
+
     def test_does_not_create_file_without_objects(self):
         name = 'file'
         objs = []
@@ -212,6 +448,16 @@ class AzureObjectsStorageTests(TestCase):
 
         self.assertContainerHasNumFiles(0)
 
+    def test_deletes_many_objects(self):
+        name = 'file'
+        objs = [{'foo': 'bar'}]
+
+        resource_id = self._storage.store_objects((name, objs, to_jsonl_bytes))
+        num_deleted = self._storage.delete_many([resource_id, 'missing.tar.gz'])
+
+        self.assertEqual(num_deleted, 1)
+        self.assertContainerHasNumFiles(0)
+
     def assertContainerHasNumFiles(self, count: int, suffix: str = ''):
         container_files = listdir(join(self._folder, self._container))
         matches = [entry for entry in container_files if entry.endswith(suffix)]
@@ -258,15 +504,193 @@ class AzureObjectStorageTests(TestCase):
 
         self.assertEqual(given, actual)
 
+    def test_fetches_many_objects_in_order(self):
+        given = [{'a': str(i)} for i in range(20)]
+        resource_ids = [str(i) for i in range(20)]
+
+        for resource_id, obj in zip(resource_ids, given):
+            self._storage.store_object(resource_id, obj)
+        actual = list(self._storage.fetch_objects_many(resource_ids, max_workers=4))
+
+        self.assertEqual(given, actual)
+
+    def test_fetches_many_missing_object(self):
+        self._storage.store_object('123', {'a': 1})
+
+        with self.assertRaises(ObjectDoesNotExistError):
+            list(self._storage.fetch_objects_many(['123', 'missing'], max_workers=2))
+
+    def setUp(self):
+        self._folder = mkdtemp()
+        self._container = 'container'
+        mkdir(join(self._folder, self._container))
+        self._storage = AzureObjectStorage(
+            account=self._folder,
+            key='unused',
+            container=self._container,
+            provider='LOCAL',
+        )
+
+    def tearDown(self):
+        rmtree(self._folder)
+
+
+class AzureObjectStorageCacheTests(TestCase):
+    def test_fetches_from_cache_after_store(self):
+        self._storage.store_object('123', {'a': '1'})
+        rmtree(join(self._folder, self._container))
+        mkdir(join(self._folder, self._container))
+
+        self.assertEqual(self._storage.fetch_object('123'), {'a': '1'})
+        self.assertEqual(self._cache.hits, 1)
+
+    def test_reads_through_cache(self):
+        self._uncached_storage.store_object('123', {'a': '1'})
+
+        self.assertEqual(self._storage.fetch_object('123'), {'a': '1'})
+        self.assertEqual(self._storage.fetch_object('123'), {'a': '1'})
+        self.assertEqual(list(self._storage.fetch_objects_many(['123'])), [{'a': '1'}])
+        self.assertEqual(self._cache.stats(), {'hits': 2, 'misses': 1, 'evictions': 0})
+
+    def test_caches_fetched_bytes_without_copy(self):
+        self._uncached_storage.store_object('123', {'a': '1'})
+
+        content = self._storage.fetch_bytes('123')
+
+        self.assertIs(type(content), bytes)
+        self.assertIs(self._cache.get(self._storage._to_cache_key('123')), content)
+
+    def test_invalidates_on_delete(self):
+        self._storage.store_object('123', {'a': '1'})
+        self._storage.delete('123')
+
+        with self.assertRaises(ObjectDoesNotExistError):
+            self._storage.fetch_object('123')
+
+    def test_invalidates_on_delete_many(self):
+        self._storage.store_object('123', {'a': '1'})
+        self._storage.delete_many(['123'])
+
+        with self.assertRaises(ObjectDoesNotExistError):
+            self._storage.fetch_object('123')
+
     def setUp(self):
         self._folder = mkdtemp()
         self._container = 'container'
         mkdir(join(self._folder, self._container))
+        self._cache = MemoryBytesCache(max_bytes=1024)
         self._storage = AzureObjectStorage(
             account=self._folder,
             key='unused',
             container=self._container,
             provider='LOCAL',
+            cache=self._cache,
+        )
+        self._uncached_storage = AzureObjectStorage(
+            account=self._folder,
+            key='unused',
+            container=self._container,
+            provider='LOCAL',
+        )
+
+    def tearDown(self):
+        rmtree(self._folder)
+
+
+class AzureAttachmentStorageTests(TestCase):
+    def test_stores_and_fetches_attachments(self):
+        attachments = [
+            {'filename': 'a.txt', 'content': b'first'},
+            {'filename': 'b.txt', 'content': b'second', 'cid': 'b'},
+        ]
+        email = {'_uid': '1', 'attachments': attachments}
+
+        stored = self._storage.store_attachments(email)
+        fetched = self._storage.fetch_attachments(stored)
+
+        self.assertNotIn('content', stored['attachments'][0])
+        self.assertNotIn('content', stored['attachments'][1])
+        self.assertEqual(stored['attachments'][1]['cid'], 'b')
+        self.assertEqual(fetched, email)
+
+    def test_fetches_single_attachment_without_pool(self):
+        stored = self._storage.store_attachments({'attachments': [{'filename': 'a.txt', 'content': b'first'}]})
+
+        with patch.object(self._storage, '_new_driver', wraps=self._storage._new_driver) as new_driver:
+            fetched = self._storage.fetch_attachments(stored)
+
+        self.assertEqual(fetched['attachments'][0]['content'], b'first')
+        self.assertIsNone(self._storage._executor_instance)
+        new_driver.assert_not_called()
+
+    def test_reuses_pool_across_fetches(self):
+        attachments = [{'filename': f'{i}.txt', 'content': f'content{i}'.encode()} for i in range(5)]
+        stored = self._storage.store_attachments({'attachments': attachments})
+
+        self._storage.fetch_attachments(stored)
+        executor = self._storage._executor_instance
+        fetched = self._storage.fetch_attachments(stored)
+
+        self.assertEqual(fetched['attachments'], attachments)
+        self.assertIsNotNone(executor)
+        self.assertIs(self._storage._executor_instance, executor)
+
+    def test_deduplicates_content(self):
+        email1 = {'attachments': [{'filename': 'a.txt', 'content': b'same'}]}
+        email2 = {'attachments': [{'filename': 'b.txt', 'content': b'same'}]}
+
+        stored1 = self._storage.store_attachments(email1)
+        stored2 = self._storage.store_attachments(email2)
+
+        self.assertEqual(stored1['attachments'][0]['sha256'], stored2['attachments'][0]['sha256'])
+        self.assertEqual(len(listdir(join(self._folder, self._container))), 1)
+
+    def test_stores_attachment_files(self):
+        stored1 = self._storage.store_attachment_file({'filename': 'a.txt', 'cid': 'a'}, BytesIO(b'same' * 1000))
+        stored2 = self._storage.store_attachment_file({'filename': 'b.txt'}, BytesIO(b'same' * 1000))
+        fetched = self._storage.fetch_attachments({'attachments': [stored1]})
+
+        self.assertEqual(stored1['sha256'], stored2['sha256'])
+        self.assertEqual(stored1['cid'], 'a')
+        self.assertEqual(fetched['attachments'], [{'filename': 'a.txt', 'cid': 'a', 'content': b'same' * 1000}])
+        self.assertEqual(len(listdir(join(self._folder, self._container))), 1)
+
+    def test_stores_attachment_file_from_spooled_file(self):
+        self._storage._spool_size = 16
+        client = self._storage._client
+        uploads = []
+
+        def upload_object_via_stream(iterator, object_name):
+            uploads.append(iterator)
+            return Container.upload_object_via_stream(client, iterator, object_name)
+
+        with patch.object(client, 'upload_object_via_stream', side_effect=upload_object_via_stream):
+            stored = self._storage.store_attachment_file({'filename': 'a.bin'}, BytesIO(urandom(4096)))
+
+        upload, = uploads
+        self.assertTrue(callable(getattr(upload, 'seek', None)))
+        self.assertNotIsInstance(upload, BytesIO)
+        self.assertEqual(len(self._storage.fetch_attachments({'attachments': [stored]})['attachments'][0]['content']),
+                         4096)
+
+    def test_ignores_emails_without_references(self):
+        email = {'attachments': [{'filename': 'a.txt', 'content': b'inline'}]}
+
+        empty = {}
+
+        self.assertIs(self._storage.fetch_attachments(email), email)
+        self.assertIs(self._storage.fetch_attachments(empty), empty)
+        self.assertIs(self._storage.store_attachments(empty), empty)
+
+    def setUp(self):
+        self._folder = mkdtemp()
+        self._container = 'container'
+        mkdir(join(self._folder, self._container))
+        self._storage = AzureAttachmentStorage(
+            account=self._folder,
+            key='unused',
+            container=self._container,
+            provider='LOCAL',
         )
 
     def tearDown(self):
@@ -1,5 +1,6 @@
 from collections import defaultdict
 from copy import deepcopy
+from time import time_ns
 from unittest import TestCase
 from unittest.mock import MagicMock
 from unittest.mock import Mock
@@ -9,9 +10,13 @@ from libcloud.storage.types import ObjectDoesNotExistError
 
 from opwen_email_server import actions
 from opwen_email_server.constants import sync
+from opwen_email_server.services.pending import PendingStats
 from opwen_email_server.services.storage import AccessInfo
 from opwen_email_server.utils.serialization import from_jsonl_bytes
+from opwen_email_server.utils.serialization import from_msgpack_frame
+from opwen_email_server.utils.serialization import read_frames
 from opwen_email_server.utils.serialization import to_jsonl_bytes
+from opwen_email_server.utils.serialization import to_msgpack_frame
 
 
 class ActionTests(TestCase):
@@ -41,6 +46,7 @@ class PingTests(TestCase):
 class SendOutboundEmailsTests(TestCase):
     def setUp(self):
         self.email_storage = Mock()
+        self.attachment_storage = Mock()
         self.send_email = MagicMock()
 
     def test_200(self):
@@ -69,22 +75,100 @@ class SendOutboundEmailsTests(TestCase):
         self.email_storage.fetch_object.assert_called_once_with(resource_id)
         self.send_email.assert_called_once_with(email)
 
-    def _execute_action(self, *args, **kwargs):
+    def test_200_with_attachment_storage(self):
+        resource_id = '5f4f519a-f943-421a-94d5-cc9625047e9b'
+        email = {'subject': 'test', 'attachments': [{'filename': 'a.txt', 'sha256': '123'}]}
+        resolved_email = {'subject': 'test', 'attachments': [{'filename': 'a.txt', 'content': b'a'}]}
+
+        self.email_storage.fetch_object.return_value = email
+        self.attachment_storage.fetch_attachments.return_value = resolved_email
+        self.send_email.return_value = True
+
+        _, status = self._execute_action(resource_id, attachment_storage=self.attachment_storage)
+
+        self.assertEqual(status, 200)
+        self.attachment_storage.fetch_attachments.assert_called_once_with(email)
+        self.send_email.assert_called_once_with(resolved_email)
+
+    def _execute_action(self, *args, attachment_storage=None, **kwargs):
         action = actions.SendOutboundEmails(
             email_storage=self.email_storage,
             send_email=self.send_email,
+            attachment_storage=attachment_storage,
         )
 
         return action(*args, **kwargs)
 
 
+# noinspection PyTypeChecker
+class SendOutboundEmailBatchTests(TestCase):
+    def setUp(self):
+        self.email_storage = Mock()
+        self.attachment_storage = Mock()
+        self.send_emails = MagicMock()
+
+    def test_200(self):
+        resource_ids = ['email1', 'email2']
+        emails = [{'subject': 'test1'}, {'subject': 'test2'}]
+
+        self.email_storage.fetch_objects_many.return_value = iter(emails)
+        self.send_emails.return_value = [True, True]
+
+        _, status = self._execute_action(resource_ids)
+
+        self.assertEqual(status, 200)
+        self.email_storage.fetch_objects_many.assert_called_once_with(resource_ids)
+        self.send_emails.assert_called_once_with(emails)
+
+    def test_500_attributes_failures(self):
+        resource_ids = ['email1', 'email2', 'email3']
+        emails = [{'subject': 'test1'}, {'subject': 'test2'}, {'subject': 'test3'}]
+
+        self.email_storage.fetch_objects_many.return_value = iter(emails)
+        self.send_emails.return_value = [True, False, True]
+
+        action = self._create_action()
+        with patch.object(action, 'log_warning') as mock_log_warning:
+            message, status = action(resource_ids)
+
+        self.assertEqual(status, 500)
+        self.assertIn('1 of 3', message)
+        mock_log_warning.assert_called_once_with('Unable to send email %s', 'email2')
+
+    def test_200_with_attachment_storage(self):
+        email = {'subject': 'test', 'attachments': [{'filename': 'a.txt', 'sha256': '123'}]}
+        resolved_email = {'subject': 'test', 'attachments': [{'filename': 'a.txt', 'content': b'a'}]}
+
+        self.email_storage.fetch_objects_many.return_value = iter([email])
+        self.attachment_storage.fetch_attachments.return_value = resolved_email
+        self.send_emails.return_value = [True]
+
+        _, status = self._execute_action(['email1'], attachment_storage=self.attachment_storage)
+
+        self.assertEqual(status, 200)
+        self.attachment_storage.fetch_attachments.assert_called_once_with(email)
+        self.send_emails.assert_called_once_with([resolved_email])
+
+    def _create_action(self, attachment_storage=None):
+        return actions.SendOutboundEmailBatch(
+            email_storage=self.email_storage,
+            send_emails=self.send_emails,
+            attachment_storage=attachment_storage,
+        )
+
+    def _execute_action(self, *args, attachment_storage=None, **kwargs):
+        action = self._create_action(attachment_storage)
+
+        return action(*args, **kwargs)
+
+
 # noinspection PyTypeChecker
 class StoreInboundEmailsTests(TestCase):
     def setUp(self):
         self.raw_email_storage = Mock()
         self.email_storage = Mock()
-        self.pending_storage = Mock()
-        self.pending_factory = MagicMock()
+        self.attachment_storage = Mock()
+        self.pending_index = Mock()
         self.email_parser = MagicMock()
         self.next_task = MagicMock()
 
@@ -95,16 +179,15 @@ class StoreInboundEmailsTests(TestCase):
 
         resource_id = 'eb93fde9-0cc6-4339-b7d6-f6e838e78f1c'
 
-        self.raw_email_storage.fetch_text.side_effect = throw
+        self.raw_email_storage.fetch_bytes.side_effect = throw
 
         _, status = self._execute_action(resource_id)
 
         self.assertEqual(status, 202)
-        self.raw_email_storage.fetch_text.assert_called_once_with(resource_id)
-        self.assertFalse(self.raw_email_storage.delete.called)
+        self.raw_email_storage.fetch_bytes.assert_called_once_with(resource_id)
+        self.assertFalse(self.raw_email_storage.delete_many.called)
         self.assertFalse(self.email_storage.store_object.called)
-        self.assertFalse(self.pending_factory.called)
-        self.assertFalse(self.pending_storage.store_text.called)
+        self.assertFalse(self.pending_index.append.called)
         self.assertFalse(self.email_parser.called)
 
     def test_200(self):
@@ -116,28 +199,111 @@ class StoreInboundEmailsTests(TestCase):
         stored_email = dict(parsed_email)
         stored_email['_uid'] = email_id
 
-        self.raw_email_storage.fetch_text.return_value = raw_email
-        self.pending_factory.return_value = self.pending_storage
+        self.raw_email_storage.fetch_bytes.return_value = raw_email.encode('utf-8')
         self.email_parser.return_value = parsed_email
 
         _, status = self._execute_action(resource_id)
 
         self.assertEqual(status, 200)
-        self.raw_email_storage.fetch_text.assert_called_once_with(resource_id)
-        self.raw_email_storage.delete.assert_called_once_with(resource_id)
+        self.raw_email_storage.fetch_bytes.assert_called_once_with(resource_id)
+        self.raw_email_storage.delete_many.assert_called_once_with((resource_id, ))
         self.email_storage.store_object.assert_called_once_with(email_id, stored_email)
-        self.pending_factory.assert_called_once_with(domain)
-        self.pending_storage.store_text.assert_called_once_with(email_id, 'pending')
+        self.pending_index.append.assert_called_once_with(domain, (email_id, ), len(raw_email))
         self.email_parser.assert_called_once_with(raw_email)
         self.next_task.assert_called_once_with(email_id)
 
-    def _execute_action(self, *args, **kwargs):
+    def test_200_splits_encoded_bytes_between_domains(self):
+        self.raw_email_storage.fetch_bytes.return_value = 'mimé'.encode('utf-8')
+        self.email_parser.return_value = {'to': ['foo@a.com', 'bar@b.com']}
+
+        _, status = self._execute_action('b8dcaf40-fd14-4a89-8898-c9514b0ad724')
+
+        email_id = self.next_task.call_args[0][0]
+        self.assertEqual(status, 200)
+        self.assertEqual([args for (args, _) in self.pending_index.append.call_args_list], [
+            ('a.com', (email_id, ), 3),
+            ('b.com', (email_id, ), 2),
+        ])
+
+    def test_200_with_email_id_source(self):
+        resource_id = 'b8dcaf40-fd14-4a89-8898-c9514b0ad724'
+        parsed_email = {'to': ['foo@test.com']}
+        email_id_source = MagicMock(return_value='email-id')
+
+        self.raw_email_storage.fetch_bytes.return_value = b'dummy-mime'
+        self.email_parser.return_value = parsed_email
+
+        _, status = self._execute_action(resource_id, email_id_source=email_id_source)
+
+        self.assertEqual(status, 200)
+        email_id_source.assert_called_once_with({'to': ['foo@test.com'], '_uid': 'email-id'})
+        self.email_storage.store_object.assert_called_once_with('email-id', parsed_email)
+        self.next_task.assert_called_once_with('email-id')
+
+    def test_200_with_attachment_storage(self):
+        resource_id = 'b8dcaf40-fd14-4a89-8898-c9514b0ad724'
+        parsed_email = {'to': ['foo@test.com'], 'attachments': [{'filename': 'a.txt', 'content': b'a'}]}
+        stored_email = {'to': ['foo@test.com'], 'attachments': [{'filename': 'a.txt', 'sha256': '123'}]}
+
+        self.raw_email_storage.fetch_bytes.return_value = b'dummy-mime'
+        self.email_parser.return_value = parsed_email
+        self.attachment_storage.store_attachments.return_value = stored_email
+
+        _, status = self._execute_action(resource_id, attachment_storage=self.attachment_storage)
+
+        self.assertEqual(status, 200)
+        email_id = self.next_task.call_args[0][0]
+        self.assertEqual(self.attachment_storage.store_attachments.call_args[0][0]['_uid'], email_id)
+        self.email_storage.store_object.assert_called_once_with(email_id, stored_email)
+
+    def test_202_with_stream_parser(self):
+        # noinspection PyUnusedLocal
+        def throw(*args, **kwargs):
+            raise ObjectDoesNotExistError(None, None, None)
+
+        stream_parser = MagicMock()
+        self.raw_email_storage.fetch_chunks.side_effect = throw
+
+        _, status = self._execute_action('eb93fde9-0cc6-4339-b7d6-f6e838e78f1c', stream_parser=stream_parser)
+
+        self.assertEqual(status, 202)
+        self.assertFalse(self.raw_email_storage.fetch_bytes.called)
+        self.assertFalse(self.email_storage.store_object.called)
+        self.assertFalse(stream_parser.called)
+
+    def test_200_with_stream_parser(self):
+        resource_id = 'b8dcaf40-fd14-4a89-8898-c9514b0ad724'
+        domain = 'test.com'
+        parsed_email = {'to': [f'foo@{domain}']}
+        stream_parser = MagicMock()
+
+        def parse(chunks):
+            self.assertEqual(b''.join(chunks), b'dummy-mime')
+            return parsed_email
+
+        self.raw_email_storage.fetch_chunks.return_value = iter([b'dummy', b'-mime'])
+        stream_parser.side_effect = parse
+
+        _, status = self._execute_action(resource_id, stream_parser=stream_parser)
+
+        email_id = self.next_task.call_args[0][0]
+        self.assertEqual(status, 200)
+        self.raw_email_storage.fetch_chunks.assert_called_once_with(resource_id)
+        self.raw_email_storage.delete_many.assert_called_once_with((resource_id, ))
+        self.assertFalse(self.raw_email_storage.fetch_bytes.called)
+        self.assertFalse(self.email_parser.called)
+        self.pending_index.append.assert_called_once_with(domain, (email_id, ), len(b'dummy-mime'))
+
+    def _execute_action(self, *args, attachment_storage=None, stream_parser=None, email_id_source=None, **kwargs):
         action = actions.StoreInboundEmails(
             raw_email_storage=self.raw_email_storage,
             email_storage=self.email_storage,
-            pending_factory=self.pending_factory,
+            pending_index=self.pending_index,
             email_parser=self.email_parser,
             next_task=self.next_task,
+            attachment_storage=attachment_storage,
+            stream_parser=stream_parser,
+            email_id_source=email_id_source,
         )
 
         return action(*args, **kwargs)
@@ -210,6 +376,7 @@ class StoreWrittenClientEmailsTests(TestCase):
     def setUp(self):
         self.client_storage = Mock()
         self.email_storage = Mock()
+        self.attachment_storage = Mock()
         self.next_task = MagicMock()
 
     def test_200(self):
@@ -241,16 +408,49 @@ class StoreWrittenClientEmailsTests(TestCase):
         _, status = self._execute_action(resource_id)
 
         self.assertEqual(status, 200)
-        self.client_storage.fetch_objects.assert_called_once_with(resource_id, (sync.EMAILS_FILE, from_jsonl_bytes))
+        self.client_storage.fetch_objects.assert_called_once_with(
+            resource_id,
+            (sync.EMAILS_FILE, from_jsonl_bytes),
+            (sync.EMAILS_FRAMES_FILE, from_msgpack_frame, read_frames),
+        )
         self.email_storage.store_object.assert_called_once_with(email_id, server_email)
         self.next_task.assert_called_once_with(email_id)
-        self.client_storage.delete.assert_called_once_with(resource_id)
+        self.client_storage.delete_many.assert_called_once_with((resource_id, ))
 
-    def _execute_action(self, *args, **kwargs):
+    def test_200_with_binary_attachments(self):
+        resource_id = 'a2e3d5a7-cb3a-42c3-beeb-d6a2a76089dc'
+        email_id = '0194bf59-fb01-479e-bd5e-a59e4b8464d0'
+        client_email = {'_uid': email_id, 'attachments': [{'filename': 'a.txt', 'content': b'YQ=='}]}
+
+        self.client_storage.fetch_objects.return_value = [deepcopy(client_email)]
+
+        _, status = self._execute_action(resource_id)
+
+        self.assertEqual(status, 200)
+        self.email_storage.store_object.assert_called_once_with(email_id, client_email)
+
+    def test_200_with_attachment_storage(self):
+        resource_id = 'a2e3d5a7-cb3a-42c3-beeb-d6a2a76089dc'
+        email_id = '0194bf59-fb01-479e-bd5e-a59e4b8464d0'
+        client_email = {'_uid': email_id, 'attachments': [{'filename': 'a.txt', 'content': 'YQ=='}]}
+        server_email = {'_uid': email_id, 'attachments': [{'filename': 'a.txt', 'content': b'a'}]}
+        stored_email = {'_uid': email_id, 'attachments': [{'filename': 'a.txt', 'sha256': '123'}]}
+
+        self.client_storage.fetch_objects.return_value = [client_email]
+        self.attachment_storage.store_attachments.return_value = stored_email
+
+        _, status = self._execute_action(resource_id, attachment_storage=self.attachment_storage)
+
+        self.assertEqual(status, 200)
+        self.attachment_storage.store_attachments.assert_called_once_with(server_email)
+        self.email_storage.store_object.assert_called_once_with(email_id, stored_email)
+
+    def _execute_action(self, *args, attachment_storage=None, **kwargs):
         action = actions.StoreWrittenClientEmails(
             client_storage=self.client_storage,
             email_storage=self.email_storage,
             next_task=self.next_task,
+            attachment_storage=attachment_storage,
         )
 
         return action(*args, **kwargs)
@@ -327,8 +527,9 @@ class DownloadClientEmailsTests(TestCase):
         self.auth = Mock()
         self.client_storage = Mock()
         self.email_storage = Mock()
-        self.pending_factory = MagicMock()
-        self.pending_storage = Mock()
+        self.attachment_storage = Mock()
+        self.pending_index = Mock()
+        self.pending_factory = None
 
     def test_400(self):
         client_id = 'af962175-8757-4ac4-a199-2387b06379fa'
@@ -341,6 +542,15 @@ class DownloadClientEmailsTests(TestCase):
 
         self.assertEqual(status, 400)
 
+    def test_400_unknown_format(self):
+        self.auth.domain_for.return_value = 'test.com'
+        self.client_storage.compression_formats.return_value = ['gz']
+
+        _, status = self._execute_action('client', 'gz', 'v0')
+
+        self.assertEqual(status, 400)
+        self.assertFalse(self.client_storage.store_objects.called)
+
     def test_403(self):
         client_id = '8bb3c924-aee6-4934-99dd-c7e50689489d'
         domain = None
@@ -357,6 +567,27 @@ class DownloadClientEmailsTests(TestCase):
             attachment_content_base64='c29tZSBmaWxlIGNvbnRlbnQ=',
         )
 
+    def test_200_v2(self):
+        email_id = 'b69bee6b-72fb-4b7f-a2ad-9aa7e375cf18'
+        server_email = {'_uid': email_id, 'attachments': [{'filename': 'a.txt', 'content': b'a'}]}
+        uploads = []
+
+        def store_objects_mock(upload, compression):
+            name, emails, serializer = upload
+            uploads.append((name, list(emails), serializer))
+            return 'resource'
+
+        self.auth.domain_for.return_value = 'test.com'
+        self.pending_index.read.return_value = [email_id], ['batch']
+        self.email_storage.fetch_objects_many.return_value = [deepcopy(server_email)]
+        self.client_storage.store_objects.side_effect = store_objects_mock
+        self.client_storage.compression_formats.return_value = ['gz']
+
+        response = self._execute_action('client', 'gz', sync.PACKAGE_FORMAT_V2)
+
+        self.assertEqual(response.get('resource_id'), 'resource')
+        self.assertEqual(uploads, [(sync.EMAILS_FRAMES_FILE, [server_email], to_msgpack_frame)])
+
     def test_200_no_attachments(self):
         self._test_200(
             attachment_content_bytes=None,
@@ -389,9 +620,8 @@ class DownloadClientEmailsTests(TestCase):
             return resource_id
 
         self.auth.domain_for.return_value = domain
-        self.pending_factory.return_value = self.pending_storage
-        self.pending_storage.iter.return_value = [email_id]
-        self.email_storage.fetch_object.return_value = server_email
+        self.pending_index.read.return_value = [email_id], ['batch']
+        self.email_storage.fetch_objects_many.side_effect = lambda email_ids: [server_email for _ in email_ids]
         self.client_storage.store_objects.side_effect = store_objects_mock
         self.client_storage.compression_formats.return_value = ['gz']
 
@@ -399,19 +629,75 @@ class DownloadClientEmailsTests(TestCase):
 
         self.assertEqual(response.get('resource_id'), resource_id)
         self.auth.domain_for.assert_called_once_with(client_id)
-        self.pending_factory.assert_called_once_with(domain)
-        self.pending_storage.iter.assert_called_once_with()
-        self.pending_storage.delete.assert_called_once_with(email_id)
-        self.email_storage.fetch_object.assert_called_once_with(email_id)
+        self.pending_index.read.assert_called_once_with(domain)
+        self.pending_index.acknowledge.assert_called_once_with(domain, ['batch'])
+        self.email_storage.fetch_objects_many.assert_called_once_with([email_id])
         self.assertEqual(_stored[sync.EMAILS_FILE], [client_email])
         self.assertEqual(_compression[sync.EMAILS_FILE], ['gz'])
         self.assertEqual(_serializers[sync.EMAILS_FILE], [to_jsonl_bytes])
 
-    def _execute_action(self, *args, **kwargs):
+    def test_200_with_attachment_storage(self):
+        email_id = 'b69bee6b-72fb-4b7f-a2ad-9aa7e375cf18'
+        stored_email = {'_uid': email_id, 'attachments': [{'filename': 'a.txt', 'sha256': '123'}]}
+        server_email = {'_uid': email_id, 'attachments': [{'filename': 'a.txt', 'content': b'a'}]}
+        client_email = {'_uid': email_id, 'attachments': [{'filename': 'a.txt', 'content': 'YQ=='}]}
+        stored = []
+
+        def store_objects_mock(upload, compression):
+            stored.extend(upload[1])
+            return 'resource'
+
+        self.auth.domain_for.return_value = 'test.com'
+        self.pending_index.read.return_value = [email_id], ['batch']
+        self.email_storage.fetch_objects_many.return_value = [stored_email]
+        self.attachment_storage.fetch_attachments.return_value = server_email
+        self.client_storage.store_objects.side_effect = store_objects_mock
+        self.client_storage.compression_formats.return_value = ['gz']
+
+        response = self._execute_action('client', 'gz', attachment_storage=self.attachment_storage)
+
+        self.assertEqual(response.get('resource_id'), 'resource')
+        self.attachment_storage.fetch_attachments.assert_called_once_with(stored_email)
+        self.assertEqual(stored, [client_email])
+
+    def test_200_drains_legacy_pending_storage(self):
+        email_ids = ['email1', 'email2', 'email3']
+        pending_storage = Mock()
+
+        self.auth.domain_for.return_value = 'test.com'
+        self.pending_index.read.return_value = email_ids[:2], ['batch']
+        self.pending_factory = MagicMock(return_value=pending_storage)
+        pending_storage.iter.return_value = email_ids[1:]
+        self.email_storage.fetch_objects_many.side_effect = lambda ids: [{'_uid': email_id} for email_id in ids]
+        self.client_storage.store_objects.side_effect = lambda upload, compression: list(upload[1]) and 'resource'
+        self.client_storage.compression_formats.return_value = ['gz']
+
+        response = self._execute_action('client', 'gz')
+
+        self.assertEqual(response.get('resource_id'), 'resource')
+        self.email_storage.fetch_objects_many.assert_called_once_with(email_ids)
+        self.pending_index.acknowledge.assert_called_once_with('test.com', ['batch'])
+        pending_storage.delete_many.assert_called_once_with({'email2', 'email3'})
+
+    def test_200_without_pending_emails(self):
+        self.auth.domain_for.return_value = 'test.com'
+        self.pending_index.read.return_value = [], []
+        self.email_storage.fetch_objects_many.return_value = []
+        self.client_storage.store_objects.return_value = None
+        self.client_storage.compression_formats.return_value = ['gz']
+
+        response = self._execute_action('client', 'gz')
+
+        self.assertIsNone(response.get('resource_id'))
+        self.assertFalse(self.pending_index.acknowledge.called)
+
+    def _execute_action(self, *args, attachment_storage=None, **kwargs):
         action = actions.DownloadClientEmails(
             auth=self.auth,
             client_storage=self.client_storage,
             email_storage=self.email_storage,
+            pending_index=self.pending_index,
+            attachment_storage=attachment_storage,
             pending_factory=self.pending_factory,
         )
 
@@ -527,6 +813,7 @@ class RegisterClientTests(TestCase):
 class CalculatePendingEmailsMetricTests(TestCase):
     def setUp(self):
         self.auth = Mock()
+        self.pending_index = Mock()
         self.pending_storage = Mock()
         self.pending_factory = MagicMock()
 
@@ -551,20 +838,111 @@ class CalculatePendingEmailsMetricTests(TestCase):
         ]
 
         self.auth.client_id_for.return_value = client_id
+        self.pending_index.stats.return_value = PendingStats(2, 300, time_ns() - 5000000000)
         self.pending_factory.return_value = self.pending_storage
         self.pending_storage.iter.return_value = pending_email_ids
 
         response = self._execute_action(client_domain)
 
-        self.assertEqual(response['pending_emails'], len(pending_email_ids))
+        self.assertEqual(response['pending_emails'], 2 + len(pending_email_ids))
+        self.assertEqual(response['pending_bytes'], 300)
+        self.assertGreaterEqual(response['oldest_pending_age_seconds'], 5)
         self.auth.client_id_for.assert_called_once_with(client_domain)
+        self.pending_index.stats.assert_called_once_with(client_domain)
         self.pending_factory.assert_called_once_with(client_domain)
         self.pending_storage.iter.assert_called_once_with()
 
     def _execute_action(self, *args, **kwargs):
         action = actions.CalculatePendingEmailsMetric(
             auth=self.auth,
+            pending_index=self.pending_index,
             pending_factory=self.pending_factory,
         )
 
         return action(*args, **kwargs)
+
+
+class CalculateAllPendingEmailsMetricsTests(TestCase):
+    def setUp(self):
+        self.auth = Mock()
+        self.pending_index = Mock()
+
+    def test_200(self):
+        self.auth.domains.return_value = ['foo.com', 'bar.com']
+        self.pending_index.stats_all.return_value = {
+            'foo.com': PendingStats(2, 300, time_ns()),
+            'unregistered.com': PendingStats(1, 10, time_ns()),
+        }
+
+        response = self._execute_action()
+
+        self.assertEqual(response['domains'], [
+            {'client_domain': 'bar.com', 'pending_emails': 0, 'pending_bytes': 0, 'oldest_pending_age_seconds': 0},
+            {'client_domain': 'foo.com', 'pending_emails': 2, 'pending_bytes': 300, 'oldest_pending_age_seconds': 0},
+        ])
+        self.pending_index.stats_all.assert_called_once_with()
+
+    def _execute_action(self, *args, **kwargs):
+        action = actions.CalculateAllPendingEmailsMetrics(
+            auth=self.auth,
+            pending_index=self.pending_index,
+        )
+
+        return action(*args, **kwargs)
+
+
+class TrainClientPackageDictionaryTests(TestCase):
+    def setUp(self):
+        self.email_storage = Mock()
+        self.dictionary_storage = Mock()
+
+    def test_404(self):
+        self.email_storage.iter.return_value = []
+        self.email_storage.fetch_objects_many.return_value = []
+
+        _, status = self._execute_action()
+
+        self.assertEqual(status, 404)
+        self.assertFalse(self.dictionary_storage.store_dictionary.called)
+
+    def test_404_with_too_few_emails(self):
+        email_ids = [str(i) for i in range(3)]
+        emails = [{'_uid': email_id, 'body': f'message {email_id}'} for email_id in email_ids]
+
+        self.email_storage.iter.return_value = iter(email_ids)
+        self.email_storage.fetch_objects_many.side_effect = lambda ids: [emails[int(i)] for i in ids]
+
+        message, status = self._execute_action()
+
+        self.assertEqual(status, 404)
+        self.assertIn('3 samples', message)
+        self.assertFalse(self.dictionary_storage.store_dictionary.called)
+
+    def test_200(self):
+        email_ids = [str(i) for i in range(1000)]
+        emails = [{
+            '_uid': email_id,
+            'to': [f'user{email_id}@test.lokole.ca'],
+            'body': f'<div>message {email_id}</div>',
+            'attachments': [{'filename': 'file.txt', 'content': b'content'}],
+        } for email_id in email_ids]
+
+        self.email_storage.iter.return_value = iter(email_ids)
+        self.email_storage.fetch_objects_many.side_effect = lambda ids: [emails[int(i)] for i in ids]
+        self.dictionary_storage.store_dictionary.return_value = '123'
+
+        response = self._execute_action()
+
+        self.assertEqual(response['dictionary_id'], '123')
+        dictionary = self.dictionary_storage.store_dictionary.call_args[0][0]
+        self.assertEqual(len(dictionary), 2048)
+
+    def _execute_action(self, *args, **kwargs):
+        action = actions.TrainClientPackageDictionary(
+            email_storage=self.email_storage,
+            dictionary_storage=self.dictionary_storage,
+            num_samples=500,
+            dictionary_size=2048,
+        )
+
+        return action(*args, **kwargs)
@@ -0,0 +1,24 @@
+from unittest import TestCase
+
+from opwen_email_server.utils.bloom import BloomFilter
+
+
+class BloomFilterTests(TestCase):
+    def test_contains_added_items(self):
+        items = [f'item{i}' for i in range(1000)]
+
+        bloom = BloomFilter.from_items(items, capacity=1000, error_rate=0.01)
+
+        self.assertTrue(all(item in bloom for item in items))
+
+    def test_false_positive_rate_is_bounded(self):
+        bloom = BloomFilter.from_items((f'item{i}' for i in range(1000)), capacity=1000, error_rate=0.01)
+
+        false_positives = sum(1 for i in range(10000) if f'other{i}' in bloom)
+
+        self.assertLess(false_positives, 300)
+
+    def test_empty_filter(self):
+        bloom = BloomFilter(capacity=0, error_rate=0.01)
+
+        self.assertNotIn('item', bloom)
@@ -0,0 +1,211 @@
+from os import listdir
+from os.path import getsize
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import TestCase
+from unittest.mock import patch
+
+from opwen_email_server.utils.cache import DiskBytesCache
+from opwen_email_server.utils.cache import MemoryBytesCache
+from opwen_email_server.utils.cache import SqliteTtlCache
+from opwen_email_server.utils.cache import TtlCache
+
+
+class MemoryBytesCacheTests(TestCase):
+    def test_gets_and_counts_hits_and_misses(self):
+        self._cache.put('a', b'123')
+
+        self.assertEqual(self._cache.get('a'), b'123')
+        self.assertIsNone(self._cache.get('b'))
+        self.assertEqual(self._cache.stats(), {'hits': 1, 'misses': 1, 'evictions': 0})
+
+    def test_evicts_least_recently_used(self):
+        self._cache.put('a', b'1234')
+        self._cache.put('b', b'1234')
+        self._cache.get('a')
+        self._cache.put('c', b'1234')
+
+        self.assertEqual(self._cache.get('a'), b'1234')
+        self.assertIsNone(self._cache.get('b'))
+        self.assertEqual(self._cache.get('c'), b'1234')
+        self.assertEqual(self._cache.evictions, 1)
+
+    def test_replaces_existing_entry(self):
+        self._cache.put('a', b'1234')
+        self._cache.put('a', b'5678')
+        self._cache.put('b', b'1234')
+
+        self.assertEqual(self._cache.get('a'), b'5678')
+        self.assertEqual(self._cache.evictions, 0)
+
+    def test_does_not_cache_values_over_budget(self):
+        self._cache.put('a', b'123')
+        self._cache.put('a', b'0123456789')
+
+        self.assertIsNone(self._cache.get('a'))
+
+    def test_deletes(self):
+        self._cache.put('a', b'123')
+        self._cache.delete('a')
+        self._cache.delete('b')
+
+        self.assertIsNone(self._cache.get('a'))
+
+    @patch.object(MemoryBytesCache, '_stats_interval', 2)
+    @patch.object(MemoryBytesCache, 'log_event')
+    def test_reports_stats(self, mock_log_event):
+        self._cache.put('a', b'123')
+        self._cache.get('a')
+        self._cache.get('b')
+
+        mock_log_event.assert_called_once_with('bytes_cache_stats', {
+            'cache': 'test',
+            'hits': 1,
+            'misses': 1,
+            'evictions': 0,
+        })
+
+    def setUp(self):
+        self._cache = MemoryBytesCache(max_bytes=8, name='test')
+
+
+class DiskBytesCacheTests(TestCase):
+    def test_gets_and_counts_hits_and_misses(self):
+        self._cache.put('a', b'123')
+
+        self.assertEqual(self._cache.get('a'), b'123')
+        self.assertIsNone(self._cache.get('b'))
+        self.assertEqual(self._cache.stats(), {'hits': 1, 'misses': 1, 'evictions': 0})
+
+    def test_evicts_down_to_low_water_mark(self):
+        for key in 'abcde':
+            self._cache.put(key, b'1234')
+
+        self.assertEqual(len(listdir(self._folder)), 1)
+        self.assertEqual(self._cache.evictions, 4)
+
+    def test_skips_eviction_when_rescan_is_under_budget(self):
+        self._cache.put('a', b'1234')
+        self._cache.put('b', b'1234')
+        self._cache.delete('b')
+        self._cache._num_bytes = 8
+
+        with patch.object(self._cache, '_entries', wraps=self._cache._entries) as mock_entries:
+            self._cache.put('c', b'1234')
+
+        self.assertEqual(mock_entries.call_count, 1)
+        self.assertEqual(self._cache.evictions, 0)
+        self.assertEqual(self._cache._num_bytes, 8)
+
+    def test_keeps_budget_across_instances(self):
+        other = DiskBytesCache(directory=self._folder, max_bytes=8)
+        self._cache._rescan_seconds = 0
+        other._rescan_seconds = 0
+
+        for key in 'abcd':
+            self._cache.put(f'{key}1', b'1234')
+            other.put(f'{key}2', b'1234')
+
+        self.assertLessEqual(sum(getsize(join(self._folder, name)) for name in listdir(self._folder)), 8)
+
+    def test_shares_entries_between_instances(self):
+        self._cache.put('a', b'123')
+        other = DiskBytesCache(directory=self._folder, max_bytes=8)
+
+        self.assertEqual(other.get('a'), b'123')
+        other.delete('a')
+        self.assertIsNone(self._cache.get('a'))
+
+    def test_tracks_size_on_replace_and_delete(self):
+        self._cache.put('a', b'1234')
+        for _ in range(5):
+            self._cache.put('a', b'5678')
+        self._cache.put('b', b'1234')
+        self._cache.delete('b')
+        self._cache.put('c', b'1234')
+
+        self.assertEqual(self._cache.get('a'), b'5678')
+        self.assertEqual(self._cache.get('c'), b'1234')
+        self.assertEqual(self._cache._num_bytes, 8)
+
+    def test_does_not_cache_values_over_budget(self):
+        self._cache.put('a', b'0123456789')
+
+        self.assertIsNone(self._cache.get('a'))
+        self.assertEqual(listdir(self._folder), [])
+
+    def setUp(self):
+        self._folder = mkdtemp()
+        self._cache = DiskBytesCache(directory=self._folder, max_bytes=8)
+
+    def tearDown(self):
+        rmtree(self._folder)
+
+
+class _TtlCacheTests:
+    def test_gets_positive_and_negative_entries(self):
+        self._cache.put('a', '1')
+        self._cache.put('b', None)
+
+        self.assertEqual(self._cache.get('a'), '1')
+        self.assertIsNone(self._cache.get('b'))
+        with self.assertRaises(KeyError):
+            self._cache.get('c')
+        self.assertEqual(self._cache.stats(), {'hits': 1, 'negative_hits': 1, 'misses': 1, 'evictions': 0})
+
+    @patch('opwen_email_server.utils.cache.time')
+    def test_expires_entries(self, mock_time):
+        mock_time.return_value = 1000
+        self._cache.put('a', '1')
+        self._cache.put('b', None)
+
+        mock_time.return_value = 1015
+        self.assertEqual(self._cache.get('a'), '1')
+        with self.assertRaises(KeyError):
+            self._cache.get('b')
+
+        mock_time.return_value = 1100
+        with self.assertRaises(KeyError):
+            self._cache.get('a')
+
+    def test_deletes(self):
+        self._cache.put('a', '1')
+        self._cache.delete('a')
+
+        with self.assertRaises(KeyError):
+            self._cache.get('a')
+
+    def test_evicts_over_max_entries(self):
+        for i in range(10):
+            self._cache.put(str(i), str(i))
+
+        self.assertEqual(self._cache.get('9'), '9')
+        with self.assertRaises(KeyError):
+            self._cache.get('0')
+        self.assertGreater(self._cache.evictions, 0)
+
+
+class TtlCacheTests(_TtlCacheTests, TestCase):
+    def setUp(self):
+        self._cache = TtlCache(max_entries=5, ttl_seconds=60, negative_ttl_seconds=10)
+
+
+class SqliteTtlCacheTests(_TtlCacheTests, TestCase):
+    def test_shares_entries_between_instances(self):
+        self._cache.put('a', '1')
+        other = SqliteTtlCache(self._path, max_entries=5, ttl_seconds=60, negative_ttl_seconds=10)
+
+        self.assertEqual(other.get('a'), '1')
+        other.delete('a')
+        with self.assertRaises(KeyError):
+            self._cache.get('a')
+
+    def setUp(self):
+        self._folder = mkdtemp()
+        self._path = join(self._folder, 'cache.sqlite3')
+        self._cache = SqliteTtlCache(self._path, max_entries=5, ttl_seconds=60, negative_ttl_seconds=10)
+        self._cache._prune_interval = 1
+
+    def tearDown(self):
+        rmtree(self._folder)
@@ -0,0 +1,97 @@
+from bz2 import decompress as bz2_decompress
+from gzip import decompress as gzip_decompress
+from lzma import decompress as xz_decompress
+from unittest import TestCase
+
+from zstandard import ZstdDecompressor
+
+from opwen_email_server.utils import compression
+
+
+class CompressChunksTests(TestCase):
+    chunks = [b'hello ', b'', b'world\n' * 1000]
+
+    def test_gz(self):
+        self.assertRoundtrips('gz', gzip_decompress)
+
+    def test_bz2(self):
+        self.assertRoundtrips('bz2', bz2_decompress)
+
+    def test_xz(self):
+        self.assertRoundtrips('xz', xz_decompress)
+
+    def test_zstd(self):
+        self.assertRoundtrips('zstd', lambda compressed: ZstdDecompressor().decompressobj().decompress(compressed))
+
+    def test_zstd_with_level(self):
+        compressed = b''.join(compression.compress_chunks(self.chunks, 'zstd', level=20))
+
+        self.assertEqual(ZstdDecompressor().decompressobj().decompress(compressed), b''.join(self.chunks))
+
+    def assertRoundtrips(self, compression_format, decompress):
+        compressed = b''.join(compression.compress_chunks(self.chunks, compression_format))
+
+        self.assertEqual(decompress(compressed), b''.join(self.chunks))
+
+
+class DecompressChunksTests(TestCase):
+    def test_roundtrip(self):
+        chunks = [b'hello ', b'', b'world\n' * 1000]
+
+        for compression_format in compression.BLOB_CODECS:
+            with self.subTest(compression=compression_format):
+                compressed = compression.compress_chunks(chunks, compression_format)
+                decompressed = compression.decompress_chunks(self._split(compressed), compression_format)
+
+                self.assertEqual(b''.join(decompressed), b''.join(chunks))
+
+    @classmethod
+    def _split(cls, chunks):
+        for chunk in chunks:
+            for i in range(0, len(chunk), 7):
+                yield chunk[i:i + 7]
+
+
+class SplitChunksTests(TestCase):
+    def test_splits_without_copying(self):
+        content = b'abcdefg'
+
+        chunks = list(compression.split_chunks(content, 3))
+
+        self.assertEqual([bytes(chunk) for chunk in chunks], [b'abc', b'def', b'g'])
+        self.assertTrue(all(chunk.obj is content for chunk in chunks))
+
+
+class OpenChunksTests(TestCase):
+    def test_reads_lines_across_chunks(self):
+        fobj = compression.open_chunks([b'fi', b'rst\nsec', b'', b'ond\n', b'third'])
+
+        self.assertEqual(list(fobj), [b'first\n', b'second\n', b'third'])
+
+    def test_reads_sizes_across_chunks(self):
+        fobj = compression.open_chunks([b'abc', b'defg', b'h'])
+
+        self.assertEqual(fobj.read(2), b'ab')
+        self.assertEqual(fobj.read(4), b'cdef')
+        self.assertEqual(fobj.read(), b'gh')
+        self.assertEqual(fobj.read(), b'')
+
+
+class DictionaryTests(TestCase):
+    def test_roundtrip_with_trained_dictionary(self):
+        samples = [f'{{"to":["user{i}@test.lokole.ca"],"subject":"hello {i}"}}\n'.encode('utf-8') for i in range(500)]
+        dictionary = compression.train_dictionary(samples, 2048)
+
+        compressed = compression.compress_chunks(samples, 'zstd', dictionary=dictionary)
+        decompressed = compression.decompress_chunks(compressed, 'zstd', dictionary=dictionary)
+
+        self.assertEqual(b''.join(decompressed), b''.join(samples))
+        self.assertTrue(compression.get_dictionary_id(dictionary).isdigit())
+
+    def test_rejects_training_with_too_few_samples(self):
+        with self.assertRaises(ValueError):
+            compression.train_dictionary([b'foo', b'bar'], 2048)
+
+    def test_rejects_dictionary_for_other_formats(self):
+        with self.assertRaises(ValueError):
+            list(compression.compress_chunks([b'foo'], 'gz', dictionary=b'bar'))
@@ -0,0 +1,115 @@
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event
+from threading import current_thread
+from threading import get_ident
+from time import sleep
+from unittest import TestCase
+from unittest.mock import Mock
+
+from opwen_email_server.utils import concurrency
+
+
+class MapOrderedTests(TestCase):
+    def test_keeps_order(self):
+        def slow_for_small_numbers(number):
+            sleep(0.01 * (10 - number))
+            return number * 2
+
+        results = concurrency.map_ordered(slow_for_small_numbers, range(10), max_workers=4)
+
+        self.assertSequenceEqual(list(results), [number * 2 for number in range(10)])
+
+    def test_runs_serially_with_single_worker(self):
+        results = concurrency.map_ordered(lambda _: get_ident(), range(3), max_workers=1)
+
+        self.assertSequenceEqual(list(results), [get_ident()] * 3)
+
+    def test_uses_given_executor(self):
+        with ThreadPoolExecutor(max_workers=2, thread_name_prefix='shared') as executor:
+            results = concurrency.map_ordered(lambda _: current_thread().name, range(5), 2, executor)
+
+            self.assertTrue(all(name.startswith('shared') for name in results))
+
+    def test_propagates_errors(self):
+        def throw(number):
+            if number == 2:
+                raise ValueError()
+            return number
+
+        with self.assertRaises(ValueError):
+            list(concurrency.map_ordered(throw, range(5), max_workers=2))
+
+
+class PeriodicRefreshTests(TestCase):
+    def test_refreshes_on_start_and_in_background(self):
+        refreshed = Event()
+        calls = []
+
+        def refresh():
+            calls.append(1)
+            if len(calls) > 1:
+                refreshed.set()
+
+        periodic = concurrency.PeriodicRefresh(refresh, interval_seconds=0.01)
+        periodic.ensure_started()
+        periodic.ensure_started()
+
+        self.assertTrue(refreshed.wait(5))
+        periodic.stop()
+
+    def test_survives_failing_refresh(self):
+        periodic = concurrency.PeriodicRefresh(Mock(side_effect=ValueError()), interval_seconds=3600)
+
+        periodic.ensure_started()
+        periodic.stop()
+
+    def test_disabled(self):
+        refresh = Mock()
+        periodic = concurrency.PeriodicRefresh(refresh, interval_seconds=0)
+
+        periodic.ensure_started()
+
+        self.assertFalse(periodic.enabled)
+        self.assertFalse(refresh.called)
+
+
+class BatcherTests(TestCase):
+    def test_flushes_full_batches(self):
+        batches = []
+
+        with concurrency.Batcher(batches.append, max_size=2, max_wait_seconds=3600) as batcher:
+            for item in range(5):
+                batcher.add(item)
+
+            self.assertEqual(batches, [[0, 1], [2, 3]])
+
+        self.assertEqual(batches, [[0, 1], [2, 3], [4]])
+
+    def test_flushes_after_window(self):
+        batches = []
+        batcher = concurrency.Batcher(batches.append, max_size=100, max_wait_seconds=0.01)
+
+        batcher.add(1)
+        sleep(0.02)
+        batcher.add(2)
+        batcher.add(3)
+
+        self.assertEqual(batches, [[1, 2]])
+
+    def test_flushes_on_error(self):
+        batches = []
+
+        with self.assertRaises(ValueError):
+            with concurrency.Batcher(batches.append, max_size=100, max_wait_seconds=3600) as batcher:
+                batcher.add(1)
+                raise ValueError()
+
+        self.assertEqual(batches, [[1]])
+
+    def test_does_not_flush_empty_batches(self):
+        flush = Mock()
+
+        with concurrency.Batcher(flush, max_size=100, max_wait_seconds=3600):
+            pass
+
+        self.assertFalse(flush.called)
@@ -1,14 +1,29 @@
+from concurrent.futures import ProcessPoolExecutor
+from email.mime.application import MIMEApplication
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
 from enum import Enum
 from enum import unique
+from gzip import compress
+from http.server import BaseHTTPRequestHandler
+from http.server import HTTPServer
+from io import BytesIO
 from os.path import abspath
 from os.path import dirname
 from os.path import join
+from re import sub
+from threading import Event
+from threading import Thread
+from time import monotonic
+from time import sleep
 from unittest import TestCase
 from unittest.mock import patch
 
+from PIL import Image
 from responses import mock
 
 from opwen_email_server.utils import email_parser
+from opwen_email_server.utils.cache import MemoryBytesCache
 
 TEST_DATA_DIRECTORY = abspath(
     join(dirname(__file__), '..', '..', 'files', 'opwen_email_server', 'utils', 'test_email_parser'))
@@ -26,6 +41,13 @@ def _given_test_image(size: ImageSize) -> bytes:
         return fobj.read()
 
 
+def _given_generated_image(size, image_format, mode='RGB') -> bytes:
+    image = Image.linear_gradient('L').resize(size).convert(mode)
+    image_bytes = BytesIO()
+    image.save(image_bytes, image_format)
+    return image_bytes.getvalue()
+
+
 class ParseMimeEmailTests(TestCase):
     def test_parses_email_metadata(self):
         mime_email = self._given_mime_email('email-html.mime')
@@ -88,6 +110,75 @@ class MimeEmailParserTests(ParseMimeEmailTests):
     _parse = email_parser.MimeEmailParser()
 
 
+class ParseMimeEmailStreamTests(ParseMimeEmailTests):
+    def test_matches_parse_mime_email(self):
+        for filename in ('email-attachment.mime', 'email-ccbcc.mime', 'email-cid.mime', 'email-html.mime'):
+            mime_email = self._given_mime_email(filename)
+
+            email = self._parse(mime_email)
+
+            self.assertEqual(email, email_parser.parse_mime_email(mime_email))
+
+    def test_decodes_transfer_encodings(self):
+        mime_email = self._given_multipart_email()
+
+        email = self._parse(mime_email)
+        attachments = email.get('attachments', [])
+
+        self.assertEqual(email.get('body'), '<b>body</b>\n')
+        self.assertEqual(attachments[0], {'filename': 'data.bin', 'content': b'\x00\x01' * 1000})
+        self.assertEqual(attachments[1], {'filename': 'note.txt', 'content': b'caf\xc3\xa9 = ' + b'a' * 80})
+        self.assertEqual(len(attachments), 2)
+
+    def test_stores_large_attachments(self):
+        mime_email = self._given_multipart_email()
+        stored = []
+
+        def store_attachment(attachment, fobj):
+            stored.append(fobj.read())
+            return dict(attachment, sha256='123')
+
+        email = email_parser.parse_mime_email_stream([mime_email.encode('utf-8')], 1024, store_attachment)
+        attachments = email.get('attachments', [])
+
+        self.assertEqual(attachments[0], {'filename': 'data.bin', 'sha256': '123'})
+        self.assertEqual(attachments[1].get('filename'), 'note.txt')
+        self.assertIn('content', attachments[1])
+        self.assertEqual(stored, [b'\x00\x01' * 1000])
+
+    @classmethod
+    def _given_multipart_email(cls):
+        message = MIMEMultipart('mixed')
+        message['From'] = 'sender@test.com'
+        message['To'] = 'recipient@test.com'
+        body = MIMEMultipart('alternative')
+        body.attach(MIMEText('body\n', 'plain'))
+        body.attach(MIMEText('<b>body</b>\n', 'html'))
+        message.attach(body)
+        data = MIMEApplication(b'\x00\x01' * 1000)
+        data.add_header('Content-Disposition', 'attachment', filename='data.bin')
+        message.attach(data)
+        note = MIMEText('caf\u00e9 = ' + 'a' * 80, 'plain', 'utf-8')
+        del note['Content-Transfer-Encoding']
+        note['Content-Transfer-Encoding'] = 'quoted-printable'
+        note.set_payload('caf=C3=A9 =3D ' + 'a' * 60 + '=\n' + 'a' * 20)
+        note.add_header('Content-Disposition', 'attachment', filename='note.txt')
+        message.attach(note)
+        return message.as_string()
+
+    @classmethod
+    def _parse(cls, mime_email):
+        content = mime_email.encode('utf-8')
+        chunks = (content[i:i + 7] for i in range(0, len(content), 7))
+        return email_parser.parse_mime_email_stream(chunks, spool_bytes=1024)
+
+
+class MimeEmailStreamParserTests(ParseMimeEmailTests):
+    @classmethod
+    def _parse(cls, mime_email):
+        return email_parser.MimeEmailStreamParser(spool_bytes=1024)([mime_email.encode('utf-8')])
+
+
 class GetDomainsTests(TestCase):
     def test_gets_domains(self):
         email = {'to': ['foo@bar.com', 'baz@bar.com', 'foo@com']}
@@ -127,6 +218,44 @@ class ResizeImageTests(TestCase):
         output_bytes = email_parser._change_image_size(input_bytes)
         self.assertEqual(input_bytes, output_bytes, self.error_message)
 
+    def test_change_image_size_reduces_large_images(self):
+        for image_format in ('JPEG', 'PNG'):
+            input_bytes = _given_generated_image((2400, 1600), image_format)
+
+            output_bytes = email_parser._change_image_size(input_bytes)
+            output_image = Image.open(BytesIO(output_bytes))
+
+            self.assertEqual(output_image.format, image_format)
+            self.assertEqual(output_image.size, (200, 133))
+
+    def test_change_image_size_reduces_large_images_without_reduce_support(self):
+        for mode, image_format in (('P', 'PNG'), ('P', 'GIF'), ('1', 'PNG')):
+            input_bytes = _given_generated_image((2400, 1600), image_format, mode)
+
+            output_bytes = email_parser._change_image_size(input_bytes)
+            output_image = Image.open(BytesIO(output_bytes))
+
+            self.assertEqual(output_image.format, image_format)
+            self.assertEqual(output_image.mode, mode)
+            self.assertEqual(output_image.size, (200, 133))
+
+    def test_reduce_image_keeps_reducing_gap(self):
+        image = Image.open(BytesIO(_given_generated_image((2400, 1600), 'PNG')))
+
+        reduced = email_parser._reduce_image(image, (200, 200))
+
+        self.assertEqual(reduced.size, (600, 400))
+
+    def test_change_image_size_in_process_pool(self):
+        input_bytes = _given_generated_image((2400, 1600), 'JPEG')
+
+        with ProcessPoolExecutor(max_workers=1) as pool:
+            with patch.object(email_parser, '_get_resize_pool', return_value=pool):
+                with patch.object(email_parser, 'IMAGE_RESIZE_POOL_MIN_BYTES', 0):
+                    output_bytes = email_parser._change_image_size(input_bytes)
+
+        self.assertEqual(output_bytes, email_parser._resize_image(input_bytes))
+
 
 class ConvertImgUrlToBase64Tests(TestCase):
     @mock.activate
@@ -138,6 +267,21 @@ class ConvertImgUrlToBase64Tests(TestCase):
 
         self.assertStartsWith(output_email['body'], '<div><h3>test image</h3><img src="data:image/png;')
 
+    @mock.activate
+    def test_format_inline_images_with_compressed_response(self):
+        with open(join(TEST_DATA_DIRECTORY, 'test_image.png'), 'rb') as image:
+            image_bytes = image.read()
+        mock.add(mock.GET,
+                 'http://test-url.png',
+                 body=compress(image_bytes),
+                 headers={'Content-Encoding': 'gzip'},
+                 content_type='image/png')
+        input_email = {'body': '<img src="http://test-url.png"/>'}
+
+        output_email = email_parser.format_inline_images(input_email, self.fail_if_called)
+
+        self.assertStartsWith(output_email['body'], '<img src="data:image/png;')
+
     @mock.activate
     @patch.object(email_parser, 'Image')
     def test_handles_exceptions_when_processing_image(self, mock_pil):
@@ -190,6 +334,173 @@ class ConvertImgUrlToBase64Tests(TestCase):
 
         self.assertHasCount(output_email['body'], 'src="data:', 2)
 
+    @mock.activate
+    def test_format_inline_images_fetches_duplicate_urls_once(self):
+        self.givenTestImage()
+        input_email = {'body': '<div><img src="http://test-url.png"/><img src="http://test-url.png"/></div>'}
+
+        email_parser.format_inline_images(input_email, self.fail_if_called)
+
+        self.assertEqual(len(mock.calls), 1)
+
+    @mock.activate
+    @patch.object(email_parser, 'INLINE_IMAGE_MAX_BYTES', 10)
+    def test_format_inline_images_with_too_large_image(self):
+        self.givenTestImage()
+        handled_errors = []
+        input_email = {'body': '<div><img src="http://test-url.png"/></div>'}
+
+        output_email = email_parser.format_inline_images(input_email, lambda *args: handled_errors.append(args))
+
+        self.assertEqual(output_email, input_email)
+        self.assertEqual(len(handled_errors), 1)
+
+    @mock.activate
+    @patch.object(email_parser, 'INLINE_IMAGES_TIMEOUT_SECONDS', 0.1)
+    def test_format_inline_images_with_total_timeout(self):
+        self.givenTestImage(delay_seconds=1)
+        handled_errors = []
+        input_email = {'body': '<div><img src="http://test-url.png"/></div>'}
+
+        output_email = email_parser.format_inline_images(input_email, lambda *args: handled_errors.append(args))
+
+        self.assertEqual(output_email, input_email)
+        self.assertEqual(handled_errors, [('Timed out inlining image %s', 'http://test-url.png')])
+
+    @mock.activate
+    @patch.object(email_parser, 'INLINE_IMAGES_MAX_WORKERS_PER_DOMAIN', 1)
+    def test_format_inline_images_limits_concurrency_per_domain(self):
+        active = []
+        max_active = []
+
+        def track_concurrency(request):
+            active.append(request.url)
+            max_active.append(len(active))
+            sleep(0.05)
+            active.pop()
+            return 404, {}, b''
+
+        for i in range(4):
+            mock.add_callback(mock.GET, f'http://test-url.png/{i}', callback=track_concurrency)
+        input_email = {'body': ''.join(f'<img src="http://test-url.png/{i}"/>' for i in range(4))}
+
+        email_parser.format_inline_images(input_email, self.fail_if_called)
+
+        self.assertEqual(len(max_active), 4)
+        self.assertEqual(max(max_active), 1)
+
+    @mock.activate
+    @patch.object(email_parser, 'INLINE_IMAGES_MAX_WORKERS_PER_DOMAIN', 1)
+    def test_format_inline_images_limits_concurrency_per_domain_across_emails(self):
+        active = []
+        max_active = []
+
+        def track_concurrency(request):
+            active.append(request.url)
+            max_active.append(len(active))
+            sleep(0.05)
+            active.pop()
+            return 404, {}, b''
+
+        for i in range(4):
+            mock.add_callback(mock.GET, f'http://test-url.png/{i}', callback=track_concurrency)
+        input_emails = [{'body': f'<img src="http://test-url.png/{i}"/>'} for i in range(4)]
+
+        threads = [
+            Thread(target=email_parser.format_inline_images, args=(email, self.fail_if_called))
+            for email in input_emails
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(max_active), 4)
+        self.assertEqual(max(max_active), 1)
+
+    @mock.activate
+    def test_format_inline_images_reuses_download_pool(self):
+        self.givenTestImage()
+        input_email = {'body': '<img src="http://test-url.png"/>'}
+
+        executors = []
+        get_image_executor = email_parser._get_image_executor
+
+        def track_executor():
+            executors.append(get_image_executor())
+            return executors[-1]
+
+        with patch.object(email_parser, '_get_image_executor', side_effect=track_executor):
+            email_parser.format_inline_images(input_email, self.fail_if_called)
+            email_parser.format_inline_images(input_email, self.fail_if_called)
+
+        self.assertEqual(len(executors), 2)
+        self.assertIs(executors[0], executors[1])
+
+    @patch.object(email_parser, 'INLINE_IMAGES_TIMEOUT_SECONDS', 0.2)
+    def test_format_inline_images_closes_slow_downloads_on_timeout(self):
+        disconnected = Event()
+
+        class SlowImageHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                self.send_response(200)
+                self.send_header('Content-Type', 'image/png')
+                self.send_header('Content-Length', str(400 * 512))
+                self.end_headers()
+                try:
+                    for _ in range(400):
+                        self.wfile.write(b'x' * 512)
+                        self.wfile.flush()
+                        sleep(0.01)
+                except OSError:
+                    disconnected.set()
+
+            def log_message(self, *args):
+                pass
+
+        server = HTTPServer(('127.0.0.1', 0), SlowImageHandler)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        Thread(target=server.serve_forever, kwargs={'poll_interval': 0.01}, daemon=True).start()
+        image_url = f'http://127.0.0.1:{server.server_port}/image.png'
+        handled_errors = []
+        input_email = {'body': f'<img src="{image_url}"/>'}
+
+        started = monotonic()
+        output_email = email_parser.format_inline_images(input_email, lambda *args: handled_errors.append(args))
+
+        self.assertLess(monotonic() - started, 1)
+        self.assertEqual(output_email, input_email)
+        self.assertEqual(handled_errors, [('Timed out inlining image %s', image_url)])
+        self.assertTrue(disconnected.wait(2))
+
+    @mock.activate
+    def test_format_inline_images_only_rewrites_img_src(self):
+        self.givenTestImage()
+        input_email = {
+            'body': ('<!DOCTYPE html>\r\n<HTML><body>\n'
+                     '<!-- <img src="http://test-url.png"> -->\n'
+                     '<p class=x>caf&eacute;<br></p>\n'
+                     '<IMG alt="src=no" SRC=\'http://test-url.png\' width=10>\n'
+                     '<script>var s = "<img src=\'http://test-url.png\'>";</script>\n'
+                     '</body></HTML>')
+        }
+
+        output_email = email_parser.format_inline_images(input_email, self.fail_if_called)
+
+        self.assertHasCount(output_email['body'], 'data:', 1)
+        self.assertIn('<IMG alt="src=no" SRC="data:image/png;base64,', output_email['body'])
+        self.assertEqual(sub('"data:[^"]*"', "'http://test-url.png'", output_email['body']), input_email['body'])
+
+    @mock.activate
+    def test_format_inline_images_without_changes_returns_email(self):
+        self.givenTestImage(status=404)
+        input_email = {'body': '<div><img src="http://test-url.png"></div>'}
+
+        output_email = email_parser.format_inline_images(input_email, self.fail_if_called)
+
+        self.assertIs(output_email, input_email)
+
     def test_format_inline_images_without_img_tags(self):
         input_email = {'body': '<div></div>'}
 
@@ -215,15 +526,96 @@ class ConvertImgUrlToBase64Tests(TestCase):
                          f'times but got {actual_count}')
 
     @classmethod
-    def givenTestImage(cls, content_type='image/png', status=200):
+    def givenTestImage(cls, content_type='image/png', status=200, delay_seconds=0):
         with open(join(TEST_DATA_DIRECTORY, 'test_image.png'), 'rb') as image:
             image_bytes = image.read()
 
-        mock.add(mock.GET,
-                 'http://test-url.png',
-                 headers={'Content-Type': content_type},
-                 body=image_bytes,
-                 status=status)
+        def respond(request):
+            sleep(delay_seconds)
+            return status, {'Content-Type': content_type}, image_bytes
+
+        mock.add_callback(mock.GET, 'http://test-url.png', callback=respond)
+
+    def fail_if_called(self, message, *args):
+        self.fail(message % args)
+
+
+class InlineImageCacheTests(TestCase):
+    def setUp(self):
+        self.cache = email_parser.InlineImageCache(MemoryBytesCache(max_bytes=1024 * 1024))
+        self.requests = []
+        with open(join(TEST_DATA_DIRECTORY, 'test_image.png'), 'rb') as image:
+            self.image_bytes = image.read()
+
+    @mock.activate
+    def test_skips_requests_for_fresh_images(self):
+        self.givenImage('http://test-url.png', {'Cache-Control': 'max-age=60'})
+
+        first = self._format('http://test-url.png')
+        second = self._format('http://test-url.png')
+
+        self.assertEqual(first, second)
+        self.assertEqual(len(self.requests), 1)
+
+    @mock.activate
+    def test_revalidates_with_etag(self):
+        self.givenImage('http://test-url.png', {'ETag': '"v1"'})
+
+        with patch.object(email_parser, '_change_image_size', wraps=email_parser._change_image_size) as resize:
+            first = self._format('http://test-url.png')
+            second = self._format('http://test-url.png')
+
+        self.assertEqual(first, second)
+        self.assertEqual([request.headers.get('If-None-Match') for request in self.requests], [None, '"v1"'])
+        self.assertEqual(resize.call_count, 1)
+
+    @mock.activate
+    def test_revalidates_with_last_modified(self):
+        last_modified = 'Wed, 21 Oct 2015 07:28:00 GMT'
+        self.givenImage('http://test-url.png', {'Last-Modified': last_modified})
+
+        self._format('http://test-url.png')
+        self._format('http://test-url.png')
+
+        self.assertEqual(self.requests[1].headers.get('If-Modified-Since'), last_modified)
+
+    @mock.activate
+    def test_refetches_when_image_was_evicted(self):
+        self.givenImage('http://test-url.png', {'ETag': '"v1"'})
+
+        first = self._format('http://test-url.png')
+        self.cache._cache.delete(next(key for key in self.cache._cache._entries if key.startswith('image:')))
+        second = self._format('http://test-url.png')
+
+        self.assertEqual(first, second)
+        self.assertEqual([request.headers.get('If-None-Match') for request in self.requests], [None, '"v1"', None])
+
+    @mock.activate
+    def test_resizes_identical_content_once(self):
+        self.givenImage('http://test-url.png/1', {})
+        self.givenImage('http://test-url.png/2', {})
+
+        with patch.object(email_parser, '_change_image_size', wraps=email_parser._change_image_size) as resize:
+            first = self._format('http://test-url.png/1')
+            second = self._format('http://test-url.png/2')
+
+        self.assertEqual(first, second)
+        self.assertEqual(len(self.requests), 2)
+        self.assertEqual(resize.call_count, 1)
+
+    def givenImage(self, url, headers):
+        def respond(request):
+            self.requests.append(request)
+            etag = headers.get('ETag')
+            if etag and request.headers.get('If-None-Match') == etag:
+                return 304, headers, b''
+            return 200, dict(headers, **{'Content-Type': 'image/png'}), self.image_bytes
+
+        mock.add_callback(mock.GET, url, callback=respond)
+
+    def _format(self, url):
+        email = email_parser.format_inline_images({'body': f'<img src="{url}"/>'}, self.fail_if_called, self.cache)
+        return email['body']
 
     def fail_if_called(self, message, *args):
         self.fail(message % args)
@@ -253,3 +645,24 @@ class FormatAttachedFilesTests(TestCase):
 
         self.assertNotEqual(input_content, output_content)
         self.assertEqual(input_filename, output_filename)
+
+    def test_format_attachments_only_copies_changed_attachments(self):
+        image = {'filename': 'test_image.png', 'content': _given_test_image(size=ImageSize.large), 'cid': 'a'}
+        document = {'filename': 'document.pdf', 'content': b'%PDF'}
+        input_email = {'attachments': [document, image]}
+
+        output_email = email_parser.format_attachments(input_email)
+        output_attachments = output_email['attachments']
+
+        self.assertIsNot(output_email, input_email)
+        self.assertIs(output_attachments[0], document)
+        self.assertIsNot(output_attachments[1], image)
+        self.assertEqual(output_attachments[1]['cid'], 'a')
+        self.assertEqual(image['content'], _given_test_image(size=ImageSize.large))
+
+    def test_format_attachments_without_changes_returns_email(self):
+        input_email = {'attachments': [{'filename': 'document.pdf', 'content': b'%PDF'}]}
+
+        output_email = email_parser.format_attachments(input_email)
+
+        self.assertIs(output_email, input_email)
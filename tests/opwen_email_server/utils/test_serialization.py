@@ -1,4 +1,9 @@
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
 from unittest import TestCase
+from unittest.mock import patch
+
+from msgpack import packb
 
 from opwen_email_server.utils import serialization
 
@@ -16,6 +21,53 @@ class JsonTests(TestCase):
         self.assertEqual(obj, serialization.from_json(serialization.to_json(obj)))
 
 
+class JsonBackendTests(TestCase):
+    def test_roundtrips_with_every_backend(self):
+        original = {'a': 1, 'b': '你好', 'c': [None, True, 1.5], 'd': {'e': ''}}
+
+        for backend in serialization.JSON_BACKENDS:
+            with self.subTest(backend=backend), self._given_backend(backend):
+                serialized = serialization.to_jsonl_bytes(original)
+                deserialized = serialization.from_jsonl_bytes(serialized)
+
+                self.assertEqual(original, deserialized)
+                self.assertTrue(serialized.endswith(b'\n'))
+                self.assertNotIn(b'\n', serialized[:-1])
+
+    def test_backends_are_interoperable(self):
+        original = {'a': 1, 'b': '你好\n"'}
+
+        for dump_backend in serialization.JSON_BACKENDS:
+            for load_backend in serialization.JSON_BACKENDS:
+                with self.subTest(dump_backend=dump_backend, load_backend=load_backend):
+                    with self._given_backend(dump_backend):
+                        serialized = serialization.to_jsonl_bytes(original)
+                    with self._given_backend(load_backend):
+                        deserialized = serialization.from_jsonl_bytes(serialized)
+
+                    self.assertEqual(original, deserialized)
+
+    def test_serializes_non_string_keys_with_every_backend(self):
+        for backend in serialization.JSON_BACKENDS:
+            with self.subTest(backend=backend), self._given_backend(backend):
+                serialized = serialization.to_jsonl_bytes({1: 'a'})
+
+                self.assertEqual(serialization.from_jsonl_bytes(serialized), {'1': 'a'})
+
+    def test_handles_invalid_lines_with_every_backend(self):
+        for backend in serialization.JSON_BACKENDS:
+            with self.subTest(backend=backend), self._given_backend(backend):
+                self.assertIsNone(serialization.from_jsonl_bytes(b'\xff\xfef\x00o\x00o\x00'))
+                self.assertIsNone(serialization.from_jsonl_bytes(b'{"corrupted":1,]}\n'))
+                self.assertIsNone(serialization.from_jsonl_bytes(b''))
+                self.assertEqual(serialization.from_jsonl_bytes(b'{"a":1},\n'), {'a': 1})
+
+    @classmethod
+    def _given_backend(cls, backend: str):
+        dump, load = serialization._JSON_BACKENDS[backend]
+        return patch.multiple(serialization, _dump_json=dump, _load_json=load)
+
+
 class Base64Tests(TestCase):
     def test_roundtrip(self):
         original = b'some bytes'
@@ -33,6 +85,120 @@ class MsgpackTests(TestCase):
 
         self.assertEqual(original, deserialized)
 
+    def test_roundtrips_objects_ending_in_newline_bytes(self):
+        originals = [{'a': 10}, {'b': b'content\n\n'}, {'c': [10, 10]}]
+
+        for original in originals:
+            with self.subTest(original=original):
+                serialized = serialization.to_msgpack_bytes(original)
+                deserialized = serialization.from_msgpack_bytes(serialized)
+
+                self.assertEqual(original, deserialized)
+
+    def test_is_compatible_with_legacy_serialization(self):
+        original = {'a': 1, 'b': b'\x00\n', 'c': ['你好']}
+        legacy = packb(original, use_bin_type=True) + b'\n'
+
+        self.assertEqual(serialization.to_msgpack_bytes(original), legacy)
+        self.assertEqual(serialization.from_msgpack_bytes(legacy), original)
+
+    def test_parses_objects_without_trailer(self):
+        original = {'a': 10}
+
+        deserialized = serialization.from_msgpack_bytes(packb(original, use_bin_type=True))
+
+        self.assertEqual(original, deserialized)
+
+    def test_parses_memoryviews(self):
+        original = {'a': b'content'}
+        serialized = memoryview(serialization.to_msgpack_bytes(original))
+
+        self.assertEqual(serialization.from_msgpack_bytes(serialized), original)
+
+    def test_fails_on_extra_data(self):
+        serialized = serialization.to_msgpack_bytes({'a': 1}) + b'\x01'
+
+        with self.assertRaises(ValueError):
+            serialization.from_msgpack_bytes(serialized)
+
+    def test_recovers_after_unserializable_object(self):
+        with self.assertRaises(TypeError):
+            serialization.to_msgpack_bytes({'a': object()})
+
+        self.assertEqual(serialization.to_msgpack_bytes({'a': 1}), packb({'a': 1}) + b'\n')
+
+    @patch.object(serialization, '_PACKER_MAX_BUFFER_BYTES', 100)
+    def test_releases_large_packer_buffers(self):
+        serialization.to_msgpack_bytes({'a': 1})
+        small_packer = serialization._get_packer()
+
+        serialization.to_msgpack_bytes({'a': 1})
+        self.assertIs(serialization._get_packer(), small_packer)
+
+        self.assertEqual(serialization.to_msgpack_bytes({'a': bytes(200)}), packb({'a': bytes(200)}) + b'\n')
+        self.assertIsNot(serialization._get_packer(), small_packer)
+
+    def test_serializes_concurrently(self):
+        originals = [{'index': index, 'content': bytes(index)} for index in range(200)]
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            serialized = list(executor.map(serialization.to_msgpack_bytes, originals))
+
+        self.assertEqual([serialization.from_msgpack_bytes(item) for item in serialized], originals)
+
+    def test_iterates_objects_from_chunks(self):
+        originals = [{'a': 10}, {'b': b'\n' * 100}, {'c': '你好'}]
+        serialized = b''.join(serialization.to_msgpack_bytes(original) for original in originals)
+        serialized += packb({'d': 10}, use_bin_type=True)
+
+        for chunk_size in (1, 3, len(serialized)):
+            with self.subTest(chunk_size=chunk_size):
+                chunks = (serialized[i:i + chunk_size] for i in range(0, len(serialized), chunk_size))
+
+                deserialized = list(serialization.iter_msgpack_objects(chunks))
+
+                self.assertEqual(deserialized, originals + [{'d': 10}])
+
+
+class MsgpackFrameTests(TestCase):
+    def test_roundtrip(self):
+        originals = [{'a': 1, 'b': b'binary\ncontent\n'}, {'c': '你好'}]
+        serialized = b''.join(serialization.to_msgpack_frame(original) for original in originals)
+
+        frames = serialization.read_frames(BytesIO(serialized))
+        deserialized = [serialization.from_msgpack_frame(frame) for frame in frames]
+
+        self.assertEqual(originals, deserialized)
+
+    def test_stores_binary_without_base64(self):
+        content = bytes(range(256)) * 4
+
+        serialized = serialization.to_msgpack_frame({'content': content})
+
+        self.assertLess(len(serialized), len(serialization.to_base64(content)))
+
+    @patch.object(serialization, '_PACKER_MAX_BUFFER_BYTES', 100)
+    def test_releases_large_packer_buffers(self):
+        serialization.to_msgpack_frame({'a': 1})
+        small_packer = serialization._get_packer()
+
+        serialized = serialization.to_msgpack_frame({'a': bytes(200)})
+
+        self.assertIsNot(serialization._get_packer(), small_packer)
+        self.assertEqual(list(serialization.read_frames(BytesIO(serialized))), [packb({'a': bytes(200)})])
+
+    def test_fails_on_truncated_frame(self):
+        serialized = serialization.to_msgpack_frame({'a': 1})
+
+        with self.assertRaises(ValueError):
+            list(serialization.read_frames(BytesIO(serialized[:-1])))
+
+    def test_fails_on_truncated_header(self):
+        serialized = serialization.to_msgpack_frame({'a': 1})
+
+        with self.assertRaises(ValueError):
+            list(serialization.read_frames(BytesIO(serialized[:2])))
+
 
 class JsonlTests(TestCase):
     def test_roundtrip(self):
@@ -61,6 +227,15 @@ class JsonlTests(TestCase):
 
         self.assertEqual([None, {"a": 1}, {"b": 2}, None], deserialized)
 
+    def test_parses_lines_without_trailing_comma_in_place(self):
+        line = b'{"a":1}\n'
+
+        with patch.object(serialization, '_load_json', wraps=serialization._load_json) as load_json:
+            deserialized = serialization.from_jsonl_bytes(line)
+
+        self.assertEqual(deserialized, {'a': 1})
+        self.assertIs(load_json.call_args[0][0], line)
+
     def test_handles_non_utf8(self):
         deserialized = serialization.from_jsonl_bytes(b'\xff\xfef\x00o\x00o\x00')
 
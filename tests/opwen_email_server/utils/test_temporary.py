@@ -1,3 +1,4 @@
+from io import BytesIO
 from os import remove
 from os.path import isfile
 from tempfile import NamedTemporaryFile
@@ -68,3 +69,17 @@ class RemovingTests(TestCase):
     def assertFileDoesNotExist(self, filename):
         if isfile(filename):
             self.fail(f'file {filename} does exists')
+
+
+class SpoolChunksTests(TestCase):
+    def test_keeps_small_payloads_in_memory(self):
+        with temporary.spool_chunks([b'foo', b'bar'], max_size=10) as fobj:
+            self.assertIsInstance(fobj, BytesIO)
+            self.assertEqual(fobj.read(), b'foobar')
+
+    def test_spools_large_payloads_to_disk(self):
+        with temporary.spool_chunks([b'foo', b'bar', b'baz'], max_size=5) as fobj:
+            self.assertNotIsInstance(fobj, BytesIO)
+            self.assertEqual(next(fobj), b'foobarbaz')
+
+        self.assertTrue(fobj.closed)
@@ -1,5 +1,8 @@
+from hashlib import sha256
 from unittest import TestCase
 
+from msgpack import packb
+
 from opwen_email_server.utils import unique
 
 
@@ -13,6 +16,46 @@ class NewEmailIdTests(TestCase):
         self.assertNotEqual(id2, id3)
         self.assertEqual(id1, id3)
 
+    def test_is_compatible_with_legacy_ids(self):
+        large_map = {str(index): index for index in range(70000)}
+        emails = [
+            {},
+            {'from': 'foo', 'to': ['bar', 'baz'], 'attachments': [{'filename': 'a.txt', 'content': b'a\n'}]},
+            {'sent_at': None, 'read': True, 'size': -1, 'score': 1.5, 'big': 2**40, 'cc': ()},
+            {'content': bytearray(b'abc'), 'view': memoryview(b'xyz'), '你好': '世界'},
+            large_map,
+            {'list': list(range(70000)), 'tuple': tuple(range(16)), 'small': list(range(15))},
+        ]
+        for size in (0, 15, 16, 31, 32, 255, 256, 65535, 65536):
+            emails.append({'str': 'x' * size, 'bin': b'x' * size, 'map': {str(i): i for i in range(size % 100)}})
+
+        for email in emails:
+            with self.subTest(keys=list(email)[:3]):
+                legacy = sha256(packb(email, use_bin_type=True) + b'\n').hexdigest()
+
+                self.assertEqual(unique.new_email_id(email), legacy)
+
+    def test_fails_on_unserializable_values(self):
+        with self.assertRaises(TypeError):
+            unique.new_email_id({'from': object()})
+
+
+class NewCanonicalEmailIdTests(TestCase):
+    def test_ignores_key_order(self):
+        id1 = unique.new_canonical_email_id({'from': 'foo', 'to': ['bar'], 'nested': {'a': 1, 'b': 2}})
+        id2 = unique.new_canonical_email_id({'nested': {'b': 2, 'a': 1}, 'to': ['bar'], 'from': 'foo'})
+
+        self.assertEqual(id1, id2)
+
+    def test_unique(self):
+        id1 = unique.new_canonical_email_id({'from': 'foo', 'attachments': [{'content': b'a'}]})
+        id2 = unique.new_canonical_email_id({'from': 'foo', 'attachments': [{'content': b'b'}]})
+        id3 = unique.new_canonical_email_id({'from': 'foo', 'to': ['bar']})
+
+        self.assertNotEqual(id1, id2)
+        self.assertNotEqual(id1, id3)
+        self.assertNotEqual(id2, id3)
+
 
 class NewClientIdTests(TestCase):
     def test_unique(self):